@@ -0,0 +1,188 @@
+"""Measures the cold start of the api: the time to import `covid_local_api.endpoints`
+and the time from starting a uvicorn process to the first served request.
+
+Runs without network access like `bench_suite.py` (fixture sheets and the fake
+upstream). Every run starts fresh processes, so that nothing is cached between runs
+(except by the operating system).
+
+Usage: python bench_cold_start.py [--runs 5] [--importtime 15]
+    [--output results.json] [--baseline previous-results.json]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import fixtures
+from fake_upstream import FakeUpstream, upstream_env
+
+N_TOWNS = 2000
+API_ROWS = 1000
+
+# Seconds to wait for the first request to be served.
+START_TIMEOUT = 120
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import covid_local_api.endpoints
+print(time.perf_counter() - start)
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env):
+    """Returns the seconds to import the api in a new process"""
+    process = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return float(process.stdout.decode().strip().splitlines()[-1])
+
+
+def measure_first_request(env, path):
+    """Starts the api with uvicorn and returns the seconds until `path` is served"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{path}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "covid_local_api.endpoints:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    try:
+        while time.perf_counter() - start < START_TIMEOUT:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=START_TIMEOUT) as response:
+                    response.read()
+                return time.perf_counter() - start
+            except (ConnectionError, urllib.error.URLError):
+                time.sleep(0.01)
+        raise RuntimeError(f"No response from {url} after {START_TIMEOUT}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def slowest_imports(env, n):
+    """Returns the `n` modules with the highest cumulative import time (in seconds)
+    that are imported directly by the api (see `python -X importtime`)"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import covid_local_api.endpoints"],
+        env=env,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    imports = []
+    for line in process.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Top-level modules and direct imports of the api are indented by <= 2.
+        if len(name) - len(name.lstrip()) <= 3:
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda item: -item[1])[:n]
+
+
+def summarize(name, values):
+    return {
+        "name": name,
+        "runs": len(values),
+        "median_s": statistics.median(values),
+        "min_s": min(values),
+        "max_s": max(values),
+    }
+
+
+def print_results(results, baseline=None):
+    baseline = {result["name"]: result for result in baseline or []}
+    print(f"{'benchmark':40} {'median s':>9} {'min s':>9} {'max s':>9}")
+    for result in results:
+        line = (
+            f"{result['name']:40} {result['median_s']:9.3f} "
+            f"{result['min_s']:9.3f} {result['max_s']:9.3f}"
+        )
+        previous = baseline.get(result["name"])
+        if previous:
+            line += f"  (median {result['median_s'] / previous['median_s'] - 1:+.0%})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--importtime", type=int, default=15, help="Show the N slowest imports"
+    )
+    parser.add_argument("--output", help="Save the results as json")
+    parser.add_argument("--baseline", help="Compare to results saved with --output")
+    args = parser.parse_args()
+
+    places = fixtures.make_places(N_TOWNS)
+    town = next(place for place in places.values() if place["fcl"] == "P")
+    fake_upstream = FakeUpstream(places)
+    sheets_dir = tempfile.mkdtemp(prefix="covid-local-api-bench-")
+    env = dict(
+        os.environ,
+        SHEET_SOURCE=fixtures.write_sheets(
+            fixtures.make_sheets(places, API_ROWS), sheets_dir
+        ),
+        **upstream_env(fake_upstream.start()),
+    )
+
+    imports, first_requests = [], []
+    for _ in range(args.runs):
+        imports.append(measure_import(env))
+        first_requests.append(
+            measure_first_request(env, f"/all?geonames_id={town['geonames_id']}")
+        )
+    results = [
+        summarize("import covid_local_api.endpoints", imports),
+        summarize("uvicorn start to first GET /all", first_requests),
+    ]
+
+    if args.importtime:
+        print("Slowest imports of the api (cumulative):")
+        for name, seconds in slowest_imports(env, args.importtime):
+            print(f"  {name:50} {seconds:7.3f}s")
+        print()
+
+    fake_upstream.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"argv": sys.argv[1:], "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compares ways to materialize sqlite rows as dicts.
+
+- dict_factory: the pure-Python row factory that the database used before
+- sqlite3.Row: the built-in row factory (converted to dicts for the response)
+- fetch_dicts: reads the column names once per query (used by DatabaseHandler)
+
+Reports the time for fetching all rows (best of several runs) and the overhead
+compared to fetching plain tuples.
+
+Usage: python bench_row_factory.py [number of rows]
+"""
+import sqlite3
+import sys
+import timeit
+
+from covid_local_api.db_handler import fetch_dicts
+
+COLUMNS = [
+    "country_code",
+    "lat",
+    "lon",
+    "name",
+    "street",
+    "zip_code",
+    "city",
+    "address_supplement",
+    "phone",
+    "website",
+    "operating_hours",
+    "appointment_required",
+    "description",
+    "sources",
+]
+
+
+def dict_factory(cursor, row):
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+def create_database(n_rows):
+    con = sqlite3.connect(":memory:")
+    con.execute(f"CREATE TABLE test_sites ({', '.join(COLUMNS)})")
+    row = ["DE", 52.5, 13.4, "Testzentrum", "Straße 1", 10115, "Berlin", None]
+    row += ["030 123456", None, "Mo-Fr 9-17 Uhr", 1, None, "https://www.berlin.de"]
+    con.executemany(
+        f"INSERT INTO test_sites VALUES ({', '.join('?' * len(COLUMNS))})",
+        [row] * n_rows,
+    )
+    return con
+
+
+def with_dict_factory(con):
+    con.row_factory = dict_factory
+    return con.execute("SELECT * FROM test_sites").fetchall()
+
+
+def with_sqlite_row(con):
+    con.row_factory = sqlite3.Row
+    return [dict(row) for row in con.execute("SELECT * FROM test_sites").fetchall()]
+
+
+def with_fetch_dicts(con):
+    con.row_factory = None
+    return fetch_dicts(con.execute("SELECT * FROM test_sites"))
+
+
+def with_tuples(con):
+    con.row_factory = None
+    return con.execute("SELECT * FROM test_sites").fetchall()
+
+
+def measure(func, con, repeat=5):
+    return min(timeit.repeat(lambda: func(con), number=1, repeat=repeat))
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    con = create_database(n_rows)
+    baseline = measure(with_tuples, con)
+    print(f"Rows: {n_rows}")
+    print(f"{'with_tuples':18} {baseline * 1000:8.1f} ms")
+    for func in [with_dict_factory, with_sqlite_row, with_fetch_dicts]:
+        duration = measure(func, con)
+        print(
+            f"{func.__name__:18} {duration * 1000:8.1f} ms  "
+            f"(+{(duration - baseline) / n_rows * 1e9:.0f} ns per row over tuples)"
+        )
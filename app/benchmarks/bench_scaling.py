@@ -0,0 +1,157 @@
+"""Measures how the DatabaseHandler scales with the size of the sheets: import time
+(per phase of `update_database`), memory and query latency for synthetic sheets (see
+`synthetic.py`).
+
+Each size runs in a separate process, so that memory measurements don't influence
+each other.
+
+Usage: python bench_scaling.py [--sizes 10000 100000 1000000] [--only test_sites]
+    [--duration 1] [--output results.json]
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import synthetic
+from bench_suite import measure
+
+# Number of entries of the other sheets, if only one sheet is scaled with --only.
+BASE_ROWS = 1000
+
+
+def rss_mb():
+    """Returns the current resident memory of the process in MB (Linux only)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1e6
+    except OSError:
+        return float("nan")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux (and bytes on macOS).
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def run_size(n_rows, only=None, duration=1.0):
+    """Imports synthetic sheets with `n_rows` entries into a DatabaseHandler and
+    measures import time, memory and query latencies"""
+    from covid_local_api.db_handler import DatabaseHandler
+    from covid_local_api.utils import timing
+
+    sheet_rows = None
+    if only:
+        sheet_rows = {sheet: BASE_ROWS for sheet in synthetic.SHEETS}
+        sheet_rows[only] = n_rows
+    start = time.perf_counter()
+    dfs, places = synthetic.make_sheets(n_rows, sheet_rows=sheet_rows)
+    generate_s = time.perf_counter() - start
+
+    rss_before = rss_mb()
+    spans = timing.start_spans()
+    start = time.perf_counter()
+    db = DatabaseHandler(lambda: dfs)
+    db.render_exports()
+    import_s = time.perf_counter() - start
+
+    page_count = db.con.execute("PRAGMA page_count").fetchone()[0]
+    page_size = db.con.execute("PRAGMA page_size").fetchone()[0]
+    result = {
+        "rows": n_rows,
+        "only": only,
+        "generate_s": generate_s,
+        "import_s": import_s,
+        "import_phases_s": dict(spans),
+        "sqlite_mb": page_count * page_size / 1e6,
+        "exports_mb": sum(len(data) for data in db.exports.values()) / 1e6,
+        "rss_mb": rss_mb() - rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+        "queries": [],
+    }
+
+    rng = np.random.default_rng(1)
+    sample = places.iloc[rng.integers(0, len(places), 1000)].to_dict("records")
+    queries = {
+        "get hotlines": lambda i: db.get("hotlines", [sample[i % 1000]["geonames_id"]]),
+        "get_nearby test_sites": lambda i: db.get_nearby(
+            "test_sites", sample[i % 1000]["lat"], sample[i % 1000]["lon"]
+        ),
+        "search hotlines": lambda i: db.search("hotlines", "corona hotline"),
+        "get_clusters test_sites (zoom 6)": lambda i: db.get_clusters(
+            "test_sites",
+            6,
+            sample[i % 1000]["lat"] - 2,
+            sample[i % 1000]["lon"] - 3,
+            sample[i % 1000]["lat"] + 2,
+            sample[i % 1000]["lon"] + 3,
+        ),
+    }
+    for name, func in queries.items():
+        result["queries"].append(measure(name, func, duration))
+    return result
+
+
+def print_result(result):
+    phases = ", ".join(
+        f"{name} {duration:.1f}s"
+        for name, duration in sorted(
+            result["import_phases_s"].items(), key=lambda item: -item[1]
+        )
+    )
+    print(
+        f"\n{result['rows']} rows" + (f" in {result['only']}" if result["only"] else "")
+    )
+    print(f"  import: {result['import_s']:.1f}s ({phases})")
+    print(
+        f"  memory: {result['rss_mb']:.0f} MB resident after import, "
+        f"{result['peak_rss_mb']:.0f} MB peak, sqlite {result['sqlite_mb']:.0f} MB, "
+        f"exports {result['exports_mb']:.0f} MB"
+    )
+    for query in result["queries"]:
+        print(
+            f"  {query['name']:34} {query['throughput']:10.1f}/s  "
+            f"p50 {query['p50_ms']:8.2f} ms  p99 {query['p99_ms']:8.2f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument(
+        "--only", choices=synthetic.SHEETS, help="Only scale this sheet"
+    )
+    parser.add_argument("--duration", type=float, default=1.0)
+    parser.add_argument("--output", help="Save the results as json")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        # Run a single size and write the result to stdout for the parent process.
+        print(json.dumps(run_size(args.single, args.only, args.duration)))
+        return
+
+    results = []
+    for size in args.sizes:
+        command = [sys.executable, __file__, "--single", str(size)]
+        command += ["--duration", str(args.duration)]
+        if args.only:
+            command += ["--only", args.only]
+        process = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+        result = json.loads(process.stdout.decode().strip().splitlines()[-1])
+        print_result(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Measures the CPU time to serialize a response of the /all endpoint.
+
+Compares the validated path (building a ResultsList from the database rows, like
+FastAPI does with `response_model`) to the fast path, which serializes the coerced
+database rows directly with ujson.
+
+Usage: python bench_serialization.py [number of rows per sheet]
+"""
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse, UJSONResponse
+
+from covid_local_api.schema import Place, ResultsList
+
+REPEATS = 200
+
+
+def make_content(n_rows):
+    place = Place(
+        name="Berlin Mitte",
+        geonames_id=6545310,
+        search_provider="geonames",
+        country="Germany",
+        country_code="DE",
+        lat=52.52,
+        lon=13.40,
+    )
+    hotline = {
+        "country_code": "DE",
+        "place": "Berlin",
+        "geonames_id": 2950159,
+        "name": "Corona-Hotline",
+        "operator": "Senatsverwaltung für Gesundheit",
+        "phone": "030 9028 2828",
+        "email": None,
+        "website": "https://www.berlin.de/corona",
+        "operating_hours": "täglich 8-20 Uhr",
+        "category": "general",
+        "description": "Informationen zu Quarantäne und Tests",
+        "sources": "https://www.berlin.de",
+    }
+    test_site = {
+        "country_code": "DE",
+        "lat": 52.5,
+        "lon": 13.4,
+        "name": "Testzentrum",
+        "street": "Invalidenstraße 1",
+        "zip_code": 10115,
+        "city": "Berlin",
+        "address_supplement": None,
+        "phone": "030 123456",
+        "website": None,
+        "operating_hours": "Mo-Fr 9-17 Uhr",
+        "appointment_required": True,
+        "description": None,
+        "sources": "https://www.berlin.de",
+        "distance": 0.1,
+    }
+    return {
+        "place": place.dict(),
+        "hotlines": [dict(hotline) for _ in range(n_rows)],
+        "websites": [],
+        "test_sites": [dict(test_site) for _ in range(n_rows)],
+        "health_departments": [],
+    }
+
+
+def validated(content):
+    return JSONResponse(jsonable_encoder(ResultsList(**content))).body
+
+
+def fast(content):
+    return UJSONResponse(content).body
+
+
+def measure(func, content):
+    start = time.process_time()
+    for _ in range(REPEATS):
+        func(content)
+    return (time.process_time() - start) / REPEATS * 1000
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    content = make_content(n_rows)
+    validated_ms = measure(validated, content)
+    fast_ms = measure(fast, content)
+    print(f"Rows per sheet: {n_rows}")
+    print(f"Validated (ResultsList): {validated_ms:.3f} ms CPU per request")
+    print(f"Fast path (ujson):       {fast_ms:.3f} ms CPU per request")
+    print(f"Speedup: {validated_ms / fast_ms:.1f}x")
@@ -0,0 +1,215 @@
+"""Benchmark suite for the database, the place handler, place search and the /all
+endpoint.
+
+Runs without network access: upstream requests go to a local fake of geonames,
+nominatim and wikidata (see `fake_upstream.py`) and the database is filled with
+fixture sheets (see `fixtures.py`). Reports throughput and p50/p99 latency of each
+benchmark, which can be saved and compared to a previous run to find regressions.
+
+Usage: python bench_suite.py [--sizes 1000 10000 100000] [--duration 2]
+    [--latency 0] [--output results.json] [--baseline previous-results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import fixtures
+from fake_upstream import FakeUpstream, upstream_env
+
+N_TOWNS = 2000
+
+# Rows per sheet of the database behind the api (for place search and /all).
+API_ROWS = 1000
+
+
+def percentile(sorted_values, p):
+    index = min(int(round(p / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(name, func, duration=2.0, min_calls=20):
+    """Calls `func` with the call number (0, 1, ...) for at least `duration` seconds
+    and `min_calls` calls.
+
+    Returns:
+        dict: Name, number of calls, throughput (calls per second) and latency
+            percentiles (in milliseconds)
+    """
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < min_calls or time.perf_counter() - start < duration:
+        call_start = time.perf_counter()
+        func(len(latencies))
+        latencies.append(time.perf_counter() - call_start)
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "name": name,
+        "calls": len(latencies),
+        "throughput": len(latencies) / total,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+def bench_database(places, towns, sizes, duration):
+    from covid_local_api.db_handler import DatabaseHandler
+
+    hierarchies = [
+        fixtures.get_hierarchy(places, town["geonames_id"]) for town in towns
+    ]
+    results = []
+    for size in sizes:
+        db = DatabaseHandler(lambda: fixtures.make_sheets(places, size))
+        results.append(
+            measure(
+                f"db.get hotlines ({size} rows)",
+                lambda i: db.get("hotlines", hierarchies[i % len(hierarchies)]),
+                duration,
+            )
+        )
+        results.append(
+            measure(
+                f"db.get_nearby test_sites ({size} rows)",
+                lambda i: db.get_nearby(
+                    "test_sites",
+                    towns[i % len(towns)]["lat"],
+                    towns[i % len(towns)]["lon"],
+                ),
+                duration,
+            )
+        )
+        db.delete_database()
+    return results
+
+
+def bench_place_handler(places, towns, duration):
+    from covid_local_api.place_handler import PlaceHandler
+    from covid_local_api.utils import place_request_utils
+
+    # Hierarchy of wikidata ids (child -> parent) and mapping of the geonames ids.
+    place_hierarchy = {
+        f"Q{place['geonames_id']}": f"Q{place['parent']}"
+        for place in places.values()
+        if place["parent"] is not None
+    }
+    place_mapping = {f"GN:{geonames_id}": [f"Q{geonames_id}"] for geonames_id in places}
+    local_handler = PlaceHandler(place_mapping, place_hierarchy)
+    upstream_handler = PlaceHandler({}, {})
+
+    def resolve_upstream(i):
+        place_request_utils.geonames_entity_cache.clear()
+        upstream_handler.resolve_hierarchies(
+            f"GN:{towns[i % len(towns)]['geonames_id']}"
+        )
+
+    return [
+        measure(
+            "PlaceHandler.resolve_hierarchies (local)",
+            lambda i: local_handler.resolve_hierarchies(
+                f"GN:{towns[i % len(towns)]['geonames_id']}"
+            ),
+            duration,
+        ),
+        measure(
+            "PlaceHandler.resolve_hierarchies (upstream, cold cache)",
+            resolve_upstream,
+            duration,
+        ),
+    ]
+
+
+def bench_api(towns, duration):
+    from starlette.testclient import TestClient
+    from covid_local_api import endpoints
+
+    # The database is loaded at startup, which runs when the client is entered.
+    with TestClient(endpoints.app) as client:
+
+        def get(url):
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+
+        return [
+            measure(
+                "GET /places",
+                lambda i: get(f"/places?q={towns[i % len(towns)]['name']}"),
+                duration,
+            ),
+            measure(
+                "GET /all?geonames_id",
+                lambda i: get(
+                    f"/all?geonames_id={towns[i % len(towns)]['geonames_id']}"
+                ),
+                duration,
+            ),
+            measure(
+                "GET /all?lat&lon",
+                lambda i: get(
+                    f"/all?lat={towns[i % len(towns)]['lat']}"
+                    f"&lon={towns[i % len(towns)]['lon']}"
+                ),
+                duration,
+            ),
+        ]
+
+
+def print_results(results, baseline=None):
+    baseline = {result["name"]: result for result in baseline or []}
+    print(f"{'benchmark':58} {'calls/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for result in results:
+        line = (
+            f"{result['name']:58} {result['throughput']:10.1f} "
+            f"{result['p50_ms']:9.2f} {result['p99_ms']:9.2f}"
+        )
+        previous = baseline.get(result["name"])
+        if previous:
+            throughput_change = result["throughput"] / previous["throughput"] - 1
+            p99_change = result["p99_ms"] / previous["p99_ms"] - 1
+            line += f"  (throughput {throughput_change:+.0%}, p99 {p99_change:+.0%})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--duration", type=float, default=2.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--output", help="Save the results as json")
+    parser.add_argument("--baseline", help="Compare to results saved with --output")
+    args = parser.parse_args()
+
+    places = fixtures.make_places(N_TOWNS)
+    towns = [place for place in places.values() if place["fcl"] == "P"]
+
+    # Configure the api before importing it (the endpoints are read at import).
+    fake_upstream = FakeUpstream(places, latency=args.latency)
+    os.environ.update(upstream_env(fake_upstream.start()))
+    sheets_dir = tempfile.mkdtemp(prefix="covid-local-api-bench-")
+    os.environ["SHEET_SOURCE"] = fixtures.write_sheets(
+        fixtures.make_sheets(places, API_ROWS), sheets_dir
+    )
+
+    results = bench_database(places, towns, args.sizes, args.duration)
+    results += bench_place_handler(places, towns, args.duration)
+    results += bench_api(towns, args.duration)
+    fake_upstream.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"argv": sys.argv[1:], "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Local stand-in for the geonames, nominatim and wikidata APIs, which serves the
+fixture places (see `fixtures.py`) in the formats that `place_request_utils` and
+geocoder expect.
+
+Point the api to it with the environment variables from `upstream_env`, e.g.:
+
+    python fake_upstream.py --port 8765
+    GEONAMES_ENDPOINT=http://localhost:8765/geonames ... uvicorn ...
+
+Usage: python fake_upstream.py [--port PORT] [--towns N] [--latency SECONDS]
+"""
+import argparse
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import fixtures
+
+# Admin level in osm and key of the id in the full geonames json for each depth of
+# the hierarchy (country, state, district, town).
+OSM_ADMIN_LEVELS = [2, 4, 6, 8]
+GEONAMES_ID_KEYS = ["countryId", "adminId1", "adminId2"]
+
+FEATURE_CLASS_NAMES = {"A": "country, state, region,...", "P": "city, village,..."}
+FEATURE_CODE_NAMES = {
+    "PCLI": "independent political entity",
+    "ADM1": "first-order administrative division",
+    "ADM2": "second-order administrative division",
+    "PPL": "populated place",
+}
+
+
+def upstream_env(base_url):
+    """Returns the environment variables to use the fake upstream at `base_url`"""
+    return {
+        "GEONAMES_ENDPOINT": base_url + "/geonames",
+        "GEONAMES_ENDPOINT_V3": base_url + "/geonames",
+        "OSM_NOMATIM_ENDPOINT": base_url + "/nominatim",
+        "WIKIDATA_ENTITY_ENDPOINT": base_url + "/wikidata/entity",
+        "WIKIDATA_SPARQL_ENDPOINT": base_url + "/wikidata/sparql",
+        # Geocode the fixture addresses without rate limit and keep them separate
+        # from the real ones.
+        "GEOCODING_MIN_INTERVAL": "0",
+        "GEOCODING_CACHE_PATH": os.path.join(
+            tempfile.gettempdir(), "covid-local-api-bench-addresses.json"
+        ),
+        # Don't count the fixture places in the access summary of the real api (which
+        # would warm them up against geonames) and don't warm up during measurements.
+        "WARMUP_SUMMARY_PATH": os.path.join(
+            tempfile.gettempdir(), "covid-local-api-bench-access-summary.json"
+        ),
+        "WARMUP_TOP_N": "0",
+    }
+
+
+class FakeUpstream:
+    """Answers upstream requests from the fixture places.
+
+    Args:
+        places (dict): The places from `fixtures.make_places`
+        latency (float): Delay of every response in seconds
+    """
+
+    def __init__(self, places, latency=0.0):
+        self.places = places
+        self.latency = latency
+        self.requests = 0
+        self._names = {place["name"].lower(): place for place in places.values()}
+        self._server = None
+
+    # --------------------------------- geonames -----------------------------------
+    def geonames_summary(self, place):
+        hierarchy = fixtures.get_hierarchy(self.places, place["geonames_id"])
+        state = self.places[hierarchy[1]] if len(hierarchy) > 1 else None
+        return {
+            "geonameId": place["geonames_id"],
+            "name": place["name"],
+            "toponymName": place["name"],
+            "lat": str(place["lat"]),
+            "lng": str(place["lon"]),
+            "countryId": str(fixtures.COUNTRY_ID),
+            "countryCode": fixtures.COUNTRY_CODE,
+            "countryName": fixtures.COUNTRY_NAME,
+            "adminName1": state["name"] if state else "",
+            "fcl": place["fcl"],
+            "fclName": FEATURE_CLASS_NAMES[place["fcl"]],
+            "fcode": place["fcode"],
+            "fcodeName": FEATURE_CODE_NAMES[place["fcode"]],
+        }
+
+    def geonames_full(self, place):
+        entity = self.geonames_summary(place)
+        hierarchy = fixtures.get_hierarchy(self.places, place["geonames_id"])
+        for key, geonames_id in zip(GEONAMES_ID_KEYS, hierarchy):
+            entity[key] = str(geonames_id)
+        entity["alternateNames"] = [
+            {"name": place["name"], "lang": "de"},
+            {"name": f"Q{place['geonames_id']}", "lang": "wkdt"},
+        ]
+        return entity
+
+    def search(self, query, limit):
+        query = query.lower()
+        if query in self._names:
+            return [self._names[query]]
+        return [place for name, place in self._names.items() if query in name][:limit]
+
+    def nearest(self, lat, lon):
+        return min(
+            (place for place in self.places.values() if place["fcl"] == "P"),
+            key=lambda place: math.hypot(place["lat"] - lat, place["lon"] - lon),
+        )
+
+    def handle_geonames(self, path, params):
+        if path == "/searchJSON":
+            places = self.search(params["q"], int(params.get("maxRows", 1)))
+            return {
+                "totalResultsCount": len(places),
+                "geonames": [self.geonames_summary(place) for place in places],
+            }
+        elif path == "/getJSON":
+            return self.geonames_full(self.places[int(params["geonameId"])])
+        elif path == "/hierarchyJSON":
+            hierarchy = fixtures.get_hierarchy(self.places, int(params["geonameId"]))
+            return {
+                "geonames": [
+                    self.geonames_summary(self.places[geonames_id])
+                    for geonames_id in hierarchy
+                ]
+            }
+        elif path == "/findNearbyPlaceNameJSON":
+            place = self.nearest(float(params["lat"]), float(params["lng"]))
+            return {"geonames": [self.geonames_summary(place)]}
+        elif path == "/countryInfoJSON":
+            return {"geonames": [{"geonameId": fixtures.COUNTRY_ID}]}
+
+    # -------------------------------- nominatim -----------------------------------
+    def osm_result(self, place):
+        return {
+            "osm_type": "relation",
+            "osm_id": place["geonames_id"],
+            "display_name": place["name"],
+            "lat": str(place["lat"]),
+            "lon": str(place["lon"]),
+            "extratags": {"wikidata": f"Q{place['geonames_id']}"},
+        }
+
+    def handle_nominatim(self, path, params):
+        if path == "/details.php":
+            hierarchy = fixtures.get_hierarchy(self.places, int(params["osmid"]))
+            address = [
+                {"osm_id": geonames_id, "osm_type": "R", "admin_level": level}
+                for geonames_id, level in zip(hierarchy, OSM_ADMIN_LEVELS)
+            ]
+            address.append(
+                {"type": "country_code", "localname": fixtures.COUNTRY_CODE.lower()}
+            )
+            return {"address": address}
+        elif path == "/lookup":
+            return [self.osm_result(self.places[int(params["osm_ids"][1:])])]
+        elif path == "/search" and "country" in params:
+            return [self.osm_result(self.places[fixtures.COUNTRY_ID])]
+        elif path == "/search" and "city" in params:
+            # Structured search for addresses (see utils/geocoding.py).
+            return [self.osm_result(place) for place in self.search(params["city"], 1)]
+        elif path == "/search":
+            places = self.search(params["q"], int(params.get("limit", 10)))
+            return [self.osm_result(place) for place in places]
+
+    # --------------------------------- wikidata -----------------------------------
+    def handle_wikidata(self, path, params):
+        if path.startswith("/entity/"):
+            wikidata_id = path[len("/entity/") :].replace(".json", "")
+            place = self.places[int(wikidata_id[1:])]
+            claims = {
+                prop: [
+                    {"mainsnak": {"datavalue": {"value": str(place["geonames_id"])}}}
+                ]
+                for prop in ["P1566", "P402"]
+            }
+            return {"entities": {wikidata_id: {"id": wikidata_id, "claims": claims}}}
+        elif path == "/sparql":
+            # Queries look up items by geonames id (P1566) or osm relation (P402).
+            match = re.search(r'wdt:P(?:1566|402) "(\d+)"', params["query"])
+            bindings = []
+            if match and int(match.group(1)) in self.places:
+                entity = "http://www.wikidata.org/entity/Q" + match.group(1)
+                bindings.append({"id": {"type": "uri", "value": entity}})
+            return {"head": {"vars": ["id"]}, "results": {"bindings": bindings}}
+
+    # ---------------------------------- server ------------------------------------
+    def handle(self, url):
+        """Returns the json response for a request url or None if it's unknown"""
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        parsed_url = urlparse(url)
+        params = {key: values[0] for key, values in parse_qs(parsed_url.query).items()}
+        service, _, path = parsed_url.path.lstrip("/").partition("/")
+        handler = {
+            "geonames": self.handle_geonames,
+            "nominatim": self.handle_nominatim,
+            "wikidata": self.handle_wikidata,
+        }.get(service)
+        try:
+            return handler("/" + path, params) if handler else None
+        except (KeyError, ValueError):
+            return None
+
+    def start(self, host="127.0.0.1", port=0):
+        """Starts the server in a background thread and returns its base url"""
+        fake_upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                content = fake_upstream.handle(self.path)
+                body = json.dumps(content).encode("utf-8")
+                self.send_response(200 if content is not None else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--towns", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake_upstream = FakeUpstream(fixtures.make_places(args.towns), args.latency)
+    base_url = fake_upstream.start(port=args.port)
+    for key, value in upstream_env(base_url).items():
+        print(f"{key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake_upstream.stop()
@@ -0,0 +1,176 @@
+"""Deterministic fixture data for the benchmarks: a hierarchy of places (country,
+states, districts, towns) and sheets, which reference these places.
+
+The places are served by `fake_upstream.py` in the formats of geonames, nominatim and
+wikidata. The same id is used for a place in all services (geonames id, osm relation
+id and wikidata id "Q<id>"), so the mappings between them are trivial to check.
+"""
+import os
+import random
+
+import pandas as pd
+
+COUNTRY_ID = 2921044
+COUNTRY_CODE = "DE"
+COUNTRY_NAME = "Germany"
+
+# Center and extent (in degrees) of the area, in which the places are located.
+CENTER = (51.0, 10.0)
+EXTENT = (4.0, 6.0)
+
+N_STATES = 16
+DISTRICTS_PER_STATE = 10
+
+
+def make_places(n_towns=2000, seed=0):
+    """Returns a dict of geonames id -> place (with parent id, feature class and the
+    ids of its admin areas like in the full geonames json)."""
+    rng = random.Random(seed)
+    places = {
+        COUNTRY_ID: {
+            "geonames_id": COUNTRY_ID,
+            "name": COUNTRY_NAME,
+            "parent": None,
+            "fcl": "A",
+            "fcode": "PCLI",
+            "lat": CENTER[0],
+            "lon": CENTER[1],
+        }
+    }
+
+    def add_place(geonames_id, name, parent, fcl, fcode):
+        lat = CENTER[0] + rng.uniform(-EXTENT[0], EXTENT[0]) / 2
+        lon = CENTER[1] + rng.uniform(-EXTENT[1], EXTENT[1]) / 2
+        places[geonames_id] = {
+            "geonames_id": geonames_id,
+            "name": name,
+            "parent": parent,
+            "fcl": fcl,
+            "fcode": fcode,
+            "lat": round(lat, 5),
+            "lon": round(lon, 5),
+        }
+
+    districts = []
+    for state in range(N_STATES):
+        state_id = 1000000 + state
+        add_place(state_id, f"Land {state}", COUNTRY_ID, "A", "ADM1")
+        for district in range(DISTRICTS_PER_STATE):
+            district_id = 2000000 + state * DISTRICTS_PER_STATE + district
+            add_place(district_id, f"Kreis {state}-{district}", state_id, "A", "ADM2")
+            districts.append(district_id)
+
+    for town in range(n_towns):
+        add_place(3000000 + town, f"Stadt {town}", rng.choice(districts), "P", "PPL")
+    return places
+
+
+def get_hierarchy(places, geonames_id):
+    """Returns the ids of the place and its parents (less local areas first)"""
+    hierarchy = []
+    while geonames_id is not None:
+        hierarchy.append(geonames_id)
+        geonames_id = places[geonames_id]["parent"]
+    return hierarchy[::-1]
+
+
+def make_sheets(places, n_rows=1000, seed=0):
+    """Returns fixture sheets with `n_rows` entries each (in the format of the Google
+    Sheet), which are assigned to random places."""
+    rng = random.Random(seed)
+    place_ids = sorted(places)
+    towns = [place for place in places.values() if place["fcl"] == "P"]
+    categories = ["general", "Quarantäne", "Kinder", "Senioren", "Reisende"]
+
+    def random_place():
+        return places[rng.choice(place_ids)]
+
+    hotlines, websites, test_sites, health_departments = [], [], [], []
+    for i in range(n_rows):
+        place = random_place()
+        hotlines.append(
+            {
+                "country_code": COUNTRY_CODE,
+                "place": place["name"],
+                "geonames_id": place["geonames_id"],
+                "name": f"Corona-Hotline {i}",
+                "operator": f"Gesundheitsamt {place['name']}",
+                "phone": f"0{rng.randint(30, 9999)} {rng.randint(100000, 999999)}",
+                "email": None,
+                "website": f"https://hotline-{i}.example.org",
+                "operating_hours": "Mo-Fr 8-18 Uhr",
+                "category": rng.choice(categories),
+                "description": "Informationen und Beratung zum Coronavirus",
+                "sources": "fixture",
+            }
+        )
+
+        place = random_place()
+        websites.append(
+            {
+                "country_code": COUNTRY_CODE,
+                "place": place["name"],
+                "geonames_id": place["geonames_id"],
+                "name": f"Informationen für {place['name']}",
+                "operator": f"Verwaltung {place['name']}",
+                "website": f"https://info-{i}.example.org",
+                "category": rng.choice(categories),
+                "description": "Aktuelle Informationen zur Lage",
+                "sources": "fixture",
+            }
+        )
+
+        town = rng.choice(towns)
+        test_sites.append(
+            {
+                "country_code": COUNTRY_CODE,
+                "lat": round(town["lat"] + rng.uniform(-0.05, 0.05), 5),
+                "lon": round(town["lon"] + rng.uniform(-0.05, 0.05), 5),
+                "name": f"Testzentrum {i}",
+                "street": f"Hauptstraße {rng.randint(1, 200)}",
+                "zip_code": rng.randint(10000, 99999),
+                "city": town["name"],
+                "address_supplement": None,
+                "phone": f"0{rng.randint(30, 9999)} {rng.randint(100000, 999999)}",
+                "website": None,
+                "operating_hours": "Mo-Sa 8-20 Uhr",
+                "appointment_required": rng.choice([True, False, None]),
+                "description": None,
+                "sources": "fixture",
+            }
+        )
+
+        place = random_place()
+        health_departments.append(
+            {
+                "country_code": COUNTRY_CODE,
+                "place": place["name"],
+                "geonames_id": place["geonames_id"],
+                "name": f"Gesundheitsamt {place['name']}",
+                "department": "Infektionsschutz",
+                "street": f"Amtsweg {rng.randint(1, 50)}",
+                "zip_code": rng.randint(10000, 99999),
+                "city": place["name"],
+                "address_supplement": None,
+                "phone": f"0{rng.randint(30, 9999)} {rng.randint(100000, 999999)}",
+                "fax": None,
+                "email": f"gesundheitsamt-{i}@example.org",
+                "website": f"https://gesundheitsamt-{i}.example.org",
+                "sources": "fixture",
+            }
+        )
+
+    return {
+        "hotlines": pd.DataFrame(hotlines),
+        "websites": pd.DataFrame(websites),
+        "test_sites": pd.DataFrame(test_sites),
+        "health_departments": pd.DataFrame(health_departments),
+    }
+
+
+def write_sheets(dfs, directory):
+    """Writes the sheets as csv files to `directory` (see `db_handler.read_sheets`)"""
+    os.makedirs(directory, exist_ok=True)
+    for sheet, df in dfs.items():
+        df.to_csv(os.path.join(directory, sheet + ".csv"), index=False)
+    return directory
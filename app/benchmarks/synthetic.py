@@ -0,0 +1,184 @@
+"""Generates large synthetic sheets with the schemas of the Google Sheet (hotlines,
+websites, test sites incl. pharmacies and health departments) for scaling tests.
+
+Values are generated with numpy, so that even 10M rows per sheet only take seconds to
+minutes. Entries are spread over places in several european countries (one place per
+`ROWS_PER_PLACE` rows), test sites are scattered around the places.
+
+Usage: python synthetic.py N_ROWS OUTPUT_DIR [--seed SEED]
+    (writes one csv file per sheet, which can be used as SHEET_SOURCE)
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import fixtures
+
+# Country code, center (lat, lon) and extent (degrees lat, lon) of the countries.
+COUNTRIES = [
+    ("DE", (51.0, 10.0), (7.0, 9.0)),
+    ("FR", (46.5, 2.5), (8.0, 10.0)),
+    ("IT", (42.5, 12.5), (9.0, 8.0)),
+    ("PL", (52.0, 19.0), (5.0, 10.0)),
+    ("AT", (47.6, 14.0), (2.0, 6.0)),
+    ("CH", (46.8, 8.2), (1.5, 4.0)),
+    ("BE", (50.6, 4.6), (1.5, 3.0)),
+    ("CZ", (49.8, 15.5), (2.0, 6.0)),
+    ("DK", (56.0, 10.0), (2.5, 4.0)),
+    ("LU", (49.7, 6.1), (0.5, 0.5)),
+]
+ROWS_PER_PLACE = 50
+SHEETS = ["hotlines", "websites", "test_sites", "health_departments"]
+
+CATEGORIES = np.array(["general", "Quarantäne", "Kinder", "Senioren", "Reisende"])
+OPERATING_HOURS = np.array(["Mo-Fr 8-18 Uhr", "täglich 9-17 Uhr", "24/7", None])
+
+
+def numbered(prefix, numbers):
+    """Returns the strings `prefix` + number for an array of numbers"""
+    return prefix + pd.Series(numbers).astype(str)
+
+
+def make_places(n_places, rng):
+    """Returns a DataFrame of places (geonames id, name, country code, lat, lon)"""
+    country_index = rng.integers(0, len(COUNTRIES), n_places)
+    centers = np.array([center for _, center, _ in COUNTRIES])[country_index]
+    extents = np.array([extent for _, _, extent in COUNTRIES])[country_index]
+    return pd.DataFrame(
+        {
+            "geonames_id": 10000000 + np.arange(n_places),
+            "name": numbered("Ort ", np.arange(n_places)),
+            "country_code": np.array([code for code, _, _ in COUNTRIES])[country_index],
+            "lat": centers[:, 0] + (rng.random(n_places) - 0.5) * extents[:, 0],
+            "lon": centers[:, 1] + (rng.random(n_places) - 0.5) * extents[:, 1],
+        }
+    )
+
+
+def phone_numbers(n, rng):
+    return (
+        "0"
+        + pd.Series(rng.integers(30, 9999, n)).astype(str)
+        + " "
+        + pd.Series(rng.integers(100000, 9999999, n)).astype(str)
+    )
+
+
+def make_sheet(sheet, n_rows, places, rng):
+    """Returns a synthetic sheet with `n_rows` entries, which are assigned to random
+    places"""
+    place = places.iloc[rng.integers(0, len(places), n_rows)].reset_index(drop=True)
+    ids = np.arange(n_rows)
+    sources = "synthetic"
+
+    if sheet == "hotlines":
+        return pd.DataFrame(
+            {
+                "country_code": place["country_code"],
+                "place": place["name"],
+                "geonames_id": place["geonames_id"],
+                "name": numbered("Corona-Hotline ", ids),
+                "operator": "Gesundheitsamt " + place["name"],
+                "phone": phone_numbers(n_rows, rng),
+                "email": None,
+                "website": "https://hotline-" + pd.Series(ids).astype(str) + ".eu",
+                "operating_hours": rng.choice(OPERATING_HOURS, n_rows),
+                "category": rng.choice(CATEGORIES, n_rows),
+                "description": "Informationen und Beratung zum Coronavirus",
+                "sources": sources,
+            }
+        )
+    elif sheet == "websites":
+        return pd.DataFrame(
+            {
+                "country_code": place["country_code"],
+                "place": place["name"],
+                "geonames_id": place["geonames_id"],
+                "name": "Informationen für " + place["name"],
+                "operator": "Verwaltung " + place["name"],
+                "website": "https://info-" + pd.Series(ids).astype(str) + ".eu",
+                "category": rng.choice(CATEGORIES, n_rows),
+                "description": "Aktuelle Informationen zur Lage",
+                "sources": sources,
+            }
+        )
+    elif sheet == "test_sites":
+        # Most test sites are pharmacies.
+        kinds = np.where(rng.random(n_rows) < 0.7, "Apotheke ", "Testzentrum ")
+        return pd.DataFrame(
+            {
+                "country_code": place["country_code"],
+                "lat": (place["lat"] + rng.normal(0, 0.03, n_rows)).round(5),
+                "lon": (place["lon"] + rng.normal(0, 0.04, n_rows)).round(5),
+                "name": kinds + pd.Series(ids).astype(str),
+                "street": numbered("Hauptstraße ", rng.integers(1, 300, n_rows)),
+                "zip_code": rng.integers(1000, 99999, n_rows),
+                "city": place["name"],
+                "address_supplement": None,
+                "phone": phone_numbers(n_rows, rng),
+                "website": None,
+                "operating_hours": rng.choice(OPERATING_HOURS, n_rows),
+                "appointment_required": rng.choice(
+                    np.array([True, False, None]), n_rows
+                ),
+                "description": None,
+                "sources": sources,
+            }
+        )
+    elif sheet == "health_departments":
+        return pd.DataFrame(
+            {
+                "country_code": place["country_code"],
+                "place": place["name"],
+                "geonames_id": place["geonames_id"],
+                "name": "Gesundheitsamt " + place["name"],
+                "department": "Infektionsschutz",
+                "street": numbered("Amtsweg ", rng.integers(1, 100, n_rows)),
+                "zip_code": rng.integers(1000, 99999, n_rows),
+                "city": place["name"],
+                "address_supplement": None,
+                "phone": phone_numbers(n_rows, rng),
+                "fax": None,
+                "email": "gesundheitsamt-" + pd.Series(ids).astype(str) + "@example.eu",
+                "website": "https://gesundheitsamt-"
+                + pd.Series(ids).astype(str)
+                + ".eu",
+                "sources": sources,
+            }
+        )
+    raise ValueError(f"Unknown sheet: {sheet}")
+
+
+def make_sheets(n_rows, seed=0, sheet_rows=None):
+    """Returns synthetic sheets with `n_rows` entries each.
+
+    Args:
+        n_rows (int): Number of entries per sheet
+        seed (int): Seed of the random generator
+        sheet_rows (dict, optional): Number of entries of single sheets (overrides
+            `n_rows` for these sheets)
+
+    Returns:
+        tuple: (dict of pandas.DataFrame, pandas.DataFrame) The sheets by name and the
+            places, to which the entries are assigned
+    """
+    rng = np.random.default_rng(seed)
+    sheet_rows = dict({sheet: n_rows for sheet in SHEETS}, **(sheet_rows or {}))
+    places = make_places(max(100, max(sheet_rows.values()) // ROWS_PER_PLACE), rng)
+    dfs = {
+        sheet: make_sheet(sheet, rows, places, rng)
+        for sheet, rows in sheet_rows.items()
+    }
+    return dfs, places
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("n_rows", type=int)
+    parser.add_argument("output_dir")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dfs, _ = make_sheets(args.n_rows, args.seed)
+    print("Wrote sheets to: " + fixtures.write_sheets(dfs, args.output_dir))
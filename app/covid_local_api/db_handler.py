@@ -1,53 +1,559 @@
-import pandas as pd
 import sqlite3
 import math
 import logging
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from covid_local_api.schema import Hotline, Website, TestSite, HealthDepartment
+from covid_local_api.utils import (
+    change_utils,
+    export_utils,
+    geocoding,
+    metrics,
+    tile_utils,
+    timing,
+)
+
+# Schemas of the sheets. Sheets are coerced to these schemas when they are imported, so
+# database rows can be returned without validating them again.
+SHEET_MODELS = {
+    "hotlines": Hotline,
+    "websites": Website,
+    "test_sites": TestSite,
+    "health_departments": HealthDepartment,
+}
+
+# Source of the data: the Google Sheet (as excel file) by default. Can be set to a local
+# excel file or a directory with one csv file per sheet (e.g. for benchmarks).
+SHEET_SOURCE = os.getenv(
+    "SHEET_SOURCE",
+    "https://docs.google.com/spreadsheets/d/1AXadba5Si7WbJkfqQ4bN67cbP93oniR-J6uN0_Av958/export?format=xlsx",
+)
+
+# Fields that are not stored in the database but added to the rows when querying.
+DYNAMIC_FIELDS = ["distance"]
+
+# Values that are interpreted as booleans (same as pydantic).
+BOOL_TRUE = {1, "1", "on", "t", "true", "y", "yes"}
+BOOL_FALSE = {0, "0", "off", "f", "false", "n", "no"}
+
+# Number of database updates, for which the changes are kept.
+CHANGE_HISTORY_SIZE = 30
+
+# Sheets and text columns in the full-text search index (with bm25 weights).
+SEARCH_SHEETS = ["hotlines", "websites"]
+SEARCH_COLUMNS = {"name": 10.0, "operator": 5.0, "category": 5.0, "description": 1.0}
+
+# Sheets with lat/lon columns, which get a spatial index and precomputed clusters.
+SPATIAL_SHEETS = ["test_sites", "health_departments"]
+
+# Sheets with addresses (street, zip_code, city), whose entries get the coordinates of
+# their address if they have none (see utils/geocoding.py).
+GEOCODED_SHEETS = ["health_departments"]
+
+# Clusters are precomputed for map zoom levels up to CLUSTER_MAX_ZOOM. Each tile
+# (360 / 2**zoom degrees wide) is split into CLUSTER_CELLS_PER_TILE cells per side.
+CLUSTER_MAX_ZOOM = 10
+CLUSTER_CELLS_PER_TILE = 8
+
+# Test sites are pre-rendered into map tiles up to TILE_MAX_ZOOM (tiles up to
+# CLUSTER_MAX_ZOOM contain clusters, the others contain single test sites).
+TILE_MAX_ZOOM = 14
+
+
+def cluster_cell_size(zoom):
+    """Returns the size of the cluster cells (in degrees) at `zoom`"""
+    return 360 / 2 ** zoom / CLUSTER_CELLS_PER_TILE
+
+
+def coerce_value(value, type_):
+    """Coerces a single value from the Google Sheet to `type_` (NaN and values that 
+    cannot be converted become None)"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    try:
+        if type_ is bool:
+            if isinstance(value, str):
+                value = value.strip().lower()
+            if value in BOOL_TRUE:
+                return True
+            elif value in BOOL_FALSE:
+                return False
+            return None
+        elif type_ is int:
+            return int(value)
+        elif type_ is float:
+            value = float(value)
+            return None if math.isnan(value) else value
+        else:
+            return str(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def coerce_sheet(df, model):
+    """Returns a copy of `df` with exactly the fields of `model` (in the same order), 
+    coerced to the field types. Missing columns are filled with None.
+
+    Args:
+        df (pandas.DataFrame): The worksheet from the Google Sheet
+        model (pydantic.BaseModel): The schema of the worksheet
+
+    Returns:
+        pandas.DataFrame: The coerced worksheet
+    """
+    import pandas as pd
+
+    columns = {}
+    for name, field in model.__fields__.items():
+        if name in DYNAMIC_FIELDS:
+            continue
+        if name in df.columns:
+            values = [coerce_value(value, field.type_) for value in df[name]]
+        else:
+            values = [None] * len(df)
+        # Use object dtype, so that ints with missing values don't become floats.
+        columns[name] = pd.Series(values, index=df.index, dtype=object)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def fetch_dicts(cur):
+    """Returns all remaining rows of the cursor `cur` as dicts.
+
+    Compared to a row factory, the column names are only read once per query (and 
+    not once per row), so materializing large results allocates much fewer objects.
+    """
+    columns = [col[0] for col in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def to_search_query(query):
+    """Converts a free-form query to an FTS5 query, which matches all words as 
+    prefixes (e.g. "Kinder" also matches "Kinderärzte")"""
+    words = query.replace('"', " ").split()
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def read_sheets(source):
+    """Reads all sheets from `source`.
+
+    Args:
+        source (str or callable): Url or path of an excel file, path of a directory 
+            with one csv file per sheet (named like the sheet), or a function that 
+            returns the sheets
+
+    Returns:
+        dict of pandas.DataFrame: The sheets by name
+    """
+    # pandas (and xlrd) take long to import, so they are only loaded for updates.
+    import pandas as pd
+
+    if callable(source):
+        return source()
+    elif os.path.isdir(source):
+        return {
+            os.path.splitext(file_name)[0]: pd.read_csv(os.path.join(source, file_name))
+            for file_name in sorted(os.listdir(source))
+            if file_name.endswith(".csv")
+        }
+    else:
+        return pd.read_excel(source, sheet_name=None)
+
+
+def squared_distance_sql(lat, lon):
+    """Returns an SQL expression for the squared distance (in degrees lat/lon) between
+    the lat/lon columns and lat/lon.
+
+    Coordinates are wrapped in parentheses, because negative values would otherwise 
+    start a comment (e.g. lon--3.5).
+    """
+    lat, lon = float(lat), float(lon)
+    return f"(lat-({lat}))*(lat-({lat}))+(lon-({lon}))*(lon-({lon}))"
+
+
+def get_dataset_version(dfs):
+    """Returns a version string for the data in `dfs`, which only changes if the 
+    content of any sheet changes.
+    
+    Args:
+        dfs (dict of pandas.DataFrame): The sheets of the Google Sheet
+
+    Returns:
+        str: The dataset version (16 hex characters)
+    """
+    import pandas as pd
+
+    sha1 = hashlib.sha1()
+    for table in sorted(dfs):
+        sha1.update(table.encode())
+        sha1.update(",".join(map(str, dfs[table].columns)).encode())
+        sha1.update(pd.util.hash_pandas_object(dfs[table]).values.tobytes())
+    return sha1.hexdigest()[:16]
+
+
+class Database:
+    """An in-memory sqlite database with the sheets and the data derived from it.
+
+    Databases are never changed after they were built. Updates build a new one and
+    replace the current one as a whole (see `DatabaseHandler.update_database`), so 
+    requests never read a half-built database.
+
+    Args:
+        con (sqlite3.Connection): The connection to the database
+        bool_columns (dict): Boolean columns of each sheet (see `restore_bools`)
+        tiles (dict): Serialized GeoJSON tiles of the test sites by (z, x, y)
+        version (str): Version of the dataset (see `get_dataset_version`)
+        updated_at (datetime): Time of the update
+    """
+
+    def __init__(
+        self, con=None, bool_columns=None, tiles=None, version=None, updated_at=None
+    ):
+        self.con = con
+        self.bool_columns = bool_columns or {}
+        self.tiles = tiles or {}
+        self.version = version
+        self.updated_at = updated_at
 
 
 class DatabaseHandler:
-    def __init__(self):
-        """Initializes the database with the data from the Google Sheet"""
-        self.con = None
-        self.update_database()
+    def __init__(self, sheet_source=None, load=True):
+        """Initializes the database with the data from the Google Sheet (or 
+        `sheet_source`, see `read_sheets`). If `load` is False, the database stays 
+        empty until `update_database` is called."""
+        self.sheet_source = sheet_source or SHEET_SOURCE
+        self._database = Database()
+        # Updates run in worker threads (scheduled or triggered by the api), but only
+        # one at a time.
+        self._update_lock = threading.Lock()
+        self.exports = {}
+        self._export_sheets = None
+        self._exports_lock = threading.Lock()
+        self.snapshots = {}
+        self.change_history = deque(maxlen=CHANGE_HISTORY_SIZE)
+        self.address_cache = geocoding.AddressCache()
+        self.missing_addresses = {}
+        # Sheets of the last update (to add coordinates without reading them again).
+        self._sheets = {}
+        if load:
+            self.update_database()
+
+    # The current database (replaced as a whole by updates).
+    @property
+    def con(self):
+        return self._database.con
+
+    @property
+    def bool_columns(self):
+        return self._database.bool_columns
+
+    @property
+    def tiles(self):
+        return self._database.tiles
+
+    @property
+    def version(self):
+        return self._database.version
+
+    @property
+    def updated_at(self):
+        return self._database.updated_at
 
     def delete_database(self):
-        """Closes the database connection, which deletes the database"""
+        """Closes the database connection, which deletes the database (only for 
+        tear down, requests can't be served afterwards)"""
         # See https://stackoverflow.com/questions/48732439/deleting-a-database-file-in-memory
         if self.con is not None:
-            logging.info("Deleting old database...")
+            logging.info("Deleting database...")
             self.con.close()
+            self._database = Database()
 
     def update_database(self):
         """Updates the database with the current data from the Google Sheet. 
         
-        Downloads the data as an excel file and writes it to an in-memory sqlite 
-        database.
+        Downloads the data as an excel file and writes it to a new in-memory sqlite 
+        database, which then replaces the current one. Requests are served from the 
+        current database in the meantime.
         """
-        self.delete_database()
+        with self._update_lock:
+            self._update_database()
+
+    def _update_database(self):
+        start = time.perf_counter()
 
-        # Create in-memory sqlite3 database.
-        # We can use check_same_thread because we only read from the database, so
-        # there's no concurrency
+        # Download excel file from Google Sheets and read it with pandas.
+        with timing.span("read_sheets"):
+            dfs = read_sheets(self.sheet_source)
+
+        # Create in-memory sqlite3 database and write the sheets to it.
+        # We can use check_same_thread because the database isn't changed after it
+        # was built, so it's only read concurrently.
         logging.info("Creating new database...")
-        self.con = sqlite3.connect(":memory:", check_same_thread=False)
-
-        # Download excel file from Google Sheets, read it with pandas and write to
-        # database.
-        url = "https://docs.google.com/spreadsheets/d/1AXadba5Si7WbJkfqQ4bN67cbP93oniR-J6uN0_Av958/export?format=xlsx"
-        dfs = pd.read_excel(url, sheet_name=None)
-        for table, df in dfs.items():
-            df.to_sql(table, self.con)
-
-        # Make database return dicts instead of tuples.
-        # From: https://stackoverflow.com/questions/3300464/how-can-i-get-dict-from-sqlite-query
-        def dict_factory(cursor, row):
-            d = {}
-            for idx, col in enumerate(cursor.description):
-                d[col[0]] = row[idx]
-            return d
-
-        self.con.row_factory = dict_factory
-        logging.info("Database successfully updated")
+        con = sqlite3.connect(":memory:", check_same_thread=False)
+        bool_columns = {}
+        # Only addresses that were geocoded before are used here, new ones are
+        # geocoded afterwards (see geocode_missing_addresses).
+        self.address_cache.load()
+        missing_addresses = {}
+        with timing.span("write_tables"):
+            for table, df in dfs.items():
+                if table in SHEET_MODELS:
+                    df = coerce_sheet(df, SHEET_MODELS[table])
+                    dfs[table] = df
+                    bool_columns[table] = [
+                        name
+                        for name, field in SHEET_MODELS[table].__fields__.items()
+                        if field.type_ is bool and name in df.columns
+                    ]
+                if table in GEOCODED_SHEETS:
+                    missing_addresses.update(
+                        geocoding.add_coordinates(df, self.address_cache)
+                    )
+                df.to_sql(table, con, index=False)
+
+        with timing.span("spatial_index"):
+            for sheet in SPATIAL_SHEETS:
+                if sheet in dfs:
+                    self.create_spatial_index(con, sheet)
+                    self.create_clusters(con, sheet)
+
+        with timing.span("search_index"):
+            self.create_search_index(
+                con, [sheet for sheet in SEARCH_SHEETS if sheet in dfs]
+            )
+
+        # End the implicit transaction of the inserts (the database can't be copied
+        # in `update_coordinates` otherwise).
+        con.commit()
+
+        tiles = {}
+        with timing.span("tiles"):
+            if "test_sites" in dfs:
+                tiles = self.render_tiles(con, "test_sites", bool_columns)
+
+        with timing.span("changes"):
+            version = get_dataset_version(dfs)
+            if version != self.version:
+                self.record_changes(dfs, version)
+
+        self._replace_database(
+            Database(con, bool_columns, tiles, version, datetime.utcnow()),
+            dfs,
+            missing_addresses,
+        )
+        metrics.DATABASE_REFRESH_DURATION.set(time.perf_counter() - start)
+        metrics.DATABASE_REFRESH_TIMESTAMP.set_to_current_time()
+        for sheet, df in dfs.items():
+            metrics.DATABASE_ROWS.labels(sheet).set(len(df))
+        logging.info(f"Database successfully updated (version: {self.version})")
+
+    def _replace_database(self, database, dfs, missing_addresses):
+        # Exports are rendered on first use (see get_export), because they take about
+        # as long as the rest of the update and aren't needed to serve the api.
+        with self._exports_lock:
+            self.exports = {}
+            self._export_sheets = {
+                sheet: df for sheet, df in dfs.items() if sheet in SHEET_MODELS
+            }
+        self._sheets = dfs
+        self.missing_addresses = missing_addresses
+        # Replace the database in one step. The old connection isn't closed, because
+        # requests may still read from it (e.g. streamed responses). It's closed when
+        # the last cursor is released.
+        self._database = database
+
+    def update_coordinates(self):
+        """Adds the coordinates of addresses that were geocoded since the last update
+        to the geocoded sheets, without reading the sheets again.
+
+        Only the tables of the geocoded sheets are replaced (in a copy of the current
+        database, which then replaces it like in `update_database`).
+
+        Returns:
+            bool: True if the database was updated (i.e. there were new coordinates)
+        """
+        with self._update_lock:
+            database = self._database
+            if database.con is None:
+                return False
+
+            self.address_cache.load()
+            dfs = dict(self._sheets)
+            missing_addresses = {}
+            for sheet in GEOCODED_SHEETS:
+                if sheet in dfs:
+                    dfs[sheet] = dfs[sheet].copy()
+                    missing_addresses.update(
+                        geocoding.add_coordinates(dfs[sheet], self.address_cache)
+                    )
+            version = get_dataset_version(dfs)
+            if version == database.version:
+                self.missing_addresses = missing_addresses
+                return False
+
+            con = sqlite3.connect(":memory:", check_same_thread=False)
+            database.con.backup(con)
+            for sheet in GEOCODED_SHEETS:
+                if sheet not in dfs:
+                    continue
+                # Rows are written in the same order, so rowids don't change.
+                for table in [f"{sheet}_rtree", f"{sheet}_clusters", sheet]:
+                    con.execute(f"DROP TABLE IF EXISTS {table}")
+                dfs[sheet].to_sql(sheet, con, index=False)
+                if sheet in SPATIAL_SHEETS:
+                    self.create_spatial_index(con, sheet)
+                    self.create_clusters(con, sheet)
+            con.commit()
+
+            self.record_changes(dfs, version)
+            self._replace_database(
+                Database(
+                    con,
+                    database.bool_columns,
+                    database.tiles,
+                    version,
+                    datetime.utcnow(),
+                ),
+                dfs,
+                missing_addresses,
+            )
+            logging.info(f"Added new coordinates (version: {version})")
+            return True
+
+    def render_exports(self):
+        """Renders the exports of the sheets from the last update (if that didn't 
+        happen yet)"""
+        with self._exports_lock:
+            if self._export_sheets is not None:
+                with timing.span("exports"):
+                    self.exports = export_utils.render_exports(self._export_sheets)
+                self._export_sheets = None
+
+    def get_export(self, sheet, format):
+        """Returns the export of `sheet` in `format` (see `export_utils.render_exports`) 
+        or None if it's not available"""
+        self.render_exports()
+        return self.exports.get((sheet, format))
+
+    def geocode_missing_addresses(self):
+        """Geocodes the addresses from the last update, which had no coordinates (rate
+        limited, see utils/geocoding.py). 
+
+        Returns:
+            int: The number of these addresses that have coordinates now (see 
+                `update_coordinates` to add them to the database)
+        """
+        if not self.missing_addresses or geocoding.GEOCODING_MAX_ADDRESSES <= 0:
+            return 0
+        return geocoding.geocode_addresses(self.missing_addresses, self.address_cache)
+
+    def record_changes(self, dfs, version):
+        """Stores the changes of each sheet compared to the previous update of the 
+        database in `change_history` (only for the last CHANGE_HISTORY_SIZE updates)"""
+        snapshots = {
+            sheet: change_utils.snapshot_sheet(dfs[sheet], key_columns)
+            for sheet, key_columns in change_utils.SHEET_KEY_COLUMNS.items()
+            if sheet in dfs
+        }
+        if self.version is not None:
+            deltas = {
+                sheet: change_utils.diff_snapshots(
+                    self.snapshots.get(sheet, {}), snapshot
+                )
+                for sheet, snapshot in snapshots.items()
+            }
+            self.change_history.append((self.version, version, deltas))
+            logging.info(
+                f"Recorded changes from version {self.version} to {version}: "
+                + ", ".join(f"{sheet}: {len(d)}" for sheet, d in deltas.items())
+            )
+        self.snapshots = snapshots
+
+    def get_changes(self, since):
+        """Returns the changes of each sheet between the dataset version `since` and 
+        the current version.
+
+        Returns:
+            dict: The inserts, updates and deletes for each sheet (see 
+                `change_utils.format_delta`) or None if the changes since this 
+                version are not available anymore
+        """
+        if since == self.version:
+            return {}
+
+        history = list(self.change_history)
+        from_versions = [from_version for from_version, _, _ in history]
+        if since not in from_versions:
+            return None
+
+        deltas_by_sheet = {}
+        for _, _, deltas in history[from_versions.index(since) :]:
+            for sheet, delta in deltas.items():
+                deltas_by_sheet.setdefault(sheet, []).append(delta)
+        return {
+            sheet: change_utils.format_delta(change_utils.compose_deltas(deltas))
+            for sheet, deltas in deltas_by_sheet.items()
+        }
+
+    def create_spatial_index(self, con, sheet):
+        """Creates an R*Tree index on the lat/lon columns of `sheet` (as table 
+        `<sheet>_rtree`, which references the rowids of `sheet`)"""
+        con.execute(
+            f"CREATE VIRTUAL TABLE {sheet}_rtree "
+            f"USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+        )
+        con.execute(
+            f"INSERT INTO {sheet}_rtree SELECT rowid, lat, lat, lon, lon FROM {sheet} "
+            f"WHERE lat IS NOT NULL AND lon IS NOT NULL"
+        )
+
+    def create_search_index(self, con, sheets):
+        """Creates an FTS5 full-text index on the text columns of `sheets` (as table 
+        `search_index`, which references the rowids of the sheets)"""
+        con.execute(
+            f"CREATE VIRTUAL TABLE search_index USING fts5(sheet UNINDEXED, "
+            f"row_id UNINDEXED, {', '.join(SEARCH_COLUMNS)})"
+        )
+        for sheet in sheets:
+            con.execute(
+                f"INSERT INTO search_index SELECT '{sheet}', rowid, "
+                f"{', '.join(SEARCH_COLUMNS)} FROM {sheet}"
+            )
+
+    def create_clusters(self, con, sheet):
+        """Precomputes grid clusters (count and centroid per cell) of the entries in 
+        `sheet` for all zoom levels up to CLUSTER_MAX_ZOOM (as table 
+        `<sheet>_clusters`)"""
+        con.execute(
+            f"CREATE TABLE {sheet}_clusters "
+            f"(zoom INTEGER, count INTEGER, lat REAL, lon REAL)"
+        )
+        for zoom in range(CLUSTER_MAX_ZOOM + 1):
+            cell_size = cluster_cell_size(zoom)
+            con.execute(
+                f"INSERT INTO {sheet}_clusters "
+                f"SELECT {zoom}, COUNT(*), AVG(lat), AVG(lon) FROM {sheet} "
+                f"WHERE lat IS NOT NULL AND lon IS NOT NULL "
+                f"GROUP BY CAST((lat + 90) / {cell_size} AS INTEGER), "
+                f"CAST((lon + 180) / {cell_size} AS INTEGER)"
+            )
+        con.execute(
+            f"CREATE INDEX {sheet}_clusters_zoom_lat ON {sheet}_clusters (zoom, lat)"
+        )
+
+    def restore_bools(self, sheet, dicts, bool_columns=None):
+        """Converts boolean columns of `sheet` (default: from the current database) 
+        back from integers (sqlite has no boolean type) in place"""
+        if bool_columns is None:
+            bool_columns = self.bool_columns
+        for name in bool_columns.get(sheet, []):
+            for d in dicts:
+                if d[name] is not None:
+                    d[name] = bool(d[name])
 
     def get(self, sheet, geonames_ids):
         """Returns all entries from `sheet`, which match one of the ids in 
@@ -64,9 +570,81 @@ class DatabaseHandler:
             f"SELECT * FROM {sheet} WHERE geonames_id "
             f"IN ({', '.join(map(str, geonames_ids))})"
         )
-        dicts = cur.fetchall()
+        dicts = fetch_dicts(cur)
+        self.restore_bools(sheet, dicts)
         return dicts
 
+    def search(self, sheet, query, geonames_ids=None, limit=20):
+        """Returns entries from `sheet` that match the free-form `query`, sorted by 
+        relevance.
+
+        Args:
+            sheet (str): The worksheet in the Google Sheet (one of SEARCH_SHEETS)
+            query (str): The words to search for in name, operator, category and 
+                description
+            geonames_ids (list of int, optional): Only return entries for these 
+                geonames_ids (default: return entries for all places)
+            limit (int, optional): Maximum number of elements to return (default: 20)
+
+        Returns:
+            list of dict: Matching database entries as key-value dicts
+        """
+        search_query = to_search_query(query)
+        if not search_query:
+            return []
+
+        weights = ", ".join(map(str, SEARCH_COLUMNS.values()))
+        place_filter = ""
+        if geonames_ids is not None:
+            place_filter = (
+                f"AND {sheet}.geonames_id IN ({', '.join(map(str, geonames_ids))}) "
+            )
+        cur = self.con.execute(
+            f"SELECT {sheet}.* FROM search_index "
+            f"JOIN {sheet} ON {sheet}.rowid = search_index.row_id "
+            f"WHERE search_index MATCH ? AND search_index.sheet = ? "
+            f"{place_filter}"
+            f"ORDER BY bm25(search_index, 0, 0, {weights}) LIMIT {int(limit)}",
+            (search_query, sheet),
+        )
+        dicts = fetch_dicts(cur)
+        self.restore_bools(sheet, dicts)
+        return dicts
+
+    def get_many(self, sheet, geonames_ids_list):
+        """Returns entries from `sheet` for several lists of geonames ids at once.
+
+        Runs a single query for the union of all ids and distributes the rows to the 
+        individual lists afterwards.
+        
+        Args:
+            sheet (str): The worksheet in the Google Sheet
+            geonames_ids_list (list of list of int): One list of geonames_ids per place
+
+        Returns:
+            list of list of dict: Filtered database entries for each list in 
+                `geonames_ids_list` (in the same order)
+        """
+        all_geonames_ids = set(
+            geonames_id
+            for geonames_ids in geonames_ids_list
+            for geonames_id in geonames_ids
+        )
+        if not all_geonames_ids:
+            return [[] for _ in geonames_ids_list]
+
+        rows_by_geonames_id = {}
+        for d in self.get(sheet, all_geonames_ids):
+            rows_by_geonames_id.setdefault(d["geonames_id"], []).append(d)
+
+        results = []
+        for geonames_ids in geonames_ids_list:
+            rows = []
+            for geonames_id in geonames_ids:
+                rows.extend(rows_by_geonames_id.get(geonames_id, []))
+            results.append(rows)
+        return results
+
     def get_nearby(self, sheet, lat, lon, max_distance=0.5, limit=5):
         """Returns nearby entries from `sheet` for a latitude/longitude pair, sorted by 
         distance.
@@ -95,16 +673,240 @@ class DatabaseHandler:
         # Distance is in degrees lat/lon, see comment in docstring.
         # TODO: Find a better solution to calculate distances, based on true distance
         #   in kilometers.
-        squared_distance = f"(lat-{lat})*(lat-{lat})+(lon-{lon})*(lon-{lon})"
+        squared_distance = squared_distance_sql(lat, lon)
         query = (
-            f"SELECT *, {squared_distance} AS distance FROM test_sites "
+            f"SELECT *, {squared_distance} AS distance FROM {sheet} "
             f"WHERE {squared_distance} <= {max_distance}*{max_distance} "
             f"ORDER BY {squared_distance} LIMIT {limit}"
         )
         cur = self.con.execute(query)
 
-        dicts = cur.fetchall()
+        dicts = fetch_dicts(cur)
+        self.restore_bools(sheet, dicts)
         for d in dicts:
             # Distance in SQL query is squared, so take the sqrt here.
             d["distance"] = math.sqrt(d["distance"])
         return dicts
+
+    def iter_rows(self, sheet, geonames_ids, after=None, limit=None):
+        """Yields entries from `sheet`, which match one of the ids in `geonames_ids`, 
+        ordered by their position in the database.
+
+        Rows are read one by one from the sqlite cursor, so memory use does not 
+        depend on the number of results. Pass the position of the last entry as 
+        `after` to continue with the next page (keyset pagination).
+
+        Args:
+            sheet (str): The worksheet in the Google Sheet
+            geonames_ids (int): The geonames_ids of the places to search for
+            after (tuple, optional): Only return entries after this position
+            limit (int, optional): Maximum number of elements to return (default: all)
+
+        Yields:
+            tuple: (position, dict) The position of the entry (for pagination) and 
+                the database entry as key-value dict
+        """
+        query = (
+            f"SELECT rowid AS _rowid, * FROM {sheet} WHERE geonames_id "
+            f"IN ({', '.join(map(str, geonames_ids))}) "
+        )
+        params = []
+        if after is not None:
+            query += "AND rowid > ? "
+            params += [after[0]]
+        query += "ORDER BY rowid "
+        if limit is not None:
+            query += f"LIMIT {int(limit)}"
+
+        for d in self.iter_dicts(sheet, self.con.execute(query, params)):
+            yield (d.pop("_rowid"),), d
+
+    def iter_nearby(self, sheet, lat, lon, max_distance=0.5, after=None, limit=None):
+        """Yields nearby entries from `sheet` for a latitude/longitude pair, sorted by 
+        distance (see `get_nearby` for details on the distance).
+
+        Rows are read one by one from the sqlite cursor, so memory use does not 
+        depend on the number of results. Pass the position of the last entry as 
+        `after` to continue with the next page (keyset pagination).
+
+        Args:
+            sheet (str): The worksheet in the Google Sheet
+            lat (float): The latitude of the place
+            lon (float): The longitude of the place
+            max_distance (float, optional): Maximum distance to search for objects (in 
+                degrees lat/lon; default: 0.5)
+            after (tuple, optional): Only return entries after this position
+            limit (int, optional): Maximum number of elements to return (default: all)
+
+        Yields:
+            tuple: (position, dict) The position of the entry (for pagination) and 
+                the database entry as key-value dict
+        """
+        squared_distance = squared_distance_sql(lat, lon)
+        query = (
+            f"SELECT rowid AS _rowid, *, {squared_distance} AS distance FROM {sheet} "
+            f"WHERE {squared_distance} <= {max_distance}*{max_distance} "
+        )
+        params = []
+        if after is not None:
+            # Sort by rowid for entries with the same distance, so the order is stable.
+            query += (
+                f"AND ({squared_distance} > ? "
+                f"OR ({squared_distance} = ? AND rowid > ?)) "
+            )
+            params += [after[0], after[0], after[1]]
+        query += f"ORDER BY {squared_distance}, rowid "
+        if limit is not None:
+            query += f"LIMIT {int(limit)}"
+
+        for d in self.iter_dicts(sheet, self.con.execute(query, params)):
+            position = (d["distance"], d.pop("_rowid"))
+            # Distance in SQL query is squared, so take the sqrt here.
+            d["distance"] = math.sqrt(d["distance"])
+            yield position, d
+
+    def iter_dicts(self, sheet, cur):
+        """Yields the rows of the cursor `cur` one by one as dicts"""
+        columns = [col[0] for col in cur.description]
+        bool_columns = self.bool_columns.get(sheet, [])
+        for row in cur:
+            d = dict(zip(columns, row))
+            for name in bool_columns:
+                if d[name] is not None:
+                    d[name] = bool(d[name])
+            yield d
+
+    def get_nearby_many(self, sheet, locations, max_distance=0.5, limit=5):
+        """Returns nearby entries from `sheet` for several latitude/longitude pairs at 
+        once, sorted by distance.
+
+        Runs a single query for the bounding boxes around all locations and computes 
+        the distances for each location afterwards. See `get_nearby` for details on 
+        the distance.
+
+        Args:
+            sheet (str): The worksheet in the Google Sheet
+            locations (list of tuple): (lat, lon) pairs of the places
+            max_distance (float, optional): Maximum distance to search for objects (in 
+                degrees lat/lon; default: 0.5)
+            limit (float, optional): Maximum number of elements to return per location 
+                (default: 5)
+
+        Returns:
+            list of list of dict: Filtered database entries for each location in 
+                `locations` (in the same order)
+        """
+        known_locations = set(
+            (lat, lon) for lat, lon in locations if lat is not None and lon is not None
+        )
+        if not known_locations:
+            return [[] for _ in locations]
+
+        bounding_boxes = " OR ".join(
+            f"(lat BETWEEN {lat - max_distance} AND {lat + max_distance} "
+            f"AND lon BETWEEN {lon - max_distance} AND {lon + max_distance})"
+            for lat, lon in known_locations
+        )
+        cur = self.con.execute(f"SELECT * FROM {sheet} WHERE {bounding_boxes}")
+        candidates = fetch_dicts(cur)
+        self.restore_bools(sheet, candidates)
+
+        results = []
+        for lat, lon in locations:
+            if (lat, lon) not in known_locations:
+                results.append([])
+                continue
+            nearby = []
+            for d in candidates:
+                distance = math.sqrt((d["lat"] - lat) ** 2 + (d["lon"] - lon) ** 2)
+                if distance <= max_distance:
+                    nearby.append((distance, d))
+            nearby.sort(key=lambda item: item[0])
+            # Copy the dicts, because the same row can be close to several locations.
+            results.append(
+                [dict(d, distance=distance) for distance, d in nearby[:limit]]
+            )
+        return results
+
+    def render_tiles(self, con, sheet, bool_columns):
+        """Renders the entries of `sheet` in the database `con` into GeoJSON tiles 
+        for all zoom levels up to TILE_MAX_ZOOM.
+
+        Returns:
+            dict: Serialized GeoJSON (as bytes) for each (z, x, y) tile
+        """
+        features_by_zoom = {}
+        for zoom in range(CLUSTER_MAX_ZOOM + 1):
+            cur = con.execute(
+                f"SELECT count, lat, lon FROM {sheet}_clusters WHERE zoom = {zoom}"
+            )
+            features_by_zoom[zoom] = [
+                tile_utils.point_feature(d["lat"], d["lon"], {"count": d["count"]})
+                for d in fetch_dicts(cur)
+            ]
+
+        cur = con.execute(
+            f"SELECT * FROM {sheet} WHERE lat IS NOT NULL AND lon IS NOT NULL"
+        )
+        dicts = fetch_dicts(cur)
+        self.restore_bools(sheet, dicts, bool_columns)
+        features = []
+        for d in dicts:
+            lat, lon = d.pop("lat"), d.pop("lon")
+            features.append(tile_utils.point_feature(lat, lon, d))
+        for zoom in range(CLUSTER_MAX_ZOOM + 1, TILE_MAX_ZOOM + 1):
+            features_by_zoom[zoom] = features
+
+        tiles = tile_utils.render_tiles(features_by_zoom)
+        logging.info(f"Rendered {len(tiles)} tiles for {sheet}")
+        return tiles
+
+    def count_in_bbox(self, sheet, min_lat, min_lon, max_lat, max_lon):
+        """Returns the number of entries from `sheet` within the bounding box"""
+        cur = self.con.execute(
+            f"SELECT COUNT(*) AS count FROM {sheet}_rtree "
+            f"WHERE min_lat >= {min_lat} AND max_lat <= {max_lat} "
+            f"AND min_lon >= {min_lon} AND max_lon <= {max_lon}"
+        )
+        return cur.fetchone()[0]
+
+    def get_in_bbox(self, sheet, min_lat, min_lon, max_lat, max_lon, limit=500):
+        """Returns entries from `sheet` within the bounding box (using the spatial 
+        index).
+
+        Args:
+            sheet (str): The worksheet in the Google Sheet
+            min_lat (float): The southern border of the bounding box
+            min_lon (float): The western border of the bounding box
+            max_lat (float): The northern border of the bounding box
+            max_lon (float): The eastern border of the bounding box
+            limit (int, optional): Maximum number of elements to return (default: 500)
+
+        Returns:
+            list of dict: Filtered database entries as key-value dicts
+        """
+        cur = self.con.execute(
+            f"SELECT {sheet}.* FROM {sheet}_rtree "
+            f"JOIN {sheet} ON {sheet}.rowid = {sheet}_rtree.id "
+            f"WHERE min_lat >= {min_lat} AND max_lat <= {max_lat} "
+            f"AND min_lon >= {min_lon} AND max_lon <= {max_lon} "
+            f"LIMIT {limit}"
+        )
+        dicts = fetch_dicts(cur)
+        self.restore_bools(sheet, dicts)
+        return dicts
+
+    def get_clusters(self, sheet, zoom, min_lat, min_lon, max_lat, max_lon):
+        """Returns the precomputed clusters of `sheet` at `zoom`, whose centroids are 
+        within the bounding box.
+
+        Returns:
+            list of dict: Clusters with keys count, lat, lon
+        """
+        zoom = min(max(zoom, 0), CLUSTER_MAX_ZOOM)
+        cur = self.con.execute(
+            f"SELECT count, lat, lon FROM {sheet}_clusters "
+            f"WHERE zoom = {zoom} AND lat BETWEEN {min_lat} AND {max_lat} "
+            f"AND lon BETWEEN {min_lon} AND {max_lon}"
+        )
+        return fetch_dicts(cur)
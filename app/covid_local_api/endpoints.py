@@ -1,19 +1,51 @@
-import geocoder
-import uvicorn
-from starlette.responses import RedirectResponse
-from fastapi import FastAPI, Query, HTTPException
+import asyncio
+import contextvars
+import hmac
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+import ujson
+from concurrent.futures import ThreadPoolExecutor
+from starlette.responses import (
+    RedirectResponse,
+    StreamingResponse,
+    Response,
+    UJSONResponse,
+)
+from starlette.routing import Match
+from fastapi import FastAPI, Header, Query, HTTPException, Request
 from typing import List
 from enum import Enum
-from timeloop import Timeloop
-from datetime import timedelta
 
 from covid_local_api.__version__ import __version__
-from covid_local_api.db_handler import DatabaseHandler
+from covid_local_api.db_handler import (
+    DatabaseHandler,
+    CLUSTER_MAX_ZOOM,
+    TILE_MAX_ZOOM,
+)
+from covid_local_api.place_index import PartitionedPlaceIndex
 from covid_local_api.schema import (
     ResultsList,
     Place,
+    BatchQuery,
+    BoundingBoxResults,
+    SearchResults,
+    ChangeFeed,
+)
+from covid_local_api.utils import (
+    deadline,
+    endpoint_utils,
+    export_utils,
+    metrics,
+    place_request_utils,
+    scheduler,
+    tile_utils,
+    timing,
+    warmup,
 )
-from covid_local_api.utils import endpoint_utils, place_request_utils
 
 
 # TODO: Implement place handler code at some point in the future like below.
@@ -33,17 +65,94 @@ from covid_local_api.utils import endpoint_utils, place_request_utils
 #     return place_handler.resolve_hierarchies(place_id)
 
 
-# Initialize database and schedule daily update
-db = DatabaseHandler()
-tl = Timeloop()
+# Responses of these endpoints only change when the database is updated, so they get an
+# ETag based on the dataset version.
+VERSIONED_PATHS = [
+    "/all",
+    "/hotlines",
+    "/websites",
+    "/health_departments",
+    "/search",
+    "/changes",
+]
+VERSIONED_PATH_PREFIXES = ["/test_sites", "/tiles/", "/export/"]
+CACHE_MAX_AGE = 3600
+
+# Tiles only change once per day, when the database is updated.
+TILE_MAX_AGE = 86400
+
+# Maximum number of places per request to the batch endpoint and number of threads
+# to resolve them in parallel.
+BATCH_MAX_PLACES = 500
+BATCH_MAX_WORKERS = 8
+
+# Health departments are found by the hierarchy of the place. If none matches, the
+# nearest ones within the maximum distance (in degrees lat/lon) are returned instead
+# (by the coordinates of their address, see utils/geocoding.py).
+NEAREST_HEALTH_DEPARTMENTS = 1
+NEAREST_HEALTH_DEPARTMENTS_MAX_DISTANCE = 0.5
+
+# Coordinates are resolved to the nearest place in the place index (within 0.5 degrees
+# lat/lon) or else by geonames. If geonames doesn't respond, places in the index up to
+# this distance are used instead.
+NEAREST_PLACE_FALLBACK_DISTANCE = 2.0
+
+
+# Logs the spans of each request as one JSON object per line.
+timing_log = logging.getLogger("covid_local_api.timing")
+
+
+log = logging.getLogger(__name__)
+
+
+# Local index of places to resolve coordinates and hierarchies without requesting
+# geonames (see scripts/geonames-to-places-csv.py), with one partition per country.
+# The pinned countries are loaded at startup, the others on first use. The sheet data
+# in `db` is not partitioned and always contains all countries.
+data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+place_index = PartitionedPlaceIndex(data_path)
+
+
+# Token for the admin endpoints (which are disabled if it's not set).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+# Database and daily update (see utils/scheduler.py). The data is loaded at startup
+# and not at import, so that importing the api (e.g. in each worker) is fast.
+db = DatabaseHandler(load=False)
 
 
-@tl.job(interval=timedelta(seconds=86400))  # once per day
 def update_database():
+    """Updates the database and renders the exports in a background thread (they
+    aren't needed for the other endpoints, see DatabaseHandler.get_export). New 
+    addresses are geocoded in another background thread."""
     db.update_database()
+    threading.Thread(target=db.render_exports, daemon=True).start()
+    if db.missing_addresses:
+        threading.Thread(target=geocode_addresses, daemon=True).start()
+
+
+def geocode_addresses():
+    """Geocodes the addresses without coordinates from the last update (rate limited,
+    so this can take a while) and adds the coordinates to the database"""
+    try:
+        if db.geocode_missing_addresses() and db.update_coordinates():
+            threading.Thread(target=db.render_exports, daemon=True).start()
+    except Exception:
+        log.exception("Failed to geocode addresses")
+
+
+refresh_scheduler = scheduler.RefreshScheduler(update_database)
 
 
-tl.start()
+# Counts of the requested places, which are saved periodically and used to warm up
+# the caches of upstream requests after a restart (see utils/warmup.py).
+access_summary = warmup.AccessSummary()
+summary_scheduler = scheduler.RefreshScheduler(
+    access_summary.save,
+    interval=warmup.WARMUP_SAVE_INTERVAL,
+    lock_path=warmup.WARMUP_SUMMARY_PATH + ".lock",
+)
 
 
 # Initialize API
@@ -55,27 +164,179 @@ app = FastAPI(
 )
 
 
+@app.on_event("startup")
+async def load_data():
+    """Loads the place index and the database before the first request is served and
+    schedules the updates of the database"""
+    loop = asyncio.get_event_loop()
+    _, loaded = await asyncio.gather(
+        loop.run_in_executor(None, place_index.preload),
+        refresh_scheduler.refresh_now(),
+    )
+    if not loaded:
+        # Serve anyway, the update is retried with backoff.
+        log.error("Failed to load the database at startup")
+    refresh_scheduler.start()
+
+
+@app.on_event("startup")
+async def start_warmup():
+    """Resolves the most requested places in the background, so that their upstream
+    responses are cached, and schedules saving the access summary"""
+    loop = asyncio.get_event_loop()
+    loop.run_in_executor(None, warm_up_caches)
+    summary_scheduler.start()
+
+
+@app.on_event("shutdown")
+async def stop_refresh_scheduler():
+    await refresh_scheduler.stop()
+
+
+@app.on_event("shutdown")
+async def save_access_summary():
+    await summary_scheduler.stop()
+    await summary_scheduler.refresh_now()
+
+
+@app.middleware("http")
+async def add_cache_headers(request, call_next):
+    """Adds ETag and Cache-Control headers to versioned endpoints and answers 
+    conditional requests with 304 (without computing the response)"""
+    path = request.url.path
+    if request.method != "GET" or not (
+        path in VERSIONED_PATHS
+        or any(path.startswith(prefix) for prefix in VERSIONED_PATH_PREFIXES)
+    ):
+        return await call_next(request)
+
+    etag = endpoint_utils.make_etag(db.version, path, request.url.query)
+    cache_headers = {"ETag": etag, "Cache-Control": f"public, max-age={CACHE_MAX_AGE}"}
+    if endpoint_utils.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    response = await call_next(request)
+    if deadline.is_partial():
+        # Don't cache results with local data instead of upstream responses.
+        response.headers["Cache-Control"] = "no-store"
+    elif response.status_code == 200:
+        for key, value in cache_headers.items():
+            if key.lower() not in response.headers:
+                response.headers[key] = value
+    return response
+
+
 # ---------------------------------- Helper functions ----------------------------------
 place_name_query = Query(
     None,
     description="The name of the place, e.g. a city, neighborhood, state (either "
-    "place_name or geonames_id must be provided)",
+    "place_name, geonames_id or lat/lon must be provided)",
 )
 
 
 geonames_id_query = Query(
     None,
-    description="The geonames.org id of the place (either place_name or "
-    "geonames_id must be provided)",
+    description="The geonames.org id of the place (either place_name, "
+    "geonames_id or lat/lon must be provided)",
+)
+
+
+lat_query = Query(
+    None,
+    description="The latitude of the location, e.g. from GPS (either place_name, "
+    "geonames_id or lat/lon must be provided)",
+)
+
+
+lon_query = Query(
+    None,
+    description="The longitude of the location, e.g. from GPS (either place_name, "
+    "geonames_id or lat/lon must be provided)",
+)
+
+
+cursor_query = Query(
+    None,
+    description="Cursor to continue with the next page of results (next_cursor of the "
+    "previous response)",
+)
+
+
+class ResponseFormat(str, Enum):
+    """Enum of the available response formats for the list endpoints"""
+
+    json = "json"
+    ndjson = "ndjson"
+
+
+format_query = Query(
+    ResponseFormat.json,
+    description="Response format. With ndjson, the entries are streamed as one JSON "
+    "object per line (without place and next_cursor)",
 )
 
 
+class ExportFormat(str, Enum):
+    """Enum of the available file formats for the export endpoint"""
+
+    csv = "csv"
+    ndjson = "ndjson"
+    parquet = "parquet"
+
+
 class SearchProvider(str, Enum):
     """Enum of the available search providers for the places endpoint"""
 
     geonames = "geonames"
 
 
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    """Records the latency of each request by endpoint and reports the spans of the 
+    request (see `timing.span`) in the Server-Timing header and the log (added last, 
+    so it also measures the other middlewares, e.g. 304 responses). Also starts the 
+    deadline for the upstream requests of the request (see `deadline.timeout`)."""
+    start = time.perf_counter()
+    spans = timing.start_spans()
+    deadline.start()
+    response = await call_next(request)
+    duration = time.perf_counter() - start
+
+    endpoint = request.scope.get("endpoint")
+    if endpoint is None:
+        # Request was answered before routing (e.g. 304), so look up the route.
+        for route in app.router.routes:
+            match, child_scope = route.matches(request.scope)
+            if match == Match.FULL:
+                endpoint = child_scope.get("endpoint")
+                break
+    endpoint_name = endpoint.__name__ if endpoint is not None else "unmatched"
+    metrics.REQUEST_LATENCY.labels(
+        endpoint_name, request.method, response.status_code
+    ).observe(duration)
+
+    response.headers["Server-Timing"] = timing.server_timing_header(spans, duration)
+    if spans:
+        timing_log.info(
+            ujson.dumps(
+                {
+                    "endpoint": endpoint_name,
+                    "path": request.url.path,
+                    "status": response.status_code,
+                    "duration_ms": round(duration * 1000, 2),
+                    "spans_ms": {
+                        name: round(span * 1000, 2) for name, span in spans.items()
+                    },
+                }
+            )
+        )
+    return response
+
+
+# Search provider of places that were resolved with the local place index.
+LOCAL_SEARCH_PROVIDER = "local"
+
+
 def geocoder_to_place(result):
     """Convert a result object from geocoder to a Place object"""
     return Place(
@@ -91,25 +352,132 @@ def geocoder_to_place(result):
     )
 
 
-def find_place(place_name=None, geonames_id=None):
+def index_to_place(place):
+    """Convert a place from the local place index to a Place object"""
+    return Place(
+        name=place["name"],
+        country_code=place["country_code"],
+        state=place["state"],
+        geonames_id=place["geonames_id"],
+        lat=place["lat"],
+        lon=place["lon"],
+        search_provider=LOCAL_SEARCH_PROVIDER,
+    )
+
+
+# Errors of upstream requests, after which endpoints fall back to local data.
+UPSTREAM_ERRORS = (place_request_utils.UpstreamError, deadline.DeadlineExceeded)
+
+
+def fallback_place(geonames_id):
+    """Returns the place for a geonames id from local data (expired cache entries or 
+    the place index) or None if it's unknown"""
+    entity = place_request_utils.cached_geonames_entity(geonames_id)
+    if entity is not None:
+        return geocoder_to_place(place_request_utils.entity_to_geocoder(entity))
+    place = place_index.get(int(geonames_id))
+    if place is not None:
+        return index_to_place(place)
+    return None
+
+
+def entity_hierarchy(entity):
+    """Returns the hierarchy of a full geonames entity, which contains the ids of its
+    admin areas (more local areas first)"""
+    return [
+        int(entity[key])
+        for key in place_request_utils.GEONAMES_HIERARCHY_KEYS[::-1]
+        if entity.get(key)
+    ]
+
+
+def fallback_hierarchy(geonames_id, country_code=None):
+    """Returns the hierarchy of a geonames id from local data: an expired cache entry, 
+    the admin areas of the cached place or only the place itself and its country (if 
+    `country_code` is given, see `place_request_utils.get_country_geonames_id`)"""
+    hierarchy = place_request_utils.geonames_hierarchy_cache.get_stale(int(geonames_id))
+    if hierarchy is not None:
+        return [item.geonames_id for item in hierarchy[::-1]]
+
+    entity = place_request_utils.cached_geonames_entity(geonames_id)
+    if entity is not None:
+        return entity_hierarchy(entity)
+
+    hierarchy = [int(geonames_id)]
+    country_id = None
+    if country_code:
+        country_id = place_request_utils.get_country_geonames_id(country_code)
+    if country_id is not None:
+        # Keeps country-wide entries (e.g. hotlines) in the results.
+        country_id = int(country_id[len(place_request_utils.GEONAMES_ID_PREFIX) :])
+        if country_id not in hierarchy:
+            hierarchy.append(country_id)
+    return hierarchy
+
+
+def upstream_unavailable(what):
+    return HTTPException(
+        504, f"Could not resolve {what}: upstream services did not respond in time"
+    )
+
+
+def find_nearest_place(lat, lon):
+    """Returns the place closest to lat/lon. 
+    
+    Uses the local place index and only requests geonames if there is no place 
+    nearby in the index. If geonames doesn't respond, the closest place within 
+    NEAREST_PLACE_FALLBACK_DISTANCE in the index is used instead.
+    """
+    place = place_index.nearest(lat, lon)
+    if place is not None:
+        return index_to_place(place)
+
+    try:
+        geonames_id = place_request_utils.search_geonames_nearby(lat, lon)
+    except UPSTREAM_ERRORS as e:
+        log.warning(f"Searching the place index further around {lat}, {lon}: {e}")
+        place = place_index.nearest(
+            lat, lon, max_distance=NEAREST_PLACE_FALLBACK_DISTANCE
+        )
+        if place is None:
+            raise upstream_unavailable(f"lat/lon {lat}, {lon}")
+        deadline.mark_partial()
+        return index_to_place(place)
+    if geonames_id is None:
+        raise HTTPException(400, f"Could not find any place near lat/lon: {lat}, {lon}")
+    return find_place(
+        geonames_id=int(geonames_id[len(place_request_utils.GEONAMES_ID_PREFIX) :])
+    )
+
+
+def find_place(place_name=None, geonames_id=None, lat=None, lon=None):
     """Finds and returns the place for the given query parameters. 
     
     If geonames_id is given, simply get some more information about it. If 
     place_name is given, search the /places endpoint and return the first result. If 
-    neither is given, raise an error.
+    lat/lon are given, return the closest place. If neither is given, raise an error.
     
     Args:
         place_name (str, optional): The name of the place to search for (used as query 
             parameter for the places endpoint)
         geonames_id (int, optional): The geonames.org id of the place
+        lat (float, optional): The latitude of the location
+        lon (float, optional): The longitude of the location
 
     Returns:
         Place: The found place
     """
-    if geonames_id is None and place_name is None:
-        raise HTTPException(400, "Either place_name or geonames_id must be provided")
+    if (lat is None) != (lon is None):
+        raise HTTPException(400, "Both lat and lon must be provided")
+    elif geonames_id is None and place_name is None and lat is None:
+        raise HTTPException(
+            400, "Either place_name, geonames_id or lat/lon must be provided"
+        )
+    elif geonames_id is None and place_name is None:
+        return find_nearest_place(lat, lon)
     elif geonames_id is None:
         # Search by place_name and use first search result.
+        access_summary.record(warmup.PLACE_NAME, place_name)
         places = search_places(q=place_name, limit=1, search_provider="geonames")
         if len(places) == 0:
             raise HTTPException(
@@ -119,23 +487,213 @@ def find_place(place_name=None, geonames_id=None):
             return places[0]
     else:
         # Get details for this geonames_id and return as Place object.
-        search_result = geocoder.geonames(
-            geonames_id, key=place_request_utils.get_geonames_user(), method="details"
-        )[0]
+        access_summary.record(warmup.GEONAMES_ID, geonames_id)
+        try:
+            search_result = place_request_utils.geonames_details(geonames_id)
+        except place_request_utils.NotFoundError:
+            raise HTTPException(400, f"Could not find geonames_id: {geonames_id}")
+        except UPSTREAM_ERRORS as e:
+            log.warning(f"Using local data for geonames_id {geonames_id}: {e}")
+            place = fallback_place(geonames_id)
+            if place is None:
+                raise upstream_unavailable(f"geonames_id {geonames_id}")
+            deadline.mark_partial()
+            return place
         place = geocoder_to_place(search_result)
         return place
 
 
-def get_hierarchy(geonames_id):
-    """Returns geonames ids of hierarchical parents (e.g. country for a city)"""
-    hierarchy = geocoder.geonames(
-        geonames_id, key=place_request_utils.get_geonames_user(), method="hierarchy",
-    )
+def get_hierarchy(geonames_id, country_code=None):
+    """Returns geonames ids of hierarchical parents (e.g. country for a city). 
+    
+    If the country is known, its partition of the place index is used (and loaded if
+    necessary), otherwise only the loaded partitions are searched. Places that were
+    just requested by find_place use the admin areas of their cached entity.
+    """
+    local_hierarchy = place_index.hierarchy(geonames_id, country_code)
+    if local_hierarchy is not None:
+        return local_hierarchy
+
+    entity = place_request_utils.geonames_entity_cache.get(str(int(geonames_id)))
+    if entity is not None:
+        return entity_hierarchy(entity)
+
+    try:
+        hierarchy = place_request_utils.geonames_hierarchy(geonames_id)
+    except place_request_utils.NotFoundError as e:
+        # Geonames answered, so the results are not partial.
+        log.info(f"No hierarchy for {geonames_id}: {e}")
+        return fallback_hierarchy(geonames_id, country_code)
+    except UPSTREAM_ERRORS as e:
+        log.warning(f"Using local hierarchy for {geonames_id}: {e}")
+        deadline.mark_partial()
+        return fallback_hierarchy(geonames_id, country_code)
     hierarchy = hierarchy[::-1]  # reverse, so that more local areas come first
     geonames_ids_hierarchy = [item.geonames_id for item in hierarchy]
     return geonames_ids_hierarchy
 
 
+def warm_up_place(kind, value):
+    """Resolves a place and its hierarchy like find_place and get_hierarchy (without 
+    counting it in the access summary), so that the upstream responses are cached"""
+    if kind == warmup.GEONAMES_ID:
+        place = geocoder_to_place(place_request_utils.geonames_details(value))
+    else:
+        places = search_places(q=value, limit=1, search_provider="geonames")
+        if not places:
+            return
+        place = places[0]
+    get_hierarchy(place.geonames_id, place.country_code)
+
+
+def warm_up_caches():
+    queries = access_summary.top(warmup.WARMUP_TOP_N)
+    if queries:
+        warmup.warm_up(queries, warm_up_place)
+
+
+def map_in_threads(func, items, budget=None):
+    """Calls `func` for all items in BATCH_MAX_WORKERS threads (in copies of the 
+    context of the current request) and returns the results.
+
+    By default, all items share the deadline of the request. If `budget` is given, 
+    each item gets its own deadline of `budget` seconds instead (see `deadline.start`), 
+    so slow upstream requests for some items don't use up the budget of the others. 
+    The deadline of an item never ends after the deadline of the request.
+    """
+
+    def run(item):
+        if budget is not None:
+            request_deadline = deadline.current()
+            if request_deadline is None:
+                deadline.start(budget)
+            else:
+                deadline.start(min(budget, request_deadline.remaining()))
+        return func(item)
+
+    contexts = [contextvars.copy_context() for _ in items]
+    with ThreadPoolExecutor(BATCH_MAX_WORKERS) as executor:
+        return list(
+            executor.map(lambda context, item: context.run(run, item), contexts, items)
+        )
+
+
+def find_places(place_names=None, geonames_ids=None):
+    """Finds the places and their hierarchies for many place names and geonames ids 
+    in parallel. 
+
+    Duplicate inputs are only resolved once. Each input is resolved with its own 
+    deadline of UPSTREAM_DEADLINE seconds (but at most until the deadline of the 
+    request), so its results are only marked as partial if local data was used for 
+    this place. Places that cannot be found do not raise 
+    an error but are returned as error messages instead.
+
+    Args:
+        place_names (list of str, optional): The names of the places to search for
+        geonames_ids (list of int, optional): The geonames.org ids of the places
+
+    Returns:
+        list of tuple: (query, result) for each unique input in the order of the 
+            inputs (geonames ids first), where query is a dict with the geonames_id 
+            or place_name and result is a (Place, hierarchy, partial) tuple or the 
+            error message if the place could not be resolved
+    """
+    queries = [{"geonames_id": geonames_id} for geonames_id in geonames_ids or []]
+    queries += [{"place_name": place_name} for place_name in place_names or []]
+    queries = [dict(t) for t in dict.fromkeys(tuple(q.items()) for q in queries)]
+
+    def resolve_place_or_error(query):
+        try:
+            place = find_place(**query)
+            hierarchy = get_hierarchy(place.geonames_id, place.country_code)
+        except HTTPException as e:
+            return e.detail
+        except Exception:
+            return f"Could not resolve place: {query}"
+        return place, hierarchy, deadline.is_partial()
+
+    results = map_in_threads(
+        resolve_place_or_error, queries, budget=deadline.UPSTREAM_DEADLINE
+    )
+    return list(zip(queries, results))
+
+
+def results_content(place, **results):
+    """Returns the content of a ResultsList for `place` as a dict. 
+
+    Database rows are coerced to the schemas when they are imported (see 
+    `db_handler.coerce_sheet`), so they are not validated again here. This saves a lot 
+    of CPU time per request compared to returning a ResultsList through FastAPI.
+
+    Args:
+        place (Place): The place of the results
+        **results: Database rows for hotlines, websites, test_sites and 
+            health_departments (and optionally next_cursor and partial, which 
+            defaults to whether the current request used local data)
+
+    Returns:
+        dict: The content of the ResultsList, which can be serialized directly
+    """
+    content = {
+        "place": place.dict(),
+        "hotlines": [],
+        "websites": [],
+        "test_sites": [],
+        "health_departments": [],
+        "next_cursor": None,
+        "partial": deadline.is_partial(),
+    }
+    content.update(results)
+    return content
+
+
+def list_response(place, sheet, entries, limit, format):
+    """Returns the entries of one sheet for a place as response.
+
+    Args:
+        place (Place): The place of the results
+        sheet (str): The sheet of the entries, e.g. hotlines
+        entries (iterator of tuple): (position, dict) pairs from 
+            `DatabaseHandler.iter_rows` or `DatabaseHandler.iter_nearby`
+        limit (int): The page size (if None, all entries are returned)
+        format (ResponseFormat): The response format
+
+    Returns:
+        Response: A ResultsList (with next_cursor if there may be more entries) or 
+            a stream of newline-delimited JSON entries
+    """
+    if format == ResponseFormat.ndjson:
+        lines = (ujson.dumps(d, ensure_ascii=False) + "\n" for _, d in entries)
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    rows = []
+    position = None
+    for position, d in entries:
+        rows.append(d)
+
+    next_cursor = None
+    if limit is not None and len(rows) == limit:
+        next_cursor = endpoint_utils.encode_cursor(db.version, position)
+    return UJSONResponse(
+        results_content(place, **{sheet: rows}, next_cursor=next_cursor)
+    )
+
+
+def iter_nearest_health_departments(place, after, limit):
+    """Yields the nearest health departments to `place` (see 
+    `DatabaseHandler.iter_nearby`), by default only NEAREST_HEALTH_DEPARTMENTS"""
+    if place.lat is None or place.lon is None:
+        return iter([])
+    return db.iter_nearby(
+        "health_departments",
+        place.lat,
+        place.lon,
+        max_distance=NEAREST_HEALTH_DEPARTMENTS_MAX_DISTANCE,
+        after=after,
+        limit=limit or NEAREST_HEALTH_DEPARTMENTS,
+    )
+
+
 # ---------------------------------- Endpoints -----------------------------------------
 @app.get(
     "/places",
@@ -154,13 +712,17 @@ def search_places(
     ),
 ):
     if search_provider == SearchProvider.geonames:
-        # Search geonames API.
-        search_results = geocoder.geonames(
-            q,
-            key=place_request_utils.get_geonames_user(),
-            maxRows=limit,
-            featureClass=["A", "P"],
-        )
+        # Search geonames API (or use expired results if it doesn't respond).
+        try:
+            search_results = place_request_utils.geonames_search(q, limit)
+        except UPSTREAM_ERRORS as e:
+            log.warning(f"Using cached search results for {q}: {e}")
+            search_results = place_request_utils.geonames_search_cache.get_stale(
+                (q, limit)
+            )
+            if search_results is None:
+                raise upstream_unavailable(f"place search: {q}")
+            deadline.mark_partial()
 
         # Format the search results to Place objects and return them.
         places = [geocoder_to_place(result) for result in search_results]
@@ -169,56 +731,196 @@ def search_places(
         raise HTTPException(400, f"Search provider not supported: {search_provider}")
 
 
+@app.get(
+    "/search",
+    summary="Search hotlines and websites via free-form query (sorted by relevance)",
+    response_model=SearchResults,
+)
+def search(
+    q: str = Query(
+        ..., description="Free-form query string (e.g. Kinder, Quarantäne, ...)"
+    ),
+    place_name: str = Query(
+        None,
+        description="Only search entries for this place (and its hierarchical "
+        "parents), e.g. a city, neighborhood, state",
+    ),
+    geonames_id: int = Query(
+        None,
+        description="Only search entries for the place with this geonames.org id "
+        "(and its hierarchical parents)",
+    ),
+    limit: int = Query(20, description="Maximum number of entries to return"),
+):
+    place = None
+    geonames_ids_hierarchy = None
+    if place_name is not None or geonames_id is not None:
+        place = find_place(place_name, geonames_id)
+        geonames_ids_hierarchy = get_hierarchy(place.geonames_id, place.country_code)
+
+    return UJSONResponse(
+        {
+            "place": place.dict() if place is not None else None,
+            "hotlines": db.search("hotlines", q, geonames_ids_hierarchy, limit),
+            "websites": db.search("websites", q, geonames_ids_hierarchy, limit),
+            "partial": deadline.is_partial(),
+        }
+    )
+
+
 @app.get(
     "/all", summary="Get all items for a place", response_model=ResultsList,
 )
+@timing.profiled
 def get_all(
     place_name: str = place_name_query,
     geonames_id: int = geonames_id_query,
+    lat: float = lat_query,
+    lon: float = lon_query,
     max_distance: float = Query(
         0.5, description="Maximum distance in degrees lon/lat for test sites"
     ),
     limit: int = Query(5, description="Maximum number of test sites to return"),
 ):
-    place = find_place(place_name, geonames_id)
-    geonames_ids_hierarchy = get_hierarchy(place.geonames_id)
-    return {
-        "place": place,
-        "hotlines": db.get("hotlines", geonames_ids_hierarchy),
-        "websites": db.get("websites", geonames_ids_hierarchy),
-        "test_sites": db.get_nearby(
+    with timing.span("find_place"):
+        place = find_place(place_name, geonames_id, lat, lon)
+    with timing.span("get_hierarchy"):
+        geonames_ids_hierarchy = get_hierarchy(place.geonames_id, place.country_code)
+    # Search test sites around the exact location if it was given.
+    if lat is not None:
+        place.lat, place.lon = lat, lon
+
+    with timing.span("db_get"):
+        hotlines = db.get("hotlines", geonames_ids_hierarchy)
+        websites = db.get("websites", geonames_ids_hierarchy)
+        health_departments = db.get("health_departments", geonames_ids_hierarchy)
+    with timing.span("get_nearby"):
+        if not health_departments and place.lat is not None:
+            health_departments = db.get_nearby(
+                "health_departments",
+                place.lat,
+                place.lon,
+                max_distance=NEAREST_HEALTH_DEPARTMENTS_MAX_DISTANCE,
+                limit=NEAREST_HEALTH_DEPARTMENTS,
+            )
+        test_sites = db.get_nearby(
             "test_sites", place.lat, place.lon, max_distance=max_distance, limit=limit
-        ),
-        "health_departments": db.get("health_departments", geonames_ids_hierarchy),
-    }
+        )
+    with timing.span("render"):
+        return UJSONResponse(
+            results_content(
+                place,
+                hotlines=hotlines,
+                websites=websites,
+                test_sites=test_sites,
+                health_departments=health_departments,
+            )
+        )
+
+
+@app.post(
+    "/all/batch",
+    summary="Get all items for many places at once (streamed as one JSON object "
+    "per line)",
+)
+@timing.profiled
+def get_all_batch(query: BatchQuery):
+    """Streams newline-delimited JSON with one `ResultsList` object per unique input, 
+    in the order of the inputs (geonames_ids first, then place_names). 
+    
+    Each object contains the input as `query`, e.g. `{"geonames_id": 2950159}`. Places 
+    that could not be found are returned as `{"query": ..., "error": ...}` objects.
+    """
+    if len(query.geonames_ids) + len(query.place_names) > BATCH_MAX_PLACES:
+        raise HTTPException(
+            400, f"At most {BATCH_MAX_PLACES} places can be requested at once"
+        )
+
+    with timing.span("find_places"):
+        results = find_places(query.place_names, query.geonames_ids)
+    found = [result for _, result in results if isinstance(result, tuple)]
+    places, hierarchies, partial = zip(*found) if found else ([], [], [])
+
+    # Run one query per sheet for all places.
+    with timing.span("db_get"):
+        hotlines = db.get_many("hotlines", hierarchies)
+        websites = db.get_many("websites", hierarchies)
+        health_departments = db.get_many("health_departments", hierarchies)
+    with timing.span("get_nearby"):
+        # Nearest health departments for the places without match in the hierarchy.
+        unmatched = [i for i, entries in enumerate(health_departments) if not entries]
+        nearest_health_departments = db.get_nearby_many(
+            "health_departments",
+            [(places[i].lat, places[i].lon) for i in unmatched],
+            max_distance=NEAREST_HEALTH_DEPARTMENTS_MAX_DISTANCE,
+            limit=NEAREST_HEALTH_DEPARTMENTS,
+        )
+        for i, entries in zip(unmatched, nearest_health_departments):
+            health_departments[i] = entries
+        test_sites = db.get_nearby_many(
+            "test_sites",
+            [(place.lat, place.lon) for place in places],
+            max_distance=query.max_distance,
+            limit=query.limit,
+        )
+
+    def generate_lines():
+        i = 0
+        for place_query, result in results:
+            if not isinstance(result, tuple):
+                content = {"query": place_query, "error": result}
+            else:
+                content = results_content(
+                    places[i],
+                    query=place_query,
+                    hotlines=hotlines[i],
+                    websites=websites[i],
+                    test_sites=test_sites[i],
+                    health_departments=health_departments[i],
+                    partial=partial[i],
+                )
+                i += 1
+            yield ujson.dumps(content, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
 
 
 @app.get(
     "/hotlines", summary=f"Get hotlines for a place", response_model=ResultsList,
 )
 def get_hotlines(
-    place_name: str = place_name_query, geonames_id: int = geonames_id_query,
+    place_name: str = place_name_query,
+    geonames_id: int = geonames_id_query,
+    limit: int = Query(
+        None, description="Maximum number of hotlines to return (default: all)"
+    ),
+    cursor: str = cursor_query,
+    format: ResponseFormat = format_query,
 ):
     place = find_place(place_name, geonames_id)
-    geonames_ids_hierarchy = get_hierarchy(place.geonames_id)
-    return {
-        "place": place,
-        "hotlines": db.get("hotlines", geonames_ids_hierarchy),
-    }
+    geonames_ids_hierarchy = get_hierarchy(place.geonames_id, place.country_code)
+    after = endpoint_utils.decode_cursor(cursor, db.version) if cursor else None
+    entries = db.iter_rows("hotlines", geonames_ids_hierarchy, after=after, limit=limit)
+    return list_response(place, "hotlines", entries, limit, format)
 
 
 @app.get(
     "/websites", summary=f"Get websites for a place", response_model=ResultsList,
 )
 def get_websites(
-    place_name: str = place_name_query, geonames_id: int = geonames_id_query,
+    place_name: str = place_name_query,
+    geonames_id: int = geonames_id_query,
+    limit: int = Query(
+        None, description="Maximum number of websites to return (default: all)"
+    ),
+    cursor: str = cursor_query,
+    format: ResponseFormat = format_query,
 ):
     place = find_place(place_name, geonames_id)
-    geonames_ids_hierarchy = get_hierarchy(place.geonames_id)
-    return {
-        "place": place,
-        "websites": db.get("websites", geonames_ids_hierarchy),
-    }
+    geonames_ids_hierarchy = get_hierarchy(place.geonames_id, place.country_code)
+    after = endpoint_utils.decode_cursor(cursor, db.version) if cursor else None
+    entries = db.iter_rows("websites", geonames_ids_hierarchy, after=after, limit=limit)
+    return list_response(place, "websites", entries, limit, format)
 
 
 @app.get(
@@ -229,19 +931,89 @@ def get_websites(
 def get_test_sites(
     place_name: str = place_name_query,
     geonames_id: int = geonames_id_query,
+    lat: float = lat_query,
+    lon: float = lon_query,
     max_distance: float = Query(
         0.5, description="Maximum distance in degrees lon/lat for test sites"
     ),
     limit: int = Query(5, description="Maximum number of test sites to return"),
+    cursor: str = cursor_query,
+    format: ResponseFormat = format_query,
 ):
-    place = find_place(place_name, geonames_id)
-    # lat, lon = get_lat_lon(geonames_id)
-    return {
-        "geonames_id": geonames_id,
-        "test_sites": db.get_nearby(
-            "test_sites", place.lat, place.lon, max_distance=max_distance, limit=limit
-        ),
-    }
+    place = find_place(place_name, geonames_id, lat, lon)
+    # Search test sites around the exact location if it was given.
+    if lat is not None:
+        place.lat, place.lon = lat, lon
+    after = endpoint_utils.decode_cursor(cursor, db.version) if cursor else None
+    entries = db.iter_nearby(
+        "test_sites",
+        place.lat,
+        place.lon,
+        max_distance=max_distance,
+        after=after,
+        limit=limit,
+    )
+    return list_response(place, "test_sites", entries, limit, format)
+
+
+@app.get(
+    "/test_sites/bbox",
+    summary="Get test sites within a bounding box, e.g. the visible area of a map "
+    "(clustered at low zoom levels)",
+    response_model=BoundingBoxResults,
+)
+def get_test_sites_in_bbox(
+    min_lat: float = Query(..., description="Southern border of the bounding box"),
+    min_lon: float = Query(..., description="Western border of the bounding box"),
+    max_lat: float = Query(..., description="Northern border of the bounding box"),
+    max_lon: float = Query(..., description="Eastern border of the bounding box"),
+    zoom: int = Query(
+        None,
+        description="Zoom level of the map (default and maximum: derived from the "
+        f"size of the bounding box). Up to zoom level {CLUSTER_MAX_ZOOM}, clusters are "
+        "returned instead of single test sites",
+    ),
+    limit: int = Query(
+        500,
+        description="Maximum number of test sites to return. If there are more test "
+        "sites in the bounding box, clusters are returned instead",
+    ),
+):
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(400, "min_lat/min_lon must be smaller than max_lat/max_lon")
+    # The zoom level at which the bounding box fits into a map tile, so that the
+    # number of clusters is bounded (also if a client sends a high zoom level with a
+    # large bounding box).
+    lon_zoom = math.log2(360 / max(max_lon - min_lon, 1e-6))
+    lat_zoom = math.log2(180 / max(max_lat - min_lat, 1e-6))
+    fitting_zoom = int(min(lon_zoom, lat_zoom))
+    zoom = max(0, fitting_zoom if zoom is None else min(zoom, fitting_zoom))
+
+    bbox = (min_lat, min_lon, max_lat, max_lon)
+    if zoom > CLUSTER_MAX_ZOOM and db.count_in_bbox("test_sites", *bbox) <= limit:
+        return {
+            "zoom": zoom,
+            "test_sites": db.get_in_bbox("test_sites", *bbox, limit=limit),
+        }
+    else:
+        return {
+            "zoom": zoom,
+            "clusters": db.get_clusters("test_sites", zoom, *bbox),
+        }
+
+
+@app.get(
+    "/tiles/{z}/{x}/{y}",
+    summary=f"Get a map tile with test sites as GeoJSON (clustered up to zoom level "
+    f"{CLUSTER_MAX_ZOOM})",
+)
+def get_tile(z: int, x: int, y: int):
+    if z < 0 or z > TILE_MAX_ZOOM:
+        raise HTTPException(404, f"Tiles are only available up to zoom {TILE_MAX_ZOOM}")
+    content = db.tiles.get((z, x, y), tile_utils.EMPTY_TILE)
+    return endpoint_utils.static_response(
+        content, media_type="application/geo+json", max_age=TILE_MAX_AGE
+    )
 
 
 @app.get(
@@ -249,18 +1021,106 @@ def get_test_sites(
     summary=f"Get responsible health departments for a place",
     response_model=ResultsList,
 )
-# TODO: This doesn't return results if e.g. Berlin is selected but the health department
-#   is in Berlin Mitte. Maybe also search for the direct children of the geonames id
-#   (but is direct children enough)?
 def get_health_departments(
-    place_name: str = place_name_query, geonames_id: int = geonames_id_query,
+    place_name: str = place_name_query,
+    geonames_id: int = geonames_id_query,
+    limit: int = Query(
+        None,
+        description="Maximum number of health departments to return (default: all)",
+    ),
+    cursor: str = cursor_query,
+    format: ResponseFormat = format_query,
 ):
     place = find_place(place_name, geonames_id)
-    geonames_ids_hierarchy = get_hierarchy(place.geonames_id)
-    return {
-        "place": place,
-        "health_departments": db.get("health_departments", geonames_ids_hierarchy),
-    }
+    geonames_ids_hierarchy = get_hierarchy(place.geonames_id, place.country_code)
+    after = endpoint_utils.decode_cursor(cursor, db.version) if cursor else None
+    # Positions of the nearest health departments are (distance, rowid), positions of
+    # the matches in the hierarchy (rowid,).
+    if after is not None and len(after) == 2:
+        entries = iter_nearest_health_departments(place, after, limit)
+    else:
+        entries = db.iter_rows(
+            "health_departments", geonames_ids_hierarchy, after=after, limit=limit
+        )
+        if after is None:
+            first_entry = next(entries, None)
+            if first_entry is None:
+                # E.g. Berlin is selected, but the health departments are in the
+                # districts of Berlin.
+                entries = iter_nearest_health_departments(place, None, limit)
+            else:
+                entries = itertools.chain([first_entry], entries)
+    return list_response(place, "health_departments", entries, limit, format)
+
+
+@app.get(
+    "/export/{sheet}",
+    summary="Download the current data of a sheet (hotlines, websites, test_sites, "
+    "health_departments) or of all sheets (all)",
+)
+def export(
+    request: Request,
+    sheet: str,
+    format: ExportFormat = Query(
+        ExportFormat.csv,
+        description="File format: csv or ndjson (compressed with gzip) or parquet. "
+        "The export of all sheets is a zip archive of csv or parquet files or a "
+        "single ndjson file (with an additional sheet key)",
+    ),
+):
+    content = db.get_export(sheet, format.value)
+    if content is None:
+        raise HTTPException(404, f"No export available for {sheet} as {format.value}")
+
+    if sheet == export_utils.ALL_SHEETS:
+        media_type, extension = export_utils.ALL_SHEETS_EXPORT_FORMATS[format.value]
+    else:
+        media_type, extension = export_utils.EXPORT_FORMATS[format.value]
+    return endpoint_utils.static_file_response(
+        request,
+        content,
+        media_type=media_type,
+        filename=f"covid-local-{sheet}-{db.version}.{extension}",
+        etag=endpoint_utils.make_etag(db.version, request.url.path, request.url.query),
+        max_age=CACHE_MAX_AGE,
+    )
+
+
+@app.get(
+    "/changes",
+    summary="Get the changes of all sheets since a previous version of the data "
+    "(version is part of the export file names)",
+    response_model=ChangeFeed,
+)
+def get_changes(
+    since: str = Query(..., description="The dataset version to get the changes for"),
+):
+    changes = db.get_changes(since)
+    if changes is None:
+        raise HTTPException(
+            410,
+            f"Changes since version {since} are not available anymore, please "
+            "download the full data from /export/all",
+        )
+    return UJSONResponse({"since": since, "version": db.version, "changes": changes})
+
+
+@app.post("/admin/refresh", include_in_schema=False)
+async def refresh_database(x_admin_token: str = Header(None)):
+    """Updates the database now (requires the ADMIN_TOKEN in the X-Admin-Token 
+    header)"""
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(403, "Invalid admin token")
+    if not await refresh_scheduler.refresh_now():
+        raise HTTPException(500, f"Refresh failed: {refresh_scheduler.last_error}")
+    return {"version": db.version, "updated_at": db.updated_at.isoformat()}
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    content, media_type = metrics.render_metrics()
+    # Media type already contains the charset, so don't let starlette add it again.
+    return Response(content, headers={"Content-Type": media_type})
 
 
 @app.get(
@@ -277,4 +1137,6 @@ endpoint_utils.use_route_names_as_operation_ids(app)
 
 # Run uvicorn server directly in here for debugging
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, debug=True)
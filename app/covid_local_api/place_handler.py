@@ -123,7 +123,6 @@ class PlaceHandler:
             key_to_add = key
         elif key.startswith(GEONAMES_ID_PREFIX):
             key_to_add = self.map_geonames_to_wikidata(key)
-            print(key_to_add)
         elif key.startswith(OSM_ID_PREFIX):
             key_to_add = self.map_osm_to_wikidata()(key)
 
@@ -0,0 +1,349 @@
+import csv
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from covid_local_api.utils import metrics
+
+log = logging.getLogger(__name__)
+
+# Feature class of populated places (cities, villages, ...) in geonames.
+POPULATED_PLACE_FEATURE_CLASS = "P"
+
+# The place index of each country is a file {country_code}_places.csv in the data
+# directory (see scripts/geonames-to-places-csv.py).
+PLACES_FILE_SUFFIX = "_places.csv"
+
+# Countries whose place indexes are loaded at startup and never evicted (comma
+# separated). Lookups without a known country (e.g. by geonames id or coordinates)
+# search these and the other countries that are currently loaded.
+PLACE_INDEX_COUNTRIES = [
+    country_code.strip().upper()
+    for country_code in os.getenv("PLACE_INDEX_COUNTRIES", "DE").split(",")
+    if country_code.strip()
+]
+
+# Maximum number of place indexes of other countries that are kept in memory (the
+# least recently used one is evicted when another country is loaded).
+PLACE_INDEX_MAX_LOADED = int(os.getenv("PLACE_INDEX_MAX_LOADED", 4))
+
+
+def distance(place: dict, lat: float, lon: float) -> float:
+    """Returns the distance between a place and lat/lon in degrees latitude.
+
+    Longitudes are scaled by the cosine of the latitude, so that the distance is
+    roughly proportional to kilometers.
+    """
+    lon_scale = max(math.cos(math.radians(lat)), 0.01)
+    return math.sqrt(
+        (place["lat"] - lat) ** 2 + ((place["lon"] - lon) * lon_scale) ** 2
+    )
+
+
+def load_place_index(places_csv_path: str, cell_size: float = 0.1):
+    """Loads a place index from a csv file created with
+    `scripts/geonames-to-places-csv.py`.
+
+    Returns an empty index if the file does not exist.
+    """
+    places = []
+    if not os.path.exists(places_csv_path):
+        log.info("No place index found at: " + places_csv_path)
+        return PlaceIndex(places, cell_size)
+
+    with open(places_csv_path, "r", encoding="utf-8") as f:
+        csv_reader = csv.DictReader(f, delimiter=",")
+        for row in csv_reader:
+            places.append(
+                {
+                    "geonames_id": int(row["geonames_id"]),
+                    "name": row["name"],
+                    "country_code": row["country_code"] or None,
+                    "state": row["state"] or None,
+                    "feature_class": row["feature_class"],
+                    "lat": float(row["lat"]),
+                    "lon": float(row["lon"]),
+                    "hierarchy": [int(item) for item in row["hierarchy"].split()],
+                }
+            )
+    return PlaceIndex(places, cell_size)
+
+
+class PlaceIndex:
+    """In-memory index of places to resolve coordinates and hierarchies without
+    requesting geonames.
+
+    Populated places are stored in a grid of `cell_size` x `cell_size` degrees, so
+    that the nearest place for a coordinate only has to be searched in the
+    surrounding cells.
+    """
+
+    def __init__(self, places: List[dict], cell_size: float = 0.1):
+        self._cell_size = cell_size
+        self._places = {}
+        self._grid = {}
+        # Bounding box of the populated places (min_lat, min_lon, max_lat, max_lon).
+        self.bounds = None
+
+        for place in places:
+            self._places[place["geonames_id"]] = place
+            if place["feature_class"] == POPULATED_PLACE_FEATURE_CLASS:
+                self._grid.setdefault(
+                    self._cell(place["lat"], place["lon"]), []
+                ).append(place)
+                self._extend_bounds(place["lat"], place["lon"])
+
+    def __len__(self):
+        return len(self._places)
+
+    def __contains__(self, geonames_id):
+        return geonames_id in self._places
+
+    def _cell(self, lat: float, lon: float):
+        return (int(lat // self._cell_size), int(lon // self._cell_size))
+
+    def _extend_bounds(self, lat: float, lon: float):
+        if self.bounds is None:
+            self.bounds = (lat, lon, lat, lon)
+        else:
+            min_lat, min_lon, max_lat, max_lon = self.bounds
+            self.bounds = (
+                min(min_lat, lat),
+                min(min_lon, lon),
+                max(max_lat, lat),
+                max(max_lon, lon),
+            )
+
+    def covers(self, lat: float, lon: float, margin: float = 0) -> bool:
+        """Returns True if lat/lon is within the bounding box of the populated places
+        (extended by `margin` degrees)"""
+        if self.bounds is None:
+            return False
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        return (
+            min_lat - margin <= lat <= max_lat + margin
+            and min_lon - margin <= lon <= max_lon + margin
+        )
+
+    def get(self, geonames_id: int) -> Optional[dict]:
+        return self._places.get(geonames_id)
+
+    def hierarchy(self, geonames_id: int) -> Optional[List[int]]:
+        """Returns the geonames ids of the place and its parents (more local areas
+        first) or None if the place is not in the index."""
+        place = self._places.get(geonames_id)
+        if place is None:
+            return None
+        return list(place["hierarchy"])
+
+    def nearest(
+        self, lat: float, lon: float, max_distance: float = 0.5
+    ) -> Optional[dict]:
+        """Returns the populated place closest to lat/lon or None if there is no
+        place within `max_distance` (in degrees latitude, see `distance`).
+        """
+        lon_scale = max(math.cos(math.radians(lat)), 0.01)
+        center_lat_cell, center_lon_cell = self._cell(lat, lon)
+        max_ring = int(math.ceil(max_distance / (self._cell_size * lon_scale)))
+
+        best_place = None
+        best_distance = max_distance
+        for ring in range(max_ring + 1):
+            # All places in rings further out are at least this far away.
+            if best_place is not None and best_distance < (
+                (ring - 1) * self._cell_size * lon_scale
+            ):
+                break
+
+            for lat_cell in range(center_lat_cell - ring, center_lat_cell + ring + 1):
+                for lon_cell in range(
+                    center_lon_cell - ring, center_lon_cell + ring + 1
+                ):
+                    # Only visit the border of the ring.
+                    if (
+                        max(
+                            abs(lat_cell - center_lat_cell),
+                            abs(lon_cell - center_lon_cell),
+                        )
+                        != ring
+                    ):
+                        continue
+
+                    for place in self._grid.get((lat_cell, lon_cell), []):
+                        place_distance = distance(place, lat, lon)
+                        if place_distance <= best_distance:
+                            best_place = place
+                            best_distance = place_distance
+        return best_place
+
+
+class PartitionedPlaceIndex:
+    """Place indexes per country, which are loaded on first use.
+
+    The `pinned` countries are loaded by `preload` and stay in memory. Of the other
+    countries, at most `max_loaded` are kept in memory and the least recently used
+    one is evicted when another one is loaded. So adding place indexes of other
+    countries doesn't increase the startup time and memory of workers that only
+    serve the pinned countries.
+
+    Only the place index is partitioned. The sheet data (hotlines, websites, test
+    sites and health departments) of all countries is still loaded into one database
+    at startup (see `DatabaseHandler`), so it grows with every country in the sheet.
+
+    Args:
+        data_path (str): Directory with the files {country_code}_places.csv
+        pinned (list of str): Countries that are loaded at startup and never evicted
+        max_loaded (int): Maximum number of other countries in memory
+        cell_size (float): Size of the grid cells (see `PlaceIndex`)
+    """
+
+    def __init__(
+        self,
+        data_path: str,
+        pinned: List[str] = PLACE_INDEX_COUNTRIES,
+        max_loaded: int = PLACE_INDEX_MAX_LOADED,
+        cell_size: float = 0.1,
+    ):
+        self.data_path = data_path
+        self.pinned = [country_code.upper() for country_code in pinned]
+        self.max_loaded = max_loaded
+        self.cell_size = cell_size
+        self.countries = self._find_countries()
+        # Loaded indexes by country code (least recently used first).
+        self._partitions = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def __len__(self):
+        """Returns the number of places in the loaded indexes"""
+        with self._lock:
+            return sum(len(index) for index in self._partitions.values())
+
+    def _find_countries(self) -> List[str]:
+        if not os.path.isdir(self.data_path):
+            return []
+        return sorted(
+            name[: -len(PLACES_FILE_SUFFIX)]
+            for name in os.listdir(self.data_path)
+            if name.endswith(PLACES_FILE_SUFFIX)
+        )
+
+    def path(self, country_code: str) -> str:
+        return os.path.join(self.data_path, country_code + PLACES_FILE_SUFFIX)
+
+    def loaded(self) -> List[str]:
+        """Returns the codes of the countries that are in memory"""
+        with self._lock:
+            return list(self._partitions)
+
+    def partition(self, country_code: str) -> Optional[PlaceIndex]:
+        """Returns the place index of a country (and loads it if necessary) or None if
+        there is no index for the country"""
+        country_code = country_code.upper()
+        with self._lock:
+            index = self._partitions.get(country_code)
+            if index is not None:
+                self._partitions.move_to_end(country_code)
+                return index
+            if country_code not in self.countries:
+                return None
+            load_lock = self._load_locks.setdefault(country_code, threading.Lock())
+
+        # Load without holding the main lock, so lookups in other countries aren't
+        # blocked (and concurrent lookups in this country load it only once).
+        with load_lock:
+            with self._lock:
+                index = self._partitions.get(country_code)
+            if index is None:
+                index = load_place_index(self.path(country_code), self.cell_size)
+                log.info(f"Loaded place index of {country_code} ({len(index)} places)")
+                metrics.PLACE_INDEX_LOADS.labels(country_code).inc()
+                metrics.PLACE_INDEX_PLACES.labels(country_code).set(len(index))
+                with self._lock:
+                    self._partitions[country_code] = index
+                    self._evict_least_recently_used()
+        return index
+
+    def _evict_least_recently_used(self):
+        unpinned = [
+            country_code
+            for country_code in self._partitions
+            if country_code not in self.pinned
+        ]
+        for country_code in unpinned[: max(len(unpinned) - self.max_loaded, 0)]:
+            self._remove(country_code)
+
+    def _remove(self, country_code: str):
+        del self._partitions[country_code]
+        metrics.PLACE_INDEX_PLACES.labels(country_code).set(0)
+        log.info(f"Evicted place index of {country_code}")
+
+    def evict(self, country_code: str):
+        """Removes the place index of a country from memory (it's loaded again on the
+        next lookup in the country)"""
+        with self._lock:
+            if country_code.upper() in self._partitions:
+                self._remove(country_code.upper())
+
+    def preload(self):
+        """Loads the place indexes of the pinned countries"""
+        for country_code in self.pinned:
+            if self.partition(country_code) is None:
+                log.warning(
+                    f"No place index found for pinned country {country_code}, so its "
+                    "coordinates and hierarchies are requested from geonames"
+                )
+
+    def _candidates(self, country_code: str = None) -> List[PlaceIndex]:
+        # The index of the given country or all loaded indexes if it's unknown.
+        if country_code:
+            index = self.partition(country_code)
+            return [] if index is None else [index]
+        with self._lock:
+            return list(self._partitions.values())
+
+    def get(self, geonames_id: int, country_code: str = None) -> Optional[dict]:
+        """Returns a place from the index of `country_code` (loaded if necessary) or,
+        if the country is unknown, from the loaded indexes"""
+        for index in self._candidates(country_code):
+            place = index.get(geonames_id)
+            if place is not None:
+                return place
+        return None
+
+    def hierarchy(
+        self, geonames_id: int, country_code: str = None
+    ) -> Optional[List[int]]:
+        """Returns the hierarchy of a place (see `PlaceIndex.hierarchy`) from the
+        index of `country_code` or, if the country is unknown, from the loaded
+        indexes"""
+        for index in self._candidates(country_code):
+            hierarchy = index.hierarchy(geonames_id)
+            if hierarchy is not None:
+                return hierarchy
+        return None
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        max_distance: float = 0.5,
+        country_code: str = None,
+    ) -> Optional[dict]:
+        """Returns the populated place closest to lat/lon (see `PlaceIndex.nearest`)
+        from the index of `country_code` or, if the country is unknown, from the
+        loaded indexes that cover lat/lon"""
+        best_place = None
+        for index in self._candidates(country_code):
+            if not index.covers(lat, lon, margin=max_distance):
+                continue
+            place = index.nearest(lat, lon, max_distance)
+            if place is not None and (
+                best_place is None
+                or distance(place, lat, lon) < distance(best_place, lat, lon)
+            ):
+                best_place = place
+        return best_place
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
 # Field validation
@@ -70,6 +70,9 @@ class HealthDepartment(BaseModel):
     country_code: Optional[str] = None
     place: Optional[str] = None
     geonames_id: Optional[int] = None
+    # Geocoded from the address at import if missing (see utils/geocoding.py).
+    lat: Optional[float] = None
+    lon: Optional[float] = None
 
     name: Optional[str] = None
     department: Optional[str] = None
@@ -83,6 +86,8 @@ class HealthDepartment(BaseModel):
     website: Optional[str] = None
     sources: Optional[str] = None
 
+    distance: Optional[float] = None  # added dynamically (for nearest departments)
+
 
 class ResultsList(BaseModel):
     place: Place
@@ -90,3 +95,44 @@ class ResultsList(BaseModel):
     websites: List[Website] = []
     test_sites: List[TestSite] = []
     health_departments: List[HealthDepartment] = []
+    next_cursor: Optional[str] = None
+    # True if local data was used, because upstream services didn't respond in time.
+    partial: bool = False
+
+
+class SearchResults(BaseModel):
+    place: Optional[Place] = None
+    hotlines: List[Hotline] = []
+    websites: List[Website] = []
+    partial: bool = False
+
+
+class SheetChanges(BaseModel):
+    inserts: List[dict] = []
+    updates: List[dict] = []
+    deletes: List[dict] = []
+
+
+class ChangeFeed(BaseModel):
+    since: str
+    version: str
+    changes: Dict[str, SheetChanges] = {}
+
+
+class Cluster(BaseModel):
+    lat: float
+    lon: float
+    count: int
+
+
+class BoundingBoxResults(BaseModel):
+    zoom: int
+    test_sites: List[TestSite] = []
+    clusters: List[Cluster] = []
+
+
+class BatchQuery(BaseModel):
+    geonames_ids: List[int] = []
+    place_names: List[str] = []
+    max_distance: float = 0.5
+    limit: int = 5
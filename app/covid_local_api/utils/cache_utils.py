@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+# All caches by name (e.g. to report their hit ratios).
+CACHES = {}
+
+
+class TTLCache:
+    """Thread-safe LRU cache, whose entries expire after `ttl` seconds.
+
+    Counts hits and misses, so the hit ratio of the cache can be monitored.
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 10000):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count: bool = True):
+        """Returns the value for `key` or `default` if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            # Expired entries are kept (until they are evicted or replaced) for
+            # get_stale.
+            if entry is None or entry[0] < time.monotonic():
+                if count:
+                    self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[1]
+
+    def get_stale(self, key, default=None):
+        """Returns the value for `key` even if it is expired (e.g. as fallback if it
+        cannot be requested again) or `default` if it is missing"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_ratio(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
@@ -0,0 +1,85 @@
+# Columns that identify an entry across updates of the Google Sheet (the sheets don't
+# have ids). Entries with the same key are numbered by their order in the sheet.
+SHEET_KEY_COLUMNS = {
+    "hotlines": ["geonames_id", "operator", "name", "phone"],
+    "websites": ["geonames_id", "operator", "name", "website"],
+    "test_sites": ["name", "street", "zip_code", "city"],
+    "health_departments": ["geonames_id", "name", "department"],
+}
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+
+def snapshot_sheet(df, key_columns: list) -> dict:
+    """Returns the entries of a sheet by their key.
+
+    Args:
+        df (pandas.DataFrame): The worksheet
+        key_columns (list of str): The columns that identify an entry
+
+    Returns:
+        dict: The entries as dicts for each key (tuple of the values of the key
+            columns and the number of the entry among the entries with the same
+            values)
+    """
+    snapshot = {}
+    occurrences = {}
+    for record in df.to_dict("records"):
+        values = tuple(record.get(column) for column in key_columns)
+        occurrence = occurrences.get(values, 0)
+        occurrences[values] = occurrence + 1
+        snapshot[values + (occurrence,)] = record
+    return snapshot
+
+
+def diff_snapshots(old: dict, new: dict) -> dict:
+    """Returns the changes between two snapshots of a sheet.
+
+    Returns:
+        dict: (operation, entry) for each changed key, where operation is INSERT,
+            UPDATE or DELETE (with entry None)
+    """
+    delta = {}
+    for key, record in new.items():
+        if key not in old:
+            delta[key] = (INSERT, record)
+        elif old[key] != record:
+            delta[key] = (UPDATE, record)
+    for key in old:
+        if key not in new:
+            delta[key] = (DELETE, None)
+    return delta
+
+
+def compose_deltas(deltas: list) -> dict:
+    """Combines consecutive deltas of a sheet (oldest first) into a single delta,
+    e.g. an insert followed by a delete cancels out."""
+    composed = {}
+    for delta in deltas:
+        for key, (operation, record) in delta.items():
+            previous = composed.get(key)
+            if previous is None:
+                composed[key] = (operation, record)
+            elif previous[0] == INSERT and operation == DELETE:
+                del composed[key]
+            elif previous[0] == INSERT:
+                composed[key] = (INSERT, record)
+            elif previous[0] == DELETE and operation == INSERT:
+                composed[key] = (UPDATE, record)
+            else:
+                composed[key] = (operation, record)
+    return composed
+
+
+def format_delta(delta: dict) -> dict:
+    """Formats a delta as lists of inserts, updates and deletes, which contain the
+    key of each entry (and the entry itself for inserts and updates)."""
+    changes = {"inserts": [], "updates": [], "deletes": []}
+    for key, (operation, record) in delta.items():
+        if operation == DELETE:
+            changes["deletes"].append({"key": list(key)})
+        else:
+            changes[operation + "s"].append({"key": list(key), "entry": record})
+    return changes
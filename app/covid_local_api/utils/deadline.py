@@ -0,0 +1,81 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# Time budget (in seconds) for all upstream requests of one request to the api. When
+# it's used up, upstream requests fail immediately and the endpoints fall back to
+# local data (and mark their results as partial).
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE", 3.0))
+
+# Maximum timeout of a single upstream request (also outside of requests to the api,
+# e.g. for the warmup).
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 5.0))
+
+# Upstream requests are not started with less time left than this.
+MIN_TIMEOUT = 0.05
+
+# Deadline of the current request (None outside of requests).
+_deadline = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of starting an upstream request after the deadline"""
+
+
+class Deadline:
+    """Time budget of a request to the api, which is shared by all its upstream
+    requests (also in other threads, see `contextvars.copy_context`).
+
+    Args:
+        budget (float): Seconds from now until the deadline
+    """
+
+    def __init__(self, budget: float):
+        self.expires_at = time.monotonic() + budget
+        self.partial = False
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+def start(budget: float = UPSTREAM_DEADLINE) -> Deadline:
+    """Starts the deadline for the current request"""
+    deadline = Deadline(budget)
+    _deadline.set(deadline)
+    return deadline
+
+
+def current() -> Optional[Deadline]:
+    return _deadline.get()
+
+
+def timeout(requested: float = None) -> float:
+    """Returns the timeout for an upstream request: the remaining time until the
+    deadline of the current request, but at most `requested` and UPSTREAM_TIMEOUT.
+
+    Raises:
+        DeadlineExceeded: If less than MIN_TIMEOUT seconds are left
+    """
+    limit = min(requested or UPSTREAM_TIMEOUT, UPSTREAM_TIMEOUT)
+    deadline = _deadline.get()
+    if deadline is None:
+        return limit
+
+    remaining = deadline.remaining()
+    if remaining < MIN_TIMEOUT:
+        raise DeadlineExceeded(f"Deadline of the request exceeded by {-remaining:.2f}s")
+    return min(limit, remaining)
+
+
+def mark_partial():
+    """Marks the results of the current request as partial (e.g. because local data
+    was used instead of an upstream response)"""
+    deadline = _deadline.get()
+    if deadline is not None:
+        deadline.partial = True
+
+
+def is_partial() -> bool:
+    deadline = _deadline.get()
+    return deadline is not None and deadline.partial
@@ -1,5 +1,12 @@
-from fastapi import FastAPI
+import base64
+import binascii
+import hashlib
+import json
+
+from fastapi import FastAPI, HTTPException
 from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import Response
 
 
 def use_route_names_as_operation_ids(app: FastAPI) -> None:
@@ -12,3 +19,131 @@ def use_route_names_as_operation_ids(app: FastAPI) -> None:
     for route in app.routes:
         if isinstance(route, APIRoute):
             route.operation_id = route.name  # in this case, 'read_items'
+
+
+def static_response(content: bytes, media_type: str, max_age: int) -> Response:
+    """
+    Return pre-rendered bytes as a response, which can be cached by clients and
+    proxies for `max_age` seconds.
+    """
+    return Response(
+        content,
+        media_type=media_type,
+        headers={"Cache-Control": f"public, max-age={max_age}"},
+    )
+
+
+def parse_range(range_header: str, size: int):
+    """
+    Return the (start, end) byte positions (inclusive) of a single-range Range header
+    or None if the header should be ignored (missing or multiple ranges).
+
+    Raises a ValueError if the range cannot be satisfied.
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    ranges = range_header[len("bytes=") :].split(",")
+    if len(ranges) != 1:
+        return None
+
+    start, _, end = ranges[0].strip().partition("-")
+    if not start:
+        # Suffix range, e.g. "bytes=-500" for the last 500 bytes.
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(f"Range not satisfiable: {range_header}")
+    return start, end
+
+
+def static_file_response(
+    request: Request,
+    content: bytes,
+    media_type: str,
+    filename: str,
+    etag: str,
+    max_age: int,
+) -> Response:
+    """
+    Return pre-rendered bytes as a file download, which supports range requests
+    (e.g. to resume downloads).
+    """
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"public, max-age={max_age}",
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "ETag": etag,
+    }
+
+    # Only return a range if the client has the same version of the file.
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        return Response(content, media_type=media_type, headers=headers)
+
+    try:
+        byte_range = parse_range(request.headers.get("range"), len(content))
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{len(content)}"
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        return Response(content, media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+    return Response(
+        content[start : end + 1],
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+def make_etag(version: str, path: str, query: str) -> str:
+    """
+    Return a strong ETag for the response to `path` and `query`, which is valid as
+    long as the dataset `version` does not change.
+    """
+    key = f"{version}:{path}?{query}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Return whether the value of an If-None-Match header contains `etag`.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, see https://tools.ietf.org/html/rfc7232#section-3.2
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+
+def encode_cursor(version: str, position: tuple) -> str:
+    """
+    Return an opaque cursor for the `position` of an entry in the dataset `version`.
+    """
+    data = json.dumps([version] + list(position), separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, version: str) -> tuple:
+    """
+    Return the position from a cursor created with `encode_cursor`.
+
+    Raises an HTTPException if the cursor is invalid or was created for another
+    dataset version (positions change when the database is updated).
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + padding).decode())
+        cursor_version, position = data[0], tuple(data[1:])
+    except (binascii.Error, ValueError, UnicodeDecodeError, IndexError, TypeError):
+        raise HTTPException(400, f"Invalid cursor: {cursor}")
+    if cursor_version != version:
+        raise HTTPException(
+            410, "Cursor expired because the data was updated, please start again"
+        )
+    return position
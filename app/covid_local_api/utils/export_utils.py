@@ -0,0 +1,104 @@
+import gzip
+import io
+import logging
+import zipfile
+
+import ujson
+
+log = logging.getLogger(__name__)
+
+# Name of the export that contains all sheets.
+ALL_SHEETS = "all"
+
+# Media type and file extension of each export format. Exports of single sheets are
+# compressed with gzip (parquet is compressed internally), exports of all sheets
+# are zip archives with one file per sheet (ndjson is a single gzipped file, in which
+# each entry has an additional "sheet" key).
+EXPORT_FORMATS = {
+    "csv": ("application/gzip", "csv.gz"),
+    "ndjson": ("application/gzip", "ndjson.gz"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+ALL_SHEETS_EXPORT_FORMATS = {
+    "csv": ("application/zip", "csv.zip"),
+    "ndjson": ("application/gzip", "ndjson.gz"),
+    "parquet": ("application/zip", "parquet.zip"),
+}
+
+
+def gzip_bytes(data: bytes) -> bytes:
+    """Compresses `data` with gzip (without timestamp, so that the output only
+    depends on the data)"""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def zip_files(files: dict) -> bytes:
+    """Returns a zip archive with the files in `files` (file name -> bytes)"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as f:
+        for name, data in files.items():
+            # Use a fixed date, so that the output only depends on the data.
+            info = zipfile.ZipInfo(name)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            f.writestr(info, data)
+    return buffer.getvalue()
+
+
+def to_csv(df) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def to_ndjson(df, extra_fields: dict = None) -> bytes:
+    lines = []
+    for record in df.to_dict("records"):
+        if extra_fields:
+            record = dict(extra_fields, **record)
+        lines.append(ujson.dumps(record, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+
+def to_parquet(df) -> bytes:
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def render_exports(dfs: dict) -> dict:
+    """Renders the sheets in `dfs` into all export formats.
+
+    Parquet exports are skipped if no parquet engine (pyarrow or fastparquet) is
+    installed.
+
+    Args:
+        dfs (dict of pandas.DataFrame): The sheets to export
+
+    Returns:
+        dict: The exported file (as bytes) for each (sheet, format) pair, where sheet
+            is ALL_SHEETS for the export of all sheets
+    """
+    exports = {}
+    for sheet, df in dfs.items():
+        exports[(sheet, "csv")] = gzip_bytes(to_csv(df))
+        exports[(sheet, "ndjson")] = gzip_bytes(to_ndjson(df))
+
+    exports[(ALL_SHEETS, "csv")] = zip_files(
+        {f"{sheet}.csv": to_csv(df) for sheet, df in dfs.items()}
+    )
+    exports[(ALL_SHEETS, "ndjson")] = gzip_bytes(
+        b"".join(to_ndjson(df, {"sheet": sheet}) for sheet, df in dfs.items())
+    )
+
+    try:
+        parquet_files = {sheet: to_parquet(df) for sheet, df in dfs.items()}
+    except ImportError:
+        log.info("No parquet engine installed, skipping parquet exports.")
+    else:
+        for sheet, data in parquet_files.items():
+            exports[(sheet, "parquet")] = data
+        exports[(ALL_SHEETS, "parquet")] = zip_files(
+            {f"{sheet}.parquet": data for sheet, data in parquet_files.items()}
+        )
+    return exports
@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from covid_local_api.utils import upstream
+from covid_local_api.utils.metrics import timed_upstream
+from covid_local_api.utils.place_request_utils import OSM_NOMATIM_ENDPOINT
+from covid_local_api.utils.scheduler import FileLock
+
+log = logging.getLogger(__name__)
+
+# File, in which the coordinates of geocoded addresses are persisted (shared by all
+# processes on a host), so that addresses are only geocoded once and not at every
+# update of the database. Should be on a volume that survives deploys.
+GEOCODING_CACHE_PATH = os.getenv(
+    "GEOCODING_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "covid-local-api-addresses.json"),
+)
+
+# Seconds between requests to nominatim (its usage policy allows at most one request
+# per second, see https://operations.osmfoundation.org/policies/nominatim/).
+GEOCODING_MIN_INTERVAL = float(os.getenv("GEOCODING_MIN_INTERVAL", 1.0))
+
+# Maximum number of addresses that are geocoded after an update of the database (the
+# rest is geocoded after the next update). 0 disables geocoding.
+GEOCODING_MAX_ADDRESSES = int(os.getenv("GEOCODING_MAX_ADDRESSES", 1000))
+
+# Nominatim requires a user agent that identifies the application.
+GEOCODING_USER_AGENT = os.getenv("GEOCODING_USER_AGENT", "covid-local-api")
+
+# Geocoding stops after this many failed requests in a row (e.g. if nominatim is down).
+GEOCODING_MAX_FAILURES = 3
+
+# Postal codes are stored as numbers in the sheets, so leading zeros are restored
+# with the length of the postal codes of the country.
+POSTAL_CODE_LENGTHS = {"DE": 5, "AT": 4, "CH": 4}
+
+
+def postal_code(zip_code, country_code) -> Optional[str]:
+    if zip_code is None:
+        return None
+    return str(zip_code).zfill(POSTAL_CODE_LENGTHS.get(country_code, 0))
+
+
+def address_key(address: dict) -> Optional[str]:
+    """Returns the cache key of an address (with street, zip_code, city and
+    country_code) or None if it has neither zip code nor city"""
+    if address.get("zip_code") is None and not address.get("city"):
+        return None
+    parts = [
+        address.get("street"),
+        postal_code(address.get("zip_code"), address.get("country_code")),
+        address.get("city"),
+        address.get("country_code"),
+    ]
+    return "|".join(
+        re.sub(r"\s+", " ", str(part)).strip().lower() if part else "" for part in parts
+    )
+
+
+class AddressCache:
+    """Coordinates of addresses by `address_key`, persisted to a json file.
+
+    Addresses that nominatim doesn't know are stored with None, so they aren't
+    requested again (a changed address gets a new key).
+
+    Args:
+        path (str): Path of the json file
+    """
+
+    def __init__(self, path: str = GEOCODING_CACHE_PATH):
+        self.path = path
+        self._coordinates = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._coordinates
+
+    def __len__(self):
+        return len(self._coordinates)
+
+    def get(self, key) -> Optional[tuple]:
+        """Returns (lat, lon) of an address or None if it's unknown"""
+        coordinates = self._coordinates.get(key)
+        return tuple(coordinates) if coordinates else None
+
+    def set(self, key, coordinates: Optional[tuple]):
+        with self._lock:
+            self._coordinates[key] = list(coordinates) if coordinates else None
+
+    def load(self):
+        """Adds the addresses from the file (e.g. geocoded by other processes)"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                coordinates = json.load(f)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._coordinates.update(coordinates)
+
+    def save(self):
+        with self._lock:
+            coordinates = dict(self._coordinates)
+        # Write to a temporary file first, so the file is never read half-written.
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(coordinates, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+
+def add_coordinates(df, cache: AddressCache) -> dict:
+    """Fills the lat/lon columns of the rows in `df` that have no coordinates with the
+    coordinates of their address from `cache` (in place).
+
+    Args:
+        df (pandas.DataFrame): Coerced sheet with address and lat/lon columns
+        cache (AddressCache): The geocoded addresses
+
+    Returns:
+        dict: The addresses that are not in the cache yet (by `address_key`)
+    """
+    missing = {}
+    for index, row in df.iterrows():
+        if row["lat"] is not None and row["lon"] is not None:
+            continue
+        address = {
+            name: row[name] for name in ["street", "zip_code", "city", "country_code"]
+        }
+        key = address_key(address)
+        if key is None:
+            continue
+        if key not in cache:
+            missing[key] = address
+        coordinates = cache.get(key)
+        if coordinates is not None:
+            df.at[index, "lat"], df.at[index, "lon"] = coordinates
+    return missing
+
+
+@timed_upstream("geocode_address")
+def request_coordinates(params: dict) -> Optional[tuple]:
+    """Returns (lat, lon) of the first nominatim search result for a structured query
+    (see https://nominatim.org/release-docs/develop/api/Search/) or None"""
+    response = upstream.session.get(
+        OSM_NOMATIM_ENDPOINT + "/search",
+        params=dict(params, format="json", limit=1),
+        headers={"User-Agent": GEOCODING_USER_AGENT},
+    )
+    response.raise_for_status()
+    results = response.json()
+    if not results:
+        return None
+    return float(results[0]["lat"]), float(results[0]["lon"])
+
+
+class Geocoder:
+    """Geocodes addresses with nominatim, with at most one request per
+    `min_interval` seconds.
+
+    Args:
+        min_interval (float): Minimum seconds between requests
+    """
+
+    def __init__(self, min_interval: float = GEOCODING_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._next_request = 0.0
+        self._lock = threading.Lock()
+
+    def _request(self, params: dict) -> Optional[tuple]:
+        with self._lock:
+            time.sleep(max(self._next_request - time.monotonic(), 0))
+            try:
+                return request_coordinates(params)
+            finally:
+                self._next_request = time.monotonic() + self.min_interval
+
+    def geocode(self, address: dict) -> Optional[tuple]:
+        """Returns (lat, lon) of an address or None if nominatim doesn't know it.
+
+        If the street isn't found, the zip code and city are geocoded instead (which
+        is still good enough to find the nearest entries).
+
+        Raises:
+            requests.RequestException: If the request failed
+        """
+        params = {
+            "street": address.get("street"),
+            "postalcode": postal_code(
+                address.get("zip_code"), address.get("country_code")
+            ),
+            "city": address.get("city"),
+            "countrycodes": (address.get("country_code") or "").lower(),
+        }
+        params = {key: value for key, value in params.items() if value}
+        coordinates = self._request(params)
+        if coordinates is None and "street" in params:
+            del params["street"]
+            coordinates = self._request(params)
+        return coordinates
+
+
+def geocode_addresses(
+    addresses: dict,
+    cache: AddressCache,
+    geocoder: Geocoder = None,
+    max_addresses: int = GEOCODING_MAX_ADDRESSES,
+) -> int:
+    """Geocodes the addresses that are not in the cache yet and saves them to the
+    cache file.
+
+    Runs in only one process per host at a time (the others wait and then find the
+    addresses in the cache file).
+
+    Args:
+        addresses (dict): The addresses by `address_key` (see `add_coordinates`)
+        cache (AddressCache): The cache, which is updated from and saved to its file
+        geocoder (Geocoder, optional): The geocoder (default: rate limited nominatim)
+        max_addresses (int): Maximum number of addresses to geocode
+
+    Returns:
+        int: The number of addresses that have coordinates now
+    """
+    geocoder = geocoder or Geocoder()
+    start = time.perf_counter()
+    requested = 0
+    with FileLock(cache.path + ".lock"):
+        cache.load()
+        failures = 0
+        try:
+            for key, address in addresses.items():
+                if key in cache:
+                    continue
+                if requested >= max_addresses:
+                    log.info("Maximum number of addresses to geocode reached")
+                    break
+                requested += 1
+                try:
+                    cache.set(key, geocoder.geocode(address))
+                    failures = 0
+                except (requests.RequestException, ValueError) as e:
+                    log.warning(f"Failed to geocode {key}: {e}")
+                    failures += 1
+                    if failures >= GEOCODING_MAX_FAILURES:
+                        log.warning("Stopped geocoding after repeated failures")
+                        break
+        finally:
+            if requested:
+                cache.save()
+
+    found = sum(1 for key in addresses if cache.get(key) is not None)
+    log.info(
+        f"Geocoded {requested} addresses in {time.perf_counter() - start:.1f}s "
+        f"({found} of {len(addresses)} have coordinates)"
+    )
+    return found
@@ -0,0 +1,164 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from covid_local_api.utils import deadline
+from covid_local_api.utils.metrics import UPSTREAM_HEDGES
+
+log = logging.getLogger(__name__)
+
+# Hedged requests: if an upstream request hasn't returned after the HEDGE_PERCENTILE
+# of the recent latencies of the same function, a duplicate is sent (e.g. with another
+# geonames user or endpoint) and the first successful answer is used. 0 disables
+# hedging.
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 0))
+
+# Share of requests that may be hedged (protects the quota of the upstream services).
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", 0.05))
+
+# Hedges are never sent earlier than this (in seconds).
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 0.05))
+
+# Number of recent latencies per function for the percentile and the minimum number,
+# before requests are hedged.
+HEDGE_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+
+# Maximum number of hedges that can be sent in a burst.
+HEDGE_BURST = 10
+
+# Threads for the requests, once hedging is active (the calling thread waits for the
+# first successful answer).
+HEDGE_MAX_WORKERS = 32
+
+
+class Hedger:
+    """Sends a duplicate of slow requests of an upstream function and returns the
+    first successful answer.
+
+    The hedges are limited by a token bucket, which gets `max_rate` tokens per
+    request (up to `burst`), so that at most a share of `max_rate` of the requests is
+    hedged on average.
+
+    Args:
+        name (str): Name of the function (for logs and metrics)
+        percentile (float): Percentile of the recent latencies after which a hedge is
+            sent
+        max_rate (float): Maximum share of hedged requests
+        min_delay (float): Minimum seconds before a hedge is sent
+        burst (float): Maximum number of hedges that can be sent at once
+    """
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = HEDGE_PERCENTILE,
+        max_rate: float = HEDGE_MAX_RATE,
+        min_delay: float = HEDGE_MIN_DELAY,
+        burst: float = HEDGE_BURST,
+    ):
+        self.name = name
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+        self.burst = burst
+        self._latencies = deque(maxlen=HEDGE_WINDOW)
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Returns the seconds after which a request is hedged (or None if there are
+        not enough latencies yet)"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        index = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
+
+    def _add_token(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.max_rate, self.burst)
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def _timed(self, attempt):
+        # Failures and timeouts are recorded as well, so that slow failing requests
+        # raise the percentile (requests that weren't sent because the deadline was
+        # exceeded are not).
+        start = time.perf_counter()
+        try:
+            return attempt()
+        except deadline.DeadlineExceeded:
+            start = None
+            raise
+        finally:
+            if start is not None:
+                with self._lock:
+                    self._latencies.append(time.perf_counter() - start)
+
+    def _submit(self, attempt):
+        # Run in a copy of the context, so the request keeps its deadline.
+        context = contextvars.copy_context()
+        return executor.submit(context.run, self._timed, attempt)
+
+    def call(self, attempt, hedge):
+        """Returns the first successful result of `attempt()` or of `hedge()`, which is
+        sent if `attempt` is slower than the percentile of the recent latencies (and
+        the rate limit allows it).
+
+        Both run in the pool and the attempt that is still running when the other
+        one succeeded is ignored. Exceptions are only raised if all sent requests
+        failed (the one of `attempt` is raised).
+        """
+        self._add_token()
+        delay = self.delay()
+        if delay is None:
+            return self._timed(attempt)
+
+        futures = [self._submit(attempt)]
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            if self._take_token():
+                UPSTREAM_HEDGES.labels(self.name, "sent").inc()
+                futures.append(self._submit(hedge))
+            else:
+                UPSTREAM_HEDGES.labels(self.name, "capped").inc()
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Check all finished attempts, so a success is never hidden by a failure
+            # that finished at the same time.
+            for future in futures:
+                if future in done and future.exception() is None:
+                    if future is not futures[0]:
+                        UPSTREAM_HEDGES.labels(self.name, "won").inc()
+                    return future.result()
+        return futures[0].result()
+
+
+executor = ThreadPoolExecutor(HEDGE_MAX_WORKERS, thread_name_prefix="hedging")
+
+# Hedgers by function name.
+_hedgers = {}
+
+
+def hedged(name: str, attempt, hedge):
+    """Calls `attempt` and hedges it with `hedge` (see `Hedger.call`), if hedging is
+    enabled (HEDGE_PERCENTILE > 0)"""
+    if HEDGE_PERCENTILE <= 0:
+        return attempt()
+    hedger = _hedgers.get(name)
+    if hedger is None:
+        hedger = _hedgers.setdefault(name, Hedger(name))
+    return hedger.call(attempt, hedge)
@@ -0,0 +1,117 @@
+import functools
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from covid_local_api.utils.cache_utils import CACHES
+
+# Buckets for latencies of routes and upstream requests (in seconds).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram(
+    "covid_local_api_request_duration_seconds",
+    "Latency of requests by endpoint",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "covid_local_api_upstream_request_duration_seconds",
+    "Latency of requests to upstream services (geonames, osm, wikidata)",
+    ["function", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_HEDGES = Counter(
+    "covid_local_api_upstream_hedges_total",
+    "Hedged upstream requests (see utils/hedging.py) that were sent, skipped because "
+    "of the rate limit (capped) or answered first (won)",
+    ["function", "result"],
+)
+DATABASE_REFRESH_DURATION = Gauge(
+    "covid_local_api_database_refresh_duration_seconds",
+    "Duration of the last database update",
+)
+DATABASE_REFRESH_TIMESTAMP = Gauge(
+    "covid_local_api_database_refresh_timestamp_seconds",
+    "Unix time of the last database update",
+)
+DATABASE_ROWS = Gauge(
+    "covid_local_api_database_rows", "Number of entries per sheet", ["sheet"]
+)
+PLACE_INDEX_PLACES = Gauge(
+    "covid_local_api_place_index_places",
+    "Number of places in the loaded place index of each country (0 if not loaded)",
+    ["country_code"],
+)
+PLACE_INDEX_LOADS = Counter(
+    "covid_local_api_place_index_loads_total",
+    "Loads of the place index of each country (including reloads after eviction)",
+    ["country_code"],
+)
+
+
+def timed_upstream(name: str):
+    """Decorator that records the latency of an upstream request function in
+    UPSTREAM_LATENCY (with outcome "error" if it raises an exception)"""
+
+    def decorator(func):
+        histogram_ok = UPSTREAM_LATENCY.labels(name, "ok")
+        histogram_error = UPSTREAM_LATENCY.labels(name, "error")
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                histogram_error.observe(time.perf_counter() - start)
+                raise
+            histogram_ok.observe(time.perf_counter() - start)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class CacheCollector:
+    """Reports hits, misses and hit ratio of all caches in `cache_utils.CACHES`.
+
+    The values are only read when the metrics are scraped, so this doesn't add any
+    work to cache lookups.
+    """
+
+    def collect(self):
+        hits = CounterMetricFamily(
+            "covid_local_api_cache_hits", "Cache hits", labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            "covid_local_api_cache_misses", "Cache misses", labels=["cache"]
+        )
+        hit_ratio = GaugeMetricFamily(
+            "covid_local_api_cache_hit_ratio", "Cache hit ratio", labels=["cache"]
+        )
+        size = GaugeMetricFamily(
+            "covid_local_api_cache_entries", "Number of cache entries", labels=["cache"]
+        )
+        for name, cache in list(CACHES.items()):
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+            hit_ratio.add_metric([name], cache.hit_ratio)
+            size.add_metric([name], len(cache))
+        return [hits, misses, hit_ratio, size]
+
+
+REGISTRY.register(CacheCollector())
+
+
+def render_metrics():
+    """Returns all metrics in the Prometheus text format and their media type"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,11 +1,15 @@
+import functools
+import json
 import logging
 import os
 import random
-from typing import List
+from typing import List, Optional
 
 import requests
-from qwikidata.linked_data_interface import get_entity_dict_from_api
-from qwikidata.sparql import return_sparql_query_results
+
+from covid_local_api.utils import hedging, upstream
+from covid_local_api.utils.cache_utils import TTLCache
+from covid_local_api.utils.metrics import timed_upstream
 
 log = logging.getLogger(__name__)
 
@@ -21,67 +25,285 @@ def get_geonames_user():
 OSM_NOMATIM_ENDPOINT = os.getenv(
     "OSM_NOMATIM_ENDPOINT", "https://nominatim.openstreetmap.org"
 )
+WIKIDATA_ENTITY_ENDPOINT = os.getenv(
+    "WIKIDATA_ENTITY_ENDPOINT", "https://www.wikidata.org/wiki/Special:EntityData"
+)
+WIKIDATA_SPARQL_ENDPOINT = os.getenv(
+    "WIKIDATA_SPARQL_ENDPOINT", "https://query.wikidata.org/sparql"
+)
 
 IGNORED_GEONAMES_ID = ["6295630", "6255148"]
 
+# Keys of a geonames entity, which contain the ids of the hierarchy (less local first)
+GEONAMES_HIERARCHY_KEYS = [
+    "countryId",
+    "adminId1",
+    "adminId2",
+    "adminId3",
+    "adminId4",
+    "adminId5",
+    "geonameId",
+]
+
+GEONAMES_CACHE_TTL = int(os.getenv("GEONAMES_CACHE_TTL", 86400))
+
+# Full entities (details of places), hierarchies and search results, so that popular
+# places are only requested once (see utils/warmup.py for prefilling these caches
+# after a restart).
+geonames_entity_cache = TTLCache("geonames_entities", ttl=GEONAMES_CACHE_TTL)
+geonames_hierarchy_cache = TTLCache("geonames_hierarchies", ttl=GEONAMES_CACHE_TTL)
+geonames_search_cache = TTLCache("geonames_searches", ttl=GEONAMES_CACHE_TTL)
+
 OSM_TYPE_MAPPING = {"relation": "R", "way": "W", "node": "N"}
 OSM_ID_PREFIX = "OSM:"
 GEONAMES_ID_PREFIX = "GN:"
 
+# Precomputed osm and geonames ids of countries (regenerate with
+# scripts/refresh-country-ids.py).
+COUNTRY_IDS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    "data",
+    "country-ids.json",
+)
 
-def request_geonames_hierarchy(geonames_id: str, fast: bool = True) -> List[str]:
+
+def load_country_ids(country_ids_path: str = COUNTRY_IDS_PATH) -> dict:
+    try:
+        with open(country_ids_path, "r") as f:
+            return json.load(f)
+    except Exception:
+        log.info("Failed to load country ids.", exc_info=True)
+        return {}
+
+
+COUNTRY_IDS = load_country_ids()
+
+
+class UpstreamError(Exception):
+    """Raised if an upstream service could not be reached or answered with an error"""
+
+
+class NotFoundError(Exception):
+    """Raised if an upstream service doesn't know the requested place (e.g. an unknown
+    geonames id)"""
+
+
+def hedged_geonames(name: str, request):
+    """Calls `request(user, endpoint)` with a random geonames user and
+    GEONAMES_ENDPOINT and hedges slow calls with another user and GEONAMES_ENDPOINT_V3
+    (see utils/hedging.py)"""
+    user = get_geonames_user()
+    other_users = [other for other in GEONAMES_USERS if other != user] or [user]
+    return hedging.hedged(
+        name,
+        lambda: request(user, GEONAMES_ENDPOINT),
+        lambda: request(random.choice(other_users), GEONAMES_ENDPOINT_V3),
+    )
+
+
+def geonames_error(message, status_code: int = None) -> Exception:
+    """Returns the exception for an error of geonames. Geonames also answers errors
+    like exceeded limits or unknown ids with status 200 and a message."""
+    if status_code == 404 or "does not exist" in str(message).lower():
+        return NotFoundError(message)
+    return UpstreamError(message)
+
+
+def check_geocoder_query(query):
+    """Raises an exception if the request of a geocoder query failed (geocoder only
+    logs these errors and returns no results).
+
+    Raises:
+        NotFoundError: If the place doesn't exist (status 404 or geonames message)
+        UpstreamError: For all other errors
+    """
+    if query.error:
+        raise geonames_error(query.error, query.status_code)
+    return query
+
+
+def check_geonames_response(response: requests.Response) -> dict:
+    """Returns the JSON of a response of the geonames api.
+
+    Raises:
+        NotFoundError: If the place doesn't exist (status 404 or geonames message)
+        UpstreamError: For all other errors
+    """
+    if not response.ok:
+        raise geonames_error(response.reason, response.status_code)
+    try:
+        results = response.json()
+    except ValueError as e:
+        raise UpstreamError(e)
+    if "status" in results:
+        raise geonames_error(results["status"].get("message"))
+    return results
+
+
+@timed_upstream("geonames_hierarchy")
+def query_geonames_hierarchy(geonames_id: int, user: str, endpoint: str) -> list:
+    # geocoder imports all of its providers, so it's only loaded when it's needed.
+    import geocoder
+
+    query = geocoder.geonames(
+        geonames_id,
+        key=user,
+        method="hierarchy",
+        url=endpoint + "/hierarchyJSON",
+        session=upstream.session,
+    )
+    return list(check_geocoder_query(query))
+
+
+@timed_upstream("geonames_search")
+def query_geonames_search(query: str, limit: int, user: str, endpoint: str) -> list:
+    import geocoder
+
+    geocoder_query = geocoder.geonames(
+        query,
+        key=user,
+        maxRows=limit,
+        featureClass=["A", "P"],
+        url=endpoint + "/searchJSON",
+        session=upstream.session,
+    )
+    return list(check_geocoder_query(geocoder_query))
+
+
+def geonames_details(geonames_id: int):
+    """Returns the geocoder result with the details of a geonames id (built from the
+    cached entity, see `request_geonames_entity`)"""
+    return entity_to_geocoder(request_geonames_entity(geonames_id))
+
+
+def entity_to_geocoder(entity: dict):
+    """Wraps a full geonames entity in a geocoder result (like the results of
+    geocoder's details method)"""
+    from geocoder.geonames_details import GeonamesFullResult
+
+    return GeonamesFullResult(entity)
+
+
+def geonames_hierarchy(geonames_id: int) -> list:
+    """Returns the geocoder results for the hierarchy of a geonames id (less local
+    areas first, cached for GEONAMES_CACHE_TTL seconds)"""
+    results = geonames_hierarchy_cache.get(int(geonames_id))
+    if results is None:
+        results = hedged_geonames(
+            "geonames_hierarchy",
+            functools.partial(query_geonames_hierarchy, geonames_id),
+        )
+        # Don't cache empty results (e.g. because of exceeded limits).
+        if results:
+            geonames_hierarchy_cache.set(int(geonames_id), results)
+    return results
+
+
+def geonames_search(query: str, limit: int = 5) -> list:
+    """Returns the geocoder results of a free-form search for places (cached for
+    GEONAMES_CACHE_TTL seconds)"""
+    results = geonames_search_cache.get((query, limit))
+    if results is None:
+        results = hedged_geonames(
+            "geonames_search", functools.partial(query_geonames_search, query, limit)
+        )
+        if results:
+            geonames_search_cache.set((query, limit), results)
+    return results
+
+
+def request_wikidata_entity(wikidata_id: str) -> dict:
+    """Returns the wikidata entity for the id from the linked data interface"""
+    response = upstream.session.get(
+        "{}/{}.json".format(WIKIDATA_ENTITY_ENDPOINT, wikidata_id)
+    )
+    response.raise_for_status()
+    # Entities of redirected ids are returned with their new id.
+    return next(iter(response.json()["entities"].values()))
+
+
+def request_wikidata_sparql(query: str) -> dict:
+    """Returns the results of a wikidata sparql query"""
+    return upstream.session.get(
+        WIKIDATA_SPARQL_ENDPOINT, params={"query": query, "format": "json"}
+    ).json()
+
+
+@timed_upstream("request_geonames_entity")
+def query_geonames_entity(geonames_id: str, user: str, endpoint: str) -> dict:
+    request_url = (
+        endpoint + "/getJSON?geonameId={geonames_id}&style=full&username={user}"
+    )
+    try:
+        response = upstream.session.get(
+            request_url.format(geonames_id=geonames_id, user=user)
+        )
+    except requests.RequestException as e:
+        raise UpstreamError(e)
+    return check_geonames_response(response)
+
+
+def request_geonames_entity(geonames_id: str) -> dict:
+    """Returns the full geonames entity (getJSON with style=full) for the id.
+
+    Entities are cached for GEONAMES_CACHE_TTL seconds, so that the details,
+    hierarchy, alternate names and wikidata id of a place are only requested once.
+
+    Raises:
+        NotFoundError: If geonames doesn't know the id
+        UpstreamError: If the request failed or geonames answered with an error
+    """
     geonames_id = str(geonames_id).strip().upper().lstrip(GEONAMES_ID_PREFIX)
-    if fast:
-        # Only request a single JSON instead of the full hierarchy
-        try:
-            #
-            request_url = (
-                GEONAMES_ENDPOINT_V3
-                + "/getJSON?geonameId={geonames_id}&style=full&username={geonames_user}"
-            )
-            response_json = requests.get(
-                request_url.format(
-                    geonames_id=geonames_id, geonames_user=random.choice(GEONAMES_USERS)
-                )
-            ).json()
-            sorted_geonames_hierarchy = []
+    entity = geonames_entity_cache.get(geonames_id)
+    if entity is None:
+        entity = hedged_geonames(
+            "geonames_entity", functools.partial(query_geonames_entity, geonames_id)
+        )
+        geonames_entity_cache.set(geonames_id, entity)
+    return entity
 
-            if "countryId" in response_json and response_json["countryId"]:
-                sorted_geonames_hierarchy.append(
-                    GEONAMES_ID_PREFIX + str(response_json["countryId"])
-                )
 
-            if "adminId1" in response_json and response_json["adminId1"]:
-                sorted_geonames_hierarchy.append(
-                    GEONAMES_ID_PREFIX + str(response_json["adminId1"])
-                )
+def cached_geonames_entity(geonames_id: int) -> Optional[dict]:
+    """Returns the cached entity for a geonames id, also if it's expired (e.g. as
+    fallback if geonames doesn't respond), or None"""
+    return geonames_entity_cache.get_stale(str(int(geonames_id)))
 
-            if "adminId2" in response_json and response_json["adminId2"]:
-                sorted_geonames_hierarchy.append(
-                    GEONAMES_ID_PREFIX + str(response_json["adminId2"])
-                )
 
-            if "adminId3" in response_json and response_json["adminId3"]:
-                sorted_geonames_hierarchy.append(
-                    GEONAMES_ID_PREFIX + str(response_json["adminId3"])
-                )
+def get_geonames_admin_hierarchy(entity: dict) -> List[str]:
+    """Returns the ids of the country, the admin areas and the entity itself from a
+    geonames entity (less local areas first)."""
+    sorted_geonames_hierarchy = []
+    for key in GEONAMES_HIERARCHY_KEYS:
+        if key in entity and entity[key]:
+            sorted_geonames_hierarchy.append(GEONAMES_ID_PREFIX + str(entity[key]))
+    return sorted_geonames_hierarchy
 
-            if "adminId4" in response_json and response_json["adminId4"]:
-                sorted_geonames_hierarchy.append(
-                    GEONAMES_ID_PREFIX + str(response_json["adminId4"])
-                )
 
-            if "adminId5" in response_json and response_json["adminId5"]:
-                sorted_geonames_hierarchy.append(
-                    GEONAMES_ID_PREFIX + str(response_json["adminId5"])
-                )
+def get_geonames_alternate_names(entity: dict, lang: str = None) -> List[str]:
+    """Returns the alternate names of a geonames entity (optionally only for
+    `lang`)."""
+    alternate_names = []
+    if "alternateNames" in entity and entity["alternateNames"]:
+        for tag in entity["alternateNames"]:
+            if lang is None or ("lang" in tag and tag["lang"] == lang):
+                if tag["name"]:
+                    alternate_names.append(tag["name"])
+    return alternate_names
 
-            if "geonameId" in response_json and response_json["geonameId"]:
-                sorted_geonames_hierarchy.append(
-                    GEONAMES_ID_PREFIX + str(response_json["geonameId"])
-                )
 
-            return sorted_geonames_hierarchy
+def get_geonames_wikidata_id(entity: dict) -> str:
+    """Returns the wikidata id of a geonames entity or None"""
+    wikidata_ids = get_geonames_alternate_names(entity, lang="wkdt")
+    return wikidata_ids[0] if wikidata_ids else None
+
+
+@timed_upstream("request_geonames_hierarchy")
+def request_geonames_hierarchy(geonames_id: str, fast: bool = True) -> List[str]:
+    geonames_id = str(geonames_id).strip().upper().lstrip(GEONAMES_ID_PREFIX)
+    if fast:
+        # Only request a single JSON instead of the full hierarchy
+        try:
+            return get_geonames_admin_hierarchy(request_geonames_entity(geonames_id))
         except Exception:
             log.info("Failed to get geonames hierarchy.", exc_info=True)
             return None
@@ -91,7 +313,7 @@ def request_geonames_hierarchy(geonames_id: str, fast: bool = True) -> List[str]
                 GEONAMES_ENDPOINT_V3
                 + "/hierarchyJSON?style=full&geonameId={geonames_id}&username={geonames_user}"
             )
-            response = requests.get(
+            response = upstream.session.get(
                 request_url.format(
                     geonames_id=geonames_id, geonames_user=random.choice(GEONAMES_USERS)
                 )
@@ -118,6 +340,7 @@ def request_geonames_hierarchy(geonames_id: str, fast: bool = True) -> List[str]
             return None
 
 
+@timed_upstream("request_osm_hierarchy")
 def request_osm_hierarchy(osm_id: str) -> List[str]:
     osm_id = str(osm_id).strip().upper().lstrip(OSM_ID_PREFIX)
     try:
@@ -131,7 +354,9 @@ def request_osm_hierarchy(osm_id: str) -> List[str]:
             OSM_NOMATIM_ENDPOINT
             + "/details.php?osmtype={osm_type}&osmid={osm_id}&format=json&addressdetails=1&hierarchy=0&linkedplaces=0&polygon_geojson=0&keywords=0&extratags=0"
         )
-        response = requests.get(request_url.format(osm_type=osm_type, osm_id=osm_id))
+        response = upstream.session.get(
+            request_url.format(osm_type=osm_type, osm_id=osm_id)
+        )
 
         country_code = None
         osm_id_to_level = []
@@ -145,7 +370,7 @@ def request_osm_hierarchy(osm_id: str) -> List[str]:
 
         sorted_osm_hierarchy = []
         if country_code:
-            country_id = map_countrycode_to_osm(country_code)
+            country_id = get_country_osm_id(country_code)
             if country_id:
                 sorted_osm_hierarchy.append(country_id)
 
@@ -160,12 +385,52 @@ def request_osm_hierarchy(osm_id: str) -> List[str]:
         return None
 
 
+def get_country_osm_id(country_code: str) -> str:
+    """Returns the osm id of a country from the precomputed country ids (requests
+    nominatim only for unknown countries)."""
+    country_ids = COUNTRY_IDS.get(country_code.upper(), {})
+    if country_ids.get("osm_id"):
+        return country_ids["osm_id"]
+    return map_countrycode_to_osm(country_code)
+
+
+def get_country_geonames_id(country_code: str) -> str:
+    """Returns the geonames id of a country from the precomputed country ids
+    (requests geonames only for unknown countries)."""
+    country_ids = COUNTRY_IDS.get(country_code.upper(), {})
+    if country_ids.get("geonames_id"):
+        return country_ids["geonames_id"]
+    return map_countrycode_to_geonames(country_code)
+
+
+@timed_upstream("map_countrycode_to_geonames")
+def map_countrycode_to_geonames(country_code: str) -> str:
+    try:
+        request_url = (
+            GEONAMES_ENDPOINT
+            + "/countryInfoJSON?country={country_code}&username={geonames_user}"
+        )
+        response = upstream.session.get(
+            request_url.format(
+                country_code=country_code.upper(),
+                geonames_user=random.choice(GEONAMES_USERS),
+            )
+        )
+        return GEONAMES_ID_PREFIX + str(response.json()["geonames"][0]["geonameId"])
+    except Exception:
+        log.debug("Failed to map country code to geonames id.", exc_info=True)
+        return None
+
+
+@timed_upstream("map_countrycode_to_osm")
 def map_countrycode_to_osm(country_code: str) -> str:
     try:
         request_url = (
             OSM_NOMATIM_ENDPOINT + "/search?country={country_code}&format=json"
         )
-        response = requests.get(request_url.format(country_code=country_code.upper()))
+        response = upstream.session.get(
+            request_url.format(country_code=country_code.upper())
+        )
         osm_obj = response.json()[0]
         osm_type = OSM_TYPE_MAPPING[osm_obj["osm_type"]]
         osm_id = osm_type + str(osm_obj["osm_id"])
@@ -175,6 +440,7 @@ def map_countrycode_to_osm(country_code: str) -> str:
         return None
 
 
+@timed_upstream("map_osm_to_wikidata")
 def map_osm_to_wikidata(osm_id: str) -> str:
     osm_id = str(osm_id).strip().upper().lstrip(OSM_ID_PREFIX)
     try:
@@ -186,7 +452,7 @@ def map_osm_to_wikidata(osm_id: str) -> str:
             OSM_NOMATIM_ENDPOINT
             + "/lookup?osm_ids={osm_id}&format=json&extratags=1&addressdetails=0&namedetails=0"
         )
-        response = requests.get(nominatim_lookup_url.format(osm_id=osm_id))
+        response = upstream.session.get(nominatim_lookup_url.format(osm_id=osm_id))
         if len(response.json()) > 1:
             log.info("Found more than one wikidata id for osm id: " + osm_id)
         if "wikidata" not in response.json()[0]["extratags"]:
@@ -208,7 +474,7 @@ def map_osm_to_wikidata(osm_id: str) -> str:
             }}
             """
 
-            res = return_sparql_query_results(
+            res = request_wikidata_sparql(
                 sparql_query.format(id_type="P402", id=osm_id)
             )
             if len(res["results"]["bindings"]) > 1:
@@ -219,24 +485,13 @@ def map_osm_to_wikidata(osm_id: str) -> str:
             return None
 
 
+@timed_upstream("map_geonames_to_wikidata")
 def map_geonames_to_wikidata(geonames_id: str) -> str:
     geonames_id = str(geonames_id).strip().upper().lstrip(GEONAMES_ID_PREFIX)
     try:
-        request_url = (
-            GEONAMES_ENDPOINT_V3
-            + "/getJSON?geonameId={geonames_id}&style=full&username={geonames_user}"
-        )
-        response_json = requests.get(
-            request_url.format(
-                geonames_id=geonames_id, geonames_user=random.choice(GEONAMES_USERS)
-            )
-        ).json()
-
-        if "alternateNames" in response_json and response_json["alternateNames"]:
-            for tag in response_json["alternateNames"]:
-                if "lang" in tag and tag["lang"] == "wkdt":
-                    if tag["name"]:
-                        return tag["name"]
+        wikidata_id = get_geonames_wikidata_id(request_geonames_entity(geonames_id))
+        if wikidata_id:
+            return wikidata_id
         raise Exception()
     except Exception:
         try:
@@ -247,7 +502,7 @@ def map_geonames_to_wikidata(geonames_id: str) -> str:
             }}
             """
 
-            res = return_sparql_query_results(
+            res = request_wikidata_sparql(
                 sparql_query.format(id_type="P1566", id=geonames_id)
             )
 
@@ -262,10 +517,11 @@ def map_geonames_to_wikidata(geonames_id: str) -> str:
             return None
 
 
+@timed_upstream("map_wikidata_to_osm")
 def map_wikidata_to_osm(wikidata_id: str) -> str:
     wikidata_id = wikidata_id.upper()
     try:
-        wikidata_result = get_entity_dict_from_api(wikidata_id)
+        wikidata_result = request_wikidata_entity(wikidata_id)
         if len(wikidata_result["claims"]["P402"]) > 1:
             log.info("Found more than one osm id for wikidata id: " + wikidata_id)
         return (
@@ -278,10 +534,11 @@ def map_wikidata_to_osm(wikidata_id: str) -> str:
         return None
 
 
+@timed_upstream("map_wikidata_to_geonames")
 def map_wikidata_to_geonames(wikidata_id: str) -> str:
     wikidata_id = wikidata_id.upper()
     try:
-        wikidata_result = get_entity_dict_from_api(wikidata_id)
+        wikidata_result = request_wikidata_entity(wikidata_id)
         if len(wikidata_result["claims"]["P1566"]) > 1:
             log.info("Found more than one geonames id for wikidata id: " + wikidata_id)
         return (
@@ -293,6 +550,7 @@ def map_wikidata_to_geonames(wikidata_id: str) -> str:
         return None
 
 
+@timed_upstream("search_osm")
 def search_osm(query: str, limit: int = 5, country_codes: List[str] = None) -> str:
     try:
         country_code_filter = ""
@@ -304,7 +562,7 @@ def search_osm(query: str, limit: int = 5, country_codes: List[str] = None) -> s
             + "/search?q={query}&limit={limit}&format=json"
             + country_code_filter
         )
-        response = requests.get(request_url.format(query=query, limit=limit))
+        response = upstream.session.get(request_url.format(query=query, limit=limit))
         results = []
         for place in response.json():
             if (
@@ -328,28 +586,60 @@ def search_osm(query: str, limit: int = 5, country_codes: List[str] = None) -> s
         return []
 
 
+@timed_upstream("search_geonames")
 def search_geonames(query: str, limit: int = 5, country_codes: List[str] = None) -> str:
-    try:
-        country_code_filter = ""
-        if country_codes:
-            for country_code in country_codes:
-                country_code_filter += "&country=" + country_code
+    country_code_filter = ""
+    if country_codes:
+        for country_code in country_codes:
+            country_code_filter += "&country=" + country_code
 
+    def request(user, endpoint):
         request_url = (
-            GEONAMES_ENDPOINT
+            endpoint
             + "/searchJSON?q={query}&maxRows={max_rows}&username={username}&orderby=relevance&featureClass=P&featureClass=A"
             + country_code_filter
         )
-        response = requests.get(
-            request_url.format(
-                query=query, max_rows=limit, username=random.choice(GEONAMES_USERS)
-            )
+        response = upstream.session.get(
+            request_url.format(query=query, max_rows=limit, username=user)
         )
+        return response.json()["geonames"]
+
+    try:
         results = []
-        for place in response.json()["geonames"]:
+        for place in hedged_geonames("search_geonames", request):
             name = place["toponymName"]
             results.append((GEONAMES_ID_PREFIX + str(place["geonameId"]), name))
         return results
     except Exception:
         log.info("Failed to execute search for: " + query, exc_info=True)
         return []
+
+
+@timed_upstream("search_geonames_nearby")
+def search_geonames_nearby(lat: float, lon: float) -> Optional[str]:
+    """Returns the geonames id (with GEONAMES_ID_PREFIX) of the place closest to
+    lat/lon or None if there is no place nearby.
+
+    Raises:
+        UpstreamError: If the request failed or geonames answered with an error
+    """
+    request_url = (
+        GEONAMES_ENDPOINT
+        + "/findNearbyPlaceNameJSON"
+        + "?lat={lat}&lng={lon}&maxRows=1&username={username}"
+    )
+    try:
+        response = upstream.session.get(
+            request_url.format(lat=lat, lon=lon, username=random.choice(GEONAMES_USERS))
+        )
+    except requests.RequestException as e:
+        raise UpstreamError(e)
+    try:
+        results = check_geonames_response(response)
+    except NotFoundError as e:
+        # Coordinates can't be unknown, so this is an error of the request.
+        raise UpstreamError(e)
+    if not results.get("geonames"):
+        log.info(f"No place found near: {lat}, {lon}")
+        return None
+    return GEONAMES_ID_PREFIX + str(results["geonames"][0]["geonameId"])
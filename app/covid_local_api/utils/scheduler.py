@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# Interval between refreshes (in seconds), which is randomly varied by +/- the jitter
+# (as fraction of the interval), so that workers don't refresh at the same time.
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", 86400))
+REFRESH_JITTER = float(os.getenv("REFRESH_JITTER", 0.1))
+
+# Delay before retrying a failed refresh, doubled after each failure.
+REFRESH_MIN_BACKOFF = float(os.getenv("REFRESH_MIN_BACKOFF", 60))
+REFRESH_MAX_BACKOFF = float(os.getenv("REFRESH_MAX_BACKOFF", 3600))
+
+# Lock file, which ensures that only one process per host refreshes at a time.
+REFRESH_LOCK_PATH = os.getenv(
+    "REFRESH_LOCK_PATH",
+    os.path.join(tempfile.gettempdir(), "covid-local-api-refresh.lock"),
+)
+
+
+class FileLock:
+    """Exclusive lock on a file, which is shared between all processes on a host
+    (does nothing on systems without fcntl)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, "a")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class RefreshScheduler:
+    """Runs `refresh` periodically in the event loop of the api (in a thread, so
+    requests are served meanwhile).
+
+    Refreshes are spread with a random jitter, retried with exponential backoff if
+    they fail and never run at the same time in several processes on the same host
+    (see REFRESH_LOCK_PATH). `refresh_now` triggers a refresh manually.
+
+    Args:
+        refresh (callable): The (blocking) function to run
+        interval (float): Seconds between refreshes
+        jitter (float): Random variation of the interval (as fraction of it)
+        min_backoff (float): Seconds before the first retry after a failure
+        max_backoff (float): Maximum seconds between retries
+        lock_path (str): Path of the lock file
+    """
+
+    def __init__(
+        self,
+        refresh,
+        interval: float = REFRESH_INTERVAL,
+        jitter: float = REFRESH_JITTER,
+        min_backoff: float = REFRESH_MIN_BACKOFF,
+        max_backoff: float = REFRESH_MAX_BACKOFF,
+        lock_path: str = REFRESH_LOCK_PATH,
+    ):
+        self.refresh = refresh
+        self.interval = interval
+        self.jitter = jitter
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.lock_path = lock_path
+        self.failures = 0
+        self.last_success = None
+        self.last_error = None
+        self._task = None
+        self._lock = None
+
+    def next_delay(self) -> float:
+        """Returns the seconds until the next refresh"""
+        if self.failures:
+            delay = min(self.max_backoff, self.min_backoff * 2 ** (self.failures - 1))
+        else:
+            delay = self.interval
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _refresh_locked(self):
+        with FileLock(self.lock_path):
+            self.refresh()
+
+    async def refresh_now(self) -> bool:
+        """Runs a refresh now (or waits for the one that is already running).
+
+        Returns:
+            bool: True if the refresh was successful
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            start = time.perf_counter()
+            try:
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self._refresh_locked
+                )
+            except Exception as e:
+                self.failures += 1
+                self.last_error = repr(e)
+                log.exception(f"Refresh failed ({self.failures} times in a row)")
+                return False
+            self.failures = 0
+            self.last_error = None
+            self.last_success = time.time()
+            log.info(f"Refresh took {time.perf_counter() - start:.1f}s")
+            return True
+
+    async def _run(self, initial_delay: float):
+        delay = initial_delay
+        while True:
+            await asyncio.sleep(delay)
+            await self.refresh_now()
+            delay = self.next_delay()
+            log.info(f"Next refresh in {delay:.0f}s")
+
+    def start(self, initial_delay: float = None):
+        """Starts the periodic refreshes (the first one after `initial_delay` or
+        `next_delay()` seconds)"""
+        if self._task is None:
+            if initial_delay is None:
+                initial_delay = self.next_delay()
+            self._task = asyncio.ensure_future(self._run(initial_delay))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,53 @@
+import json
+import math
+
+# Web mercator is only defined up to this latitude.
+MAX_LATITUDE = 85.0511287798
+
+EMPTY_TILE = json.dumps(
+    {"type": "FeatureCollection", "features": []}, separators=(",", ":")
+).encode()
+
+
+def lat_lon_to_tile(lat: float, lon: float, zoom: int) -> tuple:
+    """Returns the x/y index of the (slippy map) tile containing lat/lon at `zoom`"""
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    n = 2 ** zoom
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def point_feature(lat: float, lon: float, properties: dict) -> dict:
+    """Returns a GeoJSON point feature"""
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": properties,
+    }
+
+
+def render_tiles(features_by_zoom: dict) -> dict:
+    """Renders GeoJSON point features into z/x/y tiles.
+
+    Args:
+        features_by_zoom (dict): GeoJSON point features for each zoom level
+
+    Returns:
+        dict: Serialized GeoJSON FeatureCollection (as bytes) for each (z, x, y) tile
+            that contains at least one feature
+    """
+    tiles = {}
+    for zoom, features in features_by_zoom.items():
+        features_by_tile = {}
+        for feature in features:
+            lon, lat = feature["geometry"]["coordinates"]
+            x, y = lat_lon_to_tile(lat, lon, zoom)
+            features_by_tile.setdefault((zoom, x, y), []).append(feature)
+
+        for tile, tile_features in features_by_tile.items():
+            tiles[tile] = json.dumps(
+                {"type": "FeatureCollection", "features": tile_features},
+                separators=(",", ":"),
+            ).encode()
+    return tiles
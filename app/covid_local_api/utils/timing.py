@@ -0,0 +1,82 @@
+import contextlib
+import cProfile
+import functools
+import itertools
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+log = logging.getLogger(__name__)
+
+# Profile 1 in PROFILE_SAMPLE_RATE calls of profiled endpoints (0 disables profiling)
+# and write the stats to PROFILE_DIR (open them with e.g. snakeviz or pstats).
+PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Durations of the spans of the current request (None outside of requests).
+_spans = ContextVar("spans", default=None)
+_profile_counter = itertools.count(1)
+
+
+def start_spans() -> dict:
+    """Starts recording spans for the current request and returns the (mutable) dict
+    of span name -> duration in seconds."""
+    spans = {}
+    _spans.set(spans)
+    return spans
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Measures the duration of the block as span `name` of the current request.
+
+    Durations of spans with the same name are added up. Does nothing outside of
+    requests.
+    """
+    spans = _spans.get()
+    if spans is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0.0) + time.perf_counter() - start
+
+
+def server_timing_header(spans: dict, total: float) -> str:
+    """Formats the spans (and the total duration) as Server-Timing header value"""
+    metrics = [f"{name};dur={duration * 1000:.2f}" for name, duration in spans.items()]
+    metrics.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(metrics)
+
+
+def profiled(func):
+    """Decorator that profiles 1 in PROFILE_SAMPLE_RATE calls of `func` with cProfile
+    and dumps the stats to PROFILE_DIR.
+
+    Only works for sync functions, because cProfile only sees the current thread.
+    """
+    if PROFILE_SAMPLE_RATE <= 0:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        call_number = next(_profile_counter)
+        if call_number % PROFILE_SAMPLE_RATE != 0:
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(
+                PROFILE_DIR, f"{func.__name__}-{int(time.time())}-{call_number}.prof"
+            )
+            profile.dump_stats(path)
+            log.info("Wrote profile: " + path)
+
+    return wrapper
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from covid_local_api.utils import deadline
+
+log = logging.getLogger(__name__)
+
+# Transport for all requests to upstream services (geonames, osm, wikidata):
+# - live: send requests to the services
+# - record: send requests to the services and save the responses to
+#   UPSTREAM_FIXTURE_DIR
+# - replay: answer requests with the responses from UPSTREAM_FIXTURE_DIR (without
+#   network access), after UPSTREAM_LATENCY seconds (plus up to UPSTREAM_JITTER
+#   seconds) and with a 503 error for a share of UPSTREAM_ERROR_RATE of the requests
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "live")
+UPSTREAM_FIXTURE_DIR = os.getenv("UPSTREAM_FIXTURE_DIR", "upstream-fixtures")
+UPSTREAM_LATENCY = float(os.getenv("UPSTREAM_LATENCY", 0))
+UPSTREAM_JITTER = float(os.getenv("UPSTREAM_JITTER", 0))
+UPSTREAM_ERROR_RATE = float(os.getenv("UPSTREAM_ERROR_RATE", 0))
+
+# Number of connections that are kept open per host.
+UPSTREAM_POOL_SIZE = 32
+
+# Query parameters, which are not part of the fixture key (geonames users are chosen
+# randomly per request).
+IGNORED_PARAMS = {"username"}
+
+
+def fixture_key(method: str, url: str) -> str:
+    """Returns the file name of the fixture for a request (hash of the method and the
+    url with sorted query parameters)"""
+    parts = urlsplit(url)
+    params = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in IGNORED_PARAMS
+    )
+    normalized_url = urlunsplit(parts._replace(query=urlencode(params)))
+    return hashlib.sha1(f"{method} {normalized_url}".encode()).hexdigest() + ".json"
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Sends requests to the services and saves each response as a fixture"""
+
+    def __init__(self, fixture_dir: str, **kwargs):
+        super().__init__(**kwargs)
+        self.fixture_dir = fixture_dir
+        os.makedirs(fixture_dir, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        fixture = {
+            "method": request.method,
+            "url": request.url,
+            "status_code": response.status_code,
+            "content_type": response.headers.get("Content-Type"),
+            "body": response.content.decode("utf-8", errors="replace"),
+        }
+        path = os.path.join(self.fixture_dir, fixture_key(request.method, request.url))
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=4)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Answers requests with recorded fixtures, with simulated latency and errors.
+
+    Raises a ConnectionError for requests without fixture (like an unreachable
+    service).
+    """
+
+    def __init__(
+        self,
+        fixture_dir: str,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+    ):
+        super().__init__()
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def build_response(self, request, status_code, content, content_type=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers = CaseInsensitiveDict(
+            {"Content-Type": content_type} if content_type else {}
+        )
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def send(self, request, timeout=None, **kwargs):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if isinstance(timeout, tuple):
+            timeout = timeout[1]
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout(
+                f"Replayed request timed out: {request.url}", request=request
+            )
+        time.sleep(delay)
+
+        if random.random() < self.error_rate:
+            return self.build_response(request, 503, b"")
+
+        path = os.path.join(self.fixture_dir, fixture_key(request.method, request.url))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                fixture = json.load(f)
+        except FileNotFoundError:
+            raise requests.exceptions.ConnectionError(
+                f"No recorded response for: {request.url}", request=request
+            )
+        return self.build_response(
+            request,
+            fixture["status_code"],
+            fixture["body"].encode("utf-8"),
+            fixture["content_type"],
+        )
+
+    def close(self):
+        pass
+
+
+class DeadlineSession(requests.Session):
+    """Session, whose requests time out at the deadline of the current request to the
+    api (see utils/deadline.py)"""
+
+    def request(self, method, url, **kwargs):
+        kwargs["timeout"] = deadline.timeout(kwargs.get("timeout"))
+        return super().request(method, url, **kwargs)
+
+
+def create_session(
+    mode: str = UPSTREAM_MODE, fixture_dir: str = UPSTREAM_FIXTURE_DIR
+) -> requests.Session:
+    """Returns a requests session for upstream requests with the transport of
+    `mode` (live, record or replay)"""
+    if mode == "live":
+        adapter = HTTPAdapter(pool_maxsize=UPSTREAM_POOL_SIZE)
+    elif mode == "record":
+        adapter = RecordingAdapter(fixture_dir, pool_maxsize=UPSTREAM_POOL_SIZE)
+    elif mode == "replay":
+        adapter = ReplayAdapter(
+            fixture_dir, UPSTREAM_LATENCY, UPSTREAM_JITTER, UPSTREAM_ERROR_RATE
+        )
+    else:
+        raise ValueError(f"Unknown upstream mode: {mode}")
+
+    if mode != "live":
+        log.info(f"Upstream requests are in {mode} mode (fixtures: {fixture_dir})")
+    session = DeadlineSession()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Shared session for all upstream requests (keeps connections open between requests).
+session = create_session()
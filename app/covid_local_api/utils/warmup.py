@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+# File, in which the workers on a host persist how often places were requested (as
+# place name or geonames id), so that the caches can be warmed up after a restart.
+# Should be on a volume that survives deploys.
+WARMUP_SUMMARY_PATH = os.getenv(
+    "WARMUP_SUMMARY_PATH",
+    os.path.join(tempfile.gettempdir(), "covid-local-api-access-summary.json"),
+)
+
+# Seconds between saves of the access summary.
+WARMUP_SAVE_INTERVAL = float(os.getenv("WARMUP_SAVE_INTERVAL", 300))
+
+# Counts are halved after this many seconds, so that recent requests weigh more.
+WARMUP_HALF_LIFE = float(os.getenv("WARMUP_HALF_LIFE", 86400))
+
+# Number of most requested places to warm up and number of places that are resolved
+# at the same time (i.e. the maximum number of concurrent upstream requests).
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", 500))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", 4))
+
+# Maximum number of places in the summary file (the least requested are dropped).
+WARMUP_MAX_ENTRIES = 10000
+
+# Kinds of place queries in the summary.
+PLACE_NAME = "place_name"
+GEONAMES_ID = "geonames_id"
+
+
+class AccessSummary:
+    """Counts place queries and persists the counts to a json file, which is shared
+    by all processes on a host.
+
+    Each process adds its counts since the last save to the file (see `save`), so
+    `save` must not run in several processes at the same time (e.g. use
+    `scheduler.FileLock`).
+
+    Args:
+        path (str): Path of the json file
+        half_life (float): Seconds after which counts in the file are halved
+        max_entries (int): Maximum number of queries in the file
+    """
+
+    def __init__(
+        self,
+        path: str = WARMUP_SUMMARY_PATH,
+        half_life: float = WARMUP_HALF_LIFE,
+        max_entries: int = WARMUP_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.half_life = half_life
+        self.max_entries = max_entries
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, value):
+        """Counts a query for a place (`kind` is PLACE_NAME or GEONAMES_ID)"""
+        with self._lock:
+            self._counts[(kind, value)] += 1
+
+    def load(self) -> dict:
+        """Returns the summary from the file ({"saved_at": timestamp, "counts": [[kind,
+        value, count], ...]}) or an empty summary if it doesn't exist"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"saved_at": time.time(), "counts": []}
+
+    def save(self):
+        """Adds the counts since the last save to the file (after decaying the counts
+        in the file by their age)"""
+        with self._lock:
+            new_counts, self._counts = self._counts, Counter()
+
+        summary = self.load()
+        now = time.time()
+        decay = 0.5 ** (max(now - summary["saved_at"], 0) / self.half_life)
+        counts = Counter()
+        for kind, value, count in summary["counts"]:
+            counts[(kind, value)] = count * decay
+        counts.update(new_counts)
+
+        summary = {
+            "saved_at": now,
+            "counts": [
+                [kind, value, round(count, 3)]
+                for (kind, value), count in counts.most_common(self.max_entries)
+            ],
+        }
+        # Write to a temporary file first, so the file is never read half-written.
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+    def top(self, n: int) -> list:
+        """Returns the `n` most requested queries from the file as (kind, value)"""
+        return [(kind, value) for kind, value, _ in self.load()["counts"][:n]]
+
+
+def warm_up(queries: list, resolve, concurrency: int = WARMUP_CONCURRENCY) -> int:
+    """Resolves place queries with at most `concurrency` at the same time, so that
+    the upstream responses are cached.
+
+    Args:
+        queries (list): The (kind, value) pairs to resolve (see `AccessSummary.top`)
+        resolve (callable): Function that resolves a single query (kind, value)
+        concurrency (int): Maximum number of queries resolved in parallel
+
+    Returns:
+        int: The number of queries that were resolved without error
+    """
+    start = time.perf_counter()
+
+    def resolve_or_log(query):
+        try:
+            resolve(*query)
+            return True
+        except Exception:
+            log.debug(f"Warmup failed for: {query}", exc_info=True)
+            return False
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        resolved = sum(executor.map(resolve_or_log, queries))
+    log.info(
+        f"Warmed up {resolved} of {len(queries)} places in "
+        f"{time.perf_counter() - start:.1f}s"
+    )
+    return resolved
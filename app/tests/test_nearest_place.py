@@ -0,0 +1,60 @@
+import csv
+
+import pytest
+
+from covid_local_api import endpoints
+from covid_local_api.place_index import PartitionedPlaceIndex
+from covid_local_api.utils import upstream
+
+PLACES = [
+    # geonames_id, name, feature_class, lat, lon, hierarchy
+    (2921044, "Deutschland", "A", 51.5, 10.5, "2921044"),
+    (2950157, "Berlin", "A", 52.5, 13.4, "2950157 2921044"),
+    (6545310, "Mitte", "P", 52.52, 13.39, "6545310 2950157 2921044"),
+    (2922241, "Pankow", "P", 52.57, 13.4, "2922241 2950157 2921044"),
+]
+
+
+@pytest.fixture
+def place_index(tmp_path, monkeypatch):
+    with open(tmp_path / "DE_places.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [
+                "geonames_id",
+                "name",
+                "country_code",
+                "state",
+                "feature_class",
+                "lat",
+                "lon",
+                "hierarchy",
+            ]
+        )
+        for geonames_id, name, feature_class, lat, lon, hierarchy in PLACES:
+            writer.writerow(
+                [geonames_id, name, "DE", "Berlin", feature_class, lat, lon, hierarchy]
+            )
+    index = PartitionedPlaceIndex(str(tmp_path), pinned=["DE"])
+    index.preload()
+    monkeypatch.setattr(endpoints, "place_index", index)
+    return index
+
+
+@pytest.fixture
+def no_upstream(monkeypatch):
+    """Fails the test on any request to an upstream service"""
+
+    def request(method, url, **kwargs):
+        raise AssertionError(f"Unexpected upstream request: {method} {url}")
+
+    monkeypatch.setattr(upstream.session, "request", request)
+
+
+def test_lat_lon_is_resolved_without_upstream_request(place_index, no_upstream):
+    place = endpoints.find_place(lat=52.521, lon=13.391)
+    assert place.geonames_id == 6545310
+    assert place.search_provider == endpoints.LOCAL_SEARCH_PROVIDER
+
+    hierarchy = endpoints.get_hierarchy(place.geonames_id, place.country_code)
+    assert hierarchy == [6545310, 2950157, 2921044]
@@ -0,0 +1,100 @@
+import argparse
+import csv
+
+# This script converts a geonames.org country dump to the place index that the API
+# uses to resolve coordinates and hierarchies locally (without requesting geonames).
+# Download and unzip the dump for a country from here (e.g. DE.zip):
+# https://download.geonames.org/export/dump/
+#
+# Usage (from the scripts directory):
+# python geonames-to-places-csv.py DE.txt ../app/covid_local_api/data/DE_places.csv
+#
+# Each country gets its own file ({country_code}_places.csv), which the API loads on
+# first use (see PartitionedPlaceIndex in place_index.py).
+
+parser = argparse.ArgumentParser()
+parser.add_argument("dump_file", help="geonames dump file, e.g. DE.txt")
+parser.add_argument("output_file", help="csv file to write, e.g. DE_places.csv")
+args = parser.parse_args()
+
+# Only keep administrative areas (A) and populated places (P).
+FEATURE_CLASSES = ["A", "P"]
+ADMIN_FEATURE_CODES = ["ADM1", "ADM2", "ADM3", "ADM4"]
+COUNTRY_FEATURE_CODES = ["PCLI", "PCLD", "PCLF", "PCLS", "PCL"]
+
+# Read the dump file (see "geoname" table in the readme of the dump for the columns).
+features = []
+with open(args.dump_file, "r", encoding="utf-8") as f:
+    for line in f:
+        columns = line.rstrip("\n").split("\t")
+        if columns[6] not in FEATURE_CLASSES:
+            continue
+        features.append(
+            {
+                "geonames_id": columns[0],
+                "name": columns[1],
+                "lat": columns[4],
+                "lon": columns[5],
+                "feature_class": columns[6],
+                "feature_code": columns[7],
+                "country_code": columns[8],
+                "admin_codes": tuple(columns[10:14]),
+            }
+        )
+
+# Find the geonames ids of countries and administrative areas by their codes.
+countries = {}
+admin_areas = {}
+for feature in features:
+    if feature["feature_code"] in COUNTRY_FEATURE_CODES:
+        countries.setdefault(feature["country_code"], feature)
+    elif feature["feature_code"] in ADMIN_FEATURE_CODES:
+        level = ADMIN_FEATURE_CODES.index(feature["feature_code"]) + 1
+        key = (feature["country_code"],) + feature["admin_codes"][:level]
+        admin_areas.setdefault(key, feature)
+
+# Write each feature with its hierarchy (more local areas first).
+with open(args.output_file, "w", encoding="utf-8", newline="") as csvfile:
+    writer = csv.writer(csvfile, delimiter=",")
+    writer.writerow(
+        [
+            "geonames_id",
+            "name",
+            "country_code",
+            "state",
+            "feature_class",
+            "lat",
+            "lon",
+            "hierarchy",
+        ]
+    )
+
+    for feature in features:
+        hierarchy = [feature["geonames_id"]]
+        for level in range(len(ADMIN_FEATURE_CODES), 0, -1):
+            if not feature["admin_codes"][level - 1]:
+                continue
+            key = (feature["country_code"],) + feature["admin_codes"][:level]
+            if key in admin_areas:
+                hierarchy.append(admin_areas[key]["geonames_id"])
+        if feature["country_code"] in countries:
+            hierarchy.append(countries[feature["country_code"]]["geonames_id"])
+        # Remove duplicates (e.g. an administrative area is its own parent).
+        hierarchy = list(dict.fromkeys(hierarchy))
+
+        state = admin_areas.get(
+            (feature["country_code"], feature["admin_codes"][0]), {}
+        ).get("name", "")
+
+        writer.writerow(
+            [
+                feature["geonames_id"],
+                feature["name"],
+                feature["country_code"],
+                state,
+                feature["feature_class"],
+                feature["lat"],
+                feature["lon"],
+                " ".join(hierarchy),
+            ]
+        )
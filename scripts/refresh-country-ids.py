@@ -0,0 +1,38 @@
+import argparse
+import json
+
+from covid_local_api.utils.place_request_utils import (
+    COUNTRY_IDS_PATH,
+    load_country_ids,
+    map_countrycode_to_geonames,
+    map_countrycode_to_osm,
+)
+
+# This script regenerates the precomputed osm and geonames ids of countries, which
+# are used to resolve hierarchies without requesting nominatim for the country.
+# By default, it refreshes all countries that are already in the file.
+#
+# Usage: python refresh-country-ids.py [country codes, e.g. DE AT CH]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("country_codes", nargs="*", help="countries to add or refresh")
+parser.add_argument("--output", help="json file to write", default=COUNTRY_IDS_PATH)
+args = parser.parse_args()
+
+country_ids = load_country_ids(args.output)
+country_codes = sorted(
+    set(country_ids) | set(country_code.upper() for country_code in args.country_codes)
+)
+
+for country_code in country_codes:
+    osm_id = map_countrycode_to_osm(country_code)
+    geonames_id = map_countrycode_to_geonames(country_code)
+    if not osm_id or not geonames_id:
+        print(f"Failed to get ids for {country_code}, keeping old ids")
+        continue
+    country_ids[country_code] = {"geonames_id": geonames_id, "osm_id": osm_id}
+    print(f"{country_code}: {geonames_id}, {osm_id}")
+
+with open(args.output, "w") as f:
+    json.dump(country_ids, f, indent=4, sort_keys=True)
+    f.write("\n")